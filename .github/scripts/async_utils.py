@@ -0,0 +1,279 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+from utils import Utils
+from io_pump import REAP_INTERVAL
+from output_capture import new_capture
+from tracing import get_tracer, poll_with_rusage
+
+
+class CommandSpec:
+    """One command to run through AsyncUtils.gather"""
+
+    def __init__(
+        self,
+        command: Union[str, List[str]],
+        cwd: Optional[Union[str, Path]] = None,
+        env: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+        log_name: Optional[str] = None,
+        check: bool = True,
+        silent: bool = False,
+        label: Optional[str] = None,
+        capture: Optional[str] = None,
+        consumers: Optional[List] = None,
+    ):
+        self.command = command
+        self.cwd = cwd
+        self.env = env
+        self.timeout = timeout
+        self.log_name = log_name
+        self.check = check
+        self.silent = silent
+        self.label = label or log_name
+        self.capture = capture
+        self.consumers = consumers
+
+
+class _PrefixedEcho:
+    """Echo output line by line with a label so concurrent commands stay readable.
+
+    `label` is a string or a callable returning the label for the lines at
+    hand (None for no prefix), asked again whenever lines are echoed.
+    """
+
+    def __init__(self, utils: Utils, stream_type: str, label: Union[str, Callable[[], Optional[str]]]):
+        self.utils = utils
+        self.stream_type = stream_type
+        self.label = label
+        self._partial = b""
+
+    @property
+    def prefix(self) -> bytes:
+        label = self.label() if callable(self.label) else self.label
+        return f"[{label}] ".encode() if label else b""
+
+    def write(self, data: bytes) -> None:
+        data = self._partial + data
+        head, sep, self._partial = data.rpartition(b"\n")
+        if sep:
+            prefix = self.prefix
+            lines = (head + sep).splitlines(keepends=True)
+            self.utils._echo(b"".join(prefix + line for line in lines), self.stream_type)
+
+    def close(self) -> None:
+        if self._partial:
+            self.utils._echo(self.prefix + self._partial + b"\n", self.stream_type)
+            self._partial = b""
+
+
+class AsyncUtils:
+    """asyncio command engine on top of Utils.
+
+    Commands keep the run_command semantics (shell handling, real-time echo,
+    stdout/stderr log sinks, CalledProcessError on failure) but independent
+    commands can overlap:
+
+        async_utils = AsyncUtils(limit=2)
+        async_utils.run_commands_parallel([
+            CommandSpec("yarn build", cwd=zh_doc, log_name="doc-zh"),
+            CommandSpec("yarn build", cwd=en_doc, log_name="doc-en"),
+        ])
+
+    At most `limit` commands run at the same time. Each command runs in its
+    own process group, so a timeout kills what the shell started as well.
+    Commands are reaped with os.wait4 rather than by asyncio's child
+    watcher, so their trace spans carry CPU time and peak RSS like those of
+    Utils.run_command.
+    """
+
+    def __init__(self, utils: Optional[Utils] = None, limit: int = 4):
+        self.utils = utils or Utils()
+        self.limit = max(1, limit)
+
+    @staticmethod
+    def _kill_group(proc) -> None:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    async def _pump(self, reader: asyncio.StreamReader, handler) -> None:
+        while True:
+            data = await reader.read(64 * 1024)
+            if not data:
+                break
+            handler(data)
+
+    @staticmethod
+    async def _reap(proc: subprocess.Popen):
+        """Wait for `proc` without blocking the loop, return its rusage"""
+        while True:
+            reaped, rusage = poll_with_rusage(proc)
+            if reaped:
+                return rusage
+            await asyncio.sleep(REAP_INTERVAL)
+
+    @staticmethod
+    async def _reader(pipe):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        return reader, transport
+
+    async def run_command_async(
+        self,
+        command: Union[str, List[str]],
+        cwd: Optional[Union[str, Path]] = None,
+        env: Optional[Dict[str, str]] = None,
+        check: bool = True,
+        silent: bool = False,
+        timeout: Optional[float] = None,
+        log_name: Optional[str] = None,
+        label: Union[str, Callable[[], Optional[str]], None] = None,
+        capture: Optional[str] = None,
+        consumers: Optional[List] = None,
+    ) -> subprocess.CompletedProcess:
+        """
+        Async counterpart of Utils.run_command.
+        - `timeout` kills the command and raises subprocess.TimeoutExpired.
+        - `label` prefixes every echoed line, which keeps parallel output readable;
+          a callable is asked for the label each time lines are echoed.
+        - `capture` and `consumers` work as in Utils.run_command.
+        """
+        cwd = str(self.utils.path(cwd)) if cwd else os.getcwd()
+        env_out = env or os.environ
+        proc_args, use_shell = self.utils._prepare_command(command)
+
+        print(f"Running command: {proc_args} (cwd={cwd})")
+        sys.stdout.flush()
+        start = time.time()
+        rusage = None
+        # a plain Popen, asyncio's child watcher would reap it without rusage
+        proc = subprocess.Popen(
+            proc_args, cwd=cwd, env=env_out, shell=use_shell,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            start_new_session=True,
+        )
+        transports = []
+
+        stdout_sink, stderr_sink = self.utils.log_sinks.open_for(proc_args, log_name)
+        captures = [new_capture(capture), new_capture(capture)]
+        echoes = []
+        handlers = []
+        for stream_type, sink, stream_capture in zip(("stdout", "stderr"), (stdout_sink, stderr_sink), captures):
+            if label and not silent:
+                echo = _PrefixedEcho(self.utils, stream_type, label)
+                echoes.append(echo)
+                handlers.append(self._labelled_handler(sink, echo, stream_capture))
+            else:
+                handlers.append(self.utils._output_handler(stream_type, silent, sink, stream_capture))
+        handlers[0] = self.utils._consumer_handler(
+            handlers[0], consumers, lambda pid=proc.pid: self.utils.stop_process_tree(pid)
+        )
+
+        async def pump_and_reap():
+            readers = []
+            for pipe in (proc.stdout, proc.stderr):
+                reader, transport = await self._reader(pipe)
+                readers.append(reader)
+                transports.append(transport)
+            await asyncio.gather(self._pump(readers[0], handlers[0]), self._pump(readers[1], handlers[1]))
+            # both streams are closed, the process is about to exit
+            return await self._reap(proc)
+
+        try:
+            try:
+                rusage = await asyncio.wait_for(pump_and_reap(), timeout)
+            except asyncio.TimeoutError:
+                self._kill_group(proc)
+                rusage = await self._reap(proc)
+                raise subprocess.TimeoutExpired(proc_args, timeout)
+            except asyncio.CancelledError:
+                # gather cancels the others once a command failed, do not leave this one running
+                self._kill_group(proc)
+                # reap it while the loop is still running
+                rusage = await asyncio.shield(self._reap(proc))
+                raise
+        finally:
+            for transport in transports:
+                transport.close()
+            for pipe in (proc.stdout, proc.stderr):
+                pipe.close()
+            for echo in echoes:
+                echo.close()
+            stdout_sink.close()
+            stderr_sink.close()
+            if not silent:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            get_tracer().add_command(proc_args, cwd, start, time.time(), proc.returncode, rusage)
+
+        stdout, stderr = (c.getvalue() if c else None for c in captures)
+        if check and proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, proc_args, output=stdout, stderr=stderr)
+
+        return subprocess.CompletedProcess(args=proc_args, returncode=proc.returncode, stdout=stdout, stderr=stderr)
+
+    def _labelled_handler(self, sink, echo: _PrefixedEcho, capture=None):
+        def handle(data: bytes) -> None:
+            sink.write(data)
+            if capture is not None:
+                capture.write(data)
+            echo.write(data)
+        return handle
+
+    async def gather(
+        self,
+        specs: List[CommandSpec],
+        limit: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> list:
+        """Run commands concurrently, at most `limit` at a time, results in input order"""
+        semaphore = asyncio.Semaphore(max(1, limit or self.limit))
+
+        async def run_one(spec: CommandSpec):
+            async with semaphore:
+                return await self.run_command_async(
+                    spec.command,
+                    cwd=spec.cwd,
+                    env=spec.env,
+                    check=spec.check,
+                    silent=spec.silent,
+                    timeout=spec.timeout,
+                    log_name=spec.log_name,
+                    label=spec.label,
+                    capture=spec.capture,
+                    consumers=spec.consumers,
+                )
+
+        tasks = [asyncio.ensure_future(run_one(spec)) for spec in specs]
+        if return_exceptions:
+            return await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            # the first failure ends the batch, stop the commands still running
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    def run_command(self, command: Union[str, List[str]], **kwargs) -> subprocess.CompletedProcess:
+        """Synchronous facade of run_command_async"""
+        return asyncio.run(self.run_command_async(command, **kwargs))
+
+    def run_commands_parallel(
+        self,
+        specs: List[CommandSpec],
+        limit: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> list:
+        """Synchronous facade of gather for callers that are not async themselves"""
+        return asyncio.run(self.gather(specs, limit=limit, return_exceptions=return_exceptions))
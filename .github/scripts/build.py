@@ -1,6 +1,12 @@
+import argparse
 import os
 import platform
 from utils import Utils
+from async_utils import AsyncUtils, CommandSpec
+from step_graph import StepGraph
+from tracing import get_tracer
+from proc_table import ensure_job_marker
+from step_cache import add_no_cache_argument, apply_no_cache_argument
 import shutil
 import subprocess
 
@@ -50,22 +56,26 @@ class TestBuild:
     
     def docker_build(self):
         """Build TDinternal repo in docker, just for linux platform"""
-        cmds = [
-            'date',
-            f'rm -rf {self.wkc}/debug',
-            f'rm -rf {self.wkc}/../../debugSan',
-            f'rm -rf {self.wkc}/../../debugNoSan',
-            f'cd {self.wkc}/test/ci && time ./container_build.sh -w {self.wkdir} -e -b {self.target_branch}'
-        ]
-        self.utils.run_commands(cmds)
+        graph = StepGraph(self.utils)
+        graph.add('date', 'date')
+        graph.add('clean-debug', f'rm -rf {self.wkc}/debug')
+        graph.add('clean-debugSan', f'rm -rf {self.wkc}/../../debugSan')
+        graph.add('clean-debugNoSan', f'rm -rf {self.wkc}/../../debugNoSan')
+        graph.add(
+            'container-build',
+            f'time ./container_build.sh -w {self.wkdir} -e -b {self.target_branch}',
+            cwd=f'{self.wkc}/test/ci',
+            deps=['clean-debug', 'clean-debugSan', 'clean-debugNoSan'],
+        )
+        graph.run()
 
     def doc_build(self):
-        # build chinese doc
+        # build chinese and english doc concurrently, they are independent repos
         cmd = 'yarn install && yarn ass local && yarn build'
-        self.utils.run_command(cmd, cwd=f'{self.wkdir}/{self.ZH_DOC_REPO}')
-
-        # build english doc
-        self.utils.run_command(cmd, cwd=f'{self.wkdir}/{self.EN_DOC_REPO}')
+        AsyncUtils(self.utils, limit=2).run_commands_parallel([
+            CommandSpec(cmd, cwd=f'{self.wkdir}/{self.ZH_DOC_REPO}', log_name='doc-zh'),
+            CommandSpec(cmd, cwd=f'{self.wkdir}/{self.EN_DOC_REPO}', log_name='doc-en'),
+        ])
 
     def _vcvars_env(self, vcvars_path: str, arch: str) -> dict:
         cmd = f'{vcvars_path} {arch} && set'
@@ -88,36 +98,49 @@ class TestBuild:
             if (len(pair) >= 2):
                 os.environ[pair[0]] = pair[1]
 
-    def repo_build(self, install_dependencies=False):
-        linux_cmds = [
-            f'cd {self.wk} && rm -rf debug && mkdir debug && cd debug',
-            f'cd {self.wk}/debug && cmake .. -DBUILD_TOOLS=true \
+    def _linux_build_graph(self) -> StepGraph:
+        graph = StepGraph(self.utils)
+        graph.add('prepare-debug', 'rm -rf debug && mkdir debug', cwd=self.wk)
+        graph.add(
+            'cmake',
+            'cmake .. -DBUILD_TOOLS=true \
                 -DBUILD_KEEPER=true \
                 -DBUILD_HTTP=false \
                 -DBUILD_TEST=true \
                 -DWEBSOCKET=true \
                 -DCMAKE_BUILD_TYPE=Release \
                 -DBUILD_DEPENDENCY_TESTS=false',
-            f'cd {self.wk}/debug && make -j 4 && sudo make install',
-            'which taosd',
-            'which taosadapter',
-            'which taoskeeper'
-        ]
-        mac_cmds = [
-            'date',
-            f'cd {self.wk} && rm -rf debug && mkdir debug && cd {self.wk}/debug',
-            'echo $PATH',
-            'echo "PATH=/opt/homebrew/bin:$PATH" >> $GITHUB_ENV',
-            f'cd {self.wk}/debug && cmake .. -DBUILD_TEST=true -DBUILD_HTTPS=false -DBUILD_TOOLS=true -DCMAKE_BUILD_TYPE=Release && make -j10'
-        ]
+            cwd=f'{self.wk}/debug',
+            deps=['prepare-debug'],
+        )
+        graph.add('make-install', 'make -j 4 && sudo make install', cwd=f'{self.wk}/debug', deps=['cmake'])
+        for binary in ('taosd', 'taosadapter', 'taoskeeper'):
+            graph.add(f'which-{binary}', f'which {binary}', deps=['make-install'])
+        return graph
+
+    def _mac_build_graph(self) -> StepGraph:
+        graph = StepGraph(self.utils)
+        graph.add('date', 'date')
+        graph.add('prepare-debug', 'rm -rf debug && mkdir debug', cwd=self.wk)
+        graph.add('show-path', 'echo $PATH')
+        graph.add('export-path', 'echo "PATH=/opt/homebrew/bin:$PATH" >> $GITHUB_ENV')
+        graph.add(
+            'cmake-make',
+            'cmake .. -DBUILD_TEST=true -DBUILD_HTTPS=false -DBUILD_TOOLS=true -DCMAKE_BUILD_TYPE=Release && make -j10',
+            cwd=f'{self.wk}/debug',
+            deps=['prepare-debug'],
+        )
+        return graph
+
+    def repo_build(self, install_dependencies=False):
         if self.platform == 'linux':
             if install_dependencies:
                 self.utils.install_dependencies('linux')
-            self.utils.run_commands(linux_cmds)
+            self._linux_build_graph().run()
         elif self.platform == 'darwin':
             if install_dependencies:
                 self.utils.install_dependencies('macOS')
-            self.utils.run_commands(mac_cmds)
+            self._mac_build_graph().run()
         elif self.platform == 'windows':
             debug_dir = os.path.join(self.wk, 'debug')
             if os.path.isdir(debug_dir):
@@ -148,5 +171,10 @@ class TestBuild:
             raise ValueError(f"Invalid build type: {self.build_type}")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build TDengine, the docs or the docker image')
+    add_no_cache_argument(parser)
+    apply_no_cache_argument(parser.parse_args())
+    ensure_job_marker()
     build = TestBuild()
-    build.run()
+    with get_tracer().span(f'build:{build.build_type}'):
+        build.run()
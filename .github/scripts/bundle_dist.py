@@ -0,0 +1,133 @@
+import argparse
+import hashlib
+import os
+import re
+import shlex
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+from output_capture import CAPTURE_FULL
+from utils import Utils
+
+DEFAULT_BUNDLE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "taos-ci", "bundles")
+# full object ids of SHA-1 and SHA-256 repositories
+OBJECT_ID = re.compile(r"^(?:[0-9a-f]{40}|[0-9a-f]{64})$")
+
+
+def pr_merge_ref(pr_number) -> str:
+    """Local ref the coordinator keeps the PR merge commit under"""
+    return f"refs/ci/pr/{pr_number}/merge"
+
+
+class BundleBuilder:
+    """Thin git bundles of a few refs of one coordinator repository.
+
+    The coordinator fetches once; every remote host then gets a bundle with
+    only the objects it lacks. A host reports its own tips with
+    probe_command(), those known here become the bundle's prerequisites, so
+    `git bundle verify` always passes on that host and nothing is fetched
+    from GitHub there. Hosts with the same tips share one bundle:
+
+        builder = BundleBuilder(utils, wk, ["refs/remotes/origin/main", pr_merge_ref(pr)], bundle_dir)
+        tips = parse_probe(pool.execute(host, builder.probe_command(remote_repo))[1])
+        path = builder.bundle_for(tips)      # None when the host has everything
+        for name, command in builder.apply_commands(remote_repo, remote_bundle if path else None): ...
+        # last step of the plan
+        for name, command in builder.cleanup_commands(remote_bundle if path else None): ...
+
+    Every command can run again after a success or a failure, as RemotePlan
+    expects: the bundle is removed only at the end, and a host whose bundle
+    is gone but which has all target commits skips the fetch.
+    """
+
+    def __init__(self, utils: Utils, repo_path: Union[str, Path], refnames: Iterable[str], bundle_dir: Union[str, Path, None] = None):
+        self.utils = utils
+        self.repo_path = str(repo_path)
+        self.bundle_dir = str(bundle_dir or os.getenv("CI_BUNDLE_DIR") or DEFAULT_BUNDLE_DIR)
+        # refname -> commit the hosts are moved to
+        self.refs: Dict[str, str] = {refname: self._git("rev-parse", "--verify", f"{refname}^{{commit}}").strip() for refname in refnames}
+        self._bundles: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+
+    def _git(self, *args, check: bool = True) -> str:
+        result = self.utils.run_command(["git", *args], cwd=self.repo_path, check=check, silent=True, capture=CAPTURE_FULL)
+        return (result.stdout or "") if result.returncode == 0 else ""
+
+    def probe_command(self, remote_repo: str) -> str:
+        """Remote command printing the host's commits of HEAD and the shipped refs;
+        it fails only if the repository is missing, a ref the host lacks is skipped"""
+        refs = " ".join(shlex.quote(f"{refname}^{{commit}}") for refname in ["HEAD", *self.refs])
+        return f"cd {remote_repo} && {{ for ref in {refs}; do git rev-parse -q --verify \"$ref\" || true; done; }}"
+
+    def basis(self, host_tips: Iterable[str]) -> List[str]:
+        """The host tips that exist here, usable as bundle prerequisites"""
+        known = []
+        for tip in sorted(set(host_tips)):
+            if self._git("cat-file", "-t", tip, check=False).strip() == "commit":
+                known.append(tip)
+        return known
+
+    def bundle_for(self, host_tips: Iterable[str]) -> Optional[str]:
+        """Path of a bundle with everything the refs need beyond `host_tips`, None if nothing"""
+        basis = self.basis(host_tips)
+        key = hashlib.sha256(" ".join(sorted(self.refs.values()) + ["--not"] + basis).encode()).hexdigest()[:16]
+        with self._lock:
+            if key in self._bundles:
+                return self._bundles[key]
+            count = self._git("rev-list", "--count", *self.refs.values(), "--not", *basis, "--").strip()
+            path = None
+            if count and int(count) > 0:
+                os.makedirs(self.bundle_dir, exist_ok=True)
+                path = os.path.join(self.bundle_dir, f"{os.path.basename(self.repo_path)}-{key}.bundle")
+                if not os.path.exists(path):
+                    tmp_path = f"{path}.{os.getpid()}.tmp"
+                    rev_args = [*self.refs, *(f"^{tip}" for tip in basis)]
+                    self.utils.run_command(["git", "bundle", "create", tmp_path, *rev_args], cwd=self.repo_path, silent=True)
+                    os.replace(tmp_path, path)
+                print(f"Bundle {path}: {count} commits, {os.path.getsize(path)} bytes, {len(basis)} prerequisites")
+            self._bundles[key] = path
+            return path
+
+    def apply_commands(self, remote_repo: str, remote_bundle: Optional[str]) -> List[tuple]:
+        """(step name, command) pairs moving the remote refs to the coordinator's commits"""
+        commands = []
+        if remote_bundle:
+            have_targets = " && ".join(
+                f"git cat-file -e {commit}^{{commit}}" for commit in sorted(set(self.refs.values()))
+            )
+            commands.append((
+                "apply-bundle",
+                f"cd {remote_repo} && if [ -f {remote_bundle} ]; then "
+                f"git bundle verify -q {remote_bundle} && git fetch -q {remote_bundle} '+refs/*:refs/*'; "
+                f"else {have_targets}; fi",
+            ))
+        update_refs = " && ".join(f"git update-ref {refname} {commit}" for refname, commit in self.refs.items())
+        commands.append(("update-refs", f"cd {remote_repo} && {update_refs}"))
+        return commands
+
+    def cleanup_commands(self, remote_bundle: Optional[str]) -> List[tuple]:
+        """(step name, command) pairs removing the uploaded bundle once the plan is through"""
+        return [("remove-bundle", f"rm -f {remote_bundle}")] if remote_bundle else []
+
+
+def parse_probe(output: str) -> List[str]:
+    """Commit ids in the output of probe_command(), other lines are ignored"""
+    return [line.strip() for line in output.splitlines() if OBJECT_ID.match(line.strip())]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a thin bundle of refs for a host with the given tips")
+    parser.add_argument("repo")
+    parser.add_argument("refs", nargs="+")
+    parser.add_argument("--have", action="append", default=[], help="commit the host already has")
+    parser.add_argument("--bundle-dir", default=None)
+    args = parser.parse_args()
+
+    builder = BundleBuilder(Utils(), args.repo, args.refs, args.bundle_dir)
+    path = builder.bundle_for(args.have)
+    print(path or "host is up to date, no bundle needed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+from typing import Dict, Iterable, List, Optional
+
+from case_registry import extract_case_path, is_active_task_line
+from duration_store import PASS
+
+CHANGED = 0
+RECENTLY_FAILED = 1
+FLAKY = 2
+REST = 3
+TIER_NAMES = {CHANGED: "changed", RECENTLY_FAILED: "recently failed", FLAKY: "flaky", REST: "rest"}
+
+
+class CaseOrder:
+    """Order task lines so the likeliest failures run first.
+
+    Cases changed in the PR come first, then cases whose last run failed,
+    then cases that failed at least once in their recent history (flaky),
+    each group most failing first, then everything else in task file order.
+
+        order = CaseOrder(changed_cases, store.outcome_history(branch))
+        task_lines = order.order(task_lines)
+    """
+
+    def __init__(self, changed_cases: Iterable[str] = (), history: Optional[Dict[str, List[str]]] = None):
+        self.changed_cases = set(changed_cases)
+        # case -> outcomes, newest first
+        self.history = history or {}
+
+    def failure_rate(self, case: str) -> float:
+        outcomes = self.history.get(case)
+        if not outcomes:
+            return 0.0
+        return sum(1 for outcome in outcomes if outcome != PASS) / len(outcomes)
+
+    def tier(self, case: str) -> int:
+        if case in self.changed_cases:
+            return CHANGED
+        outcomes = self.history.get(case)
+        if outcomes and outcomes[0] != PASS:
+            return RECENTLY_FAILED
+        if outcomes and any(outcome != PASS for outcome in outcomes):
+            return FLAKY
+        return REST
+
+    def order(self, task_lines: List[str]) -> List[str]:
+        """Stable reordering of the active task lines; comments are dropped"""
+        keyed = []
+        for position, line in enumerate(task_lines):
+            if not is_active_task_line(line):
+                continue
+            case = extract_case_path(line)
+            tier = self.tier(case)
+            rate = self.failure_rate(case) if tier in (RECENTLY_FAILED, FLAKY) else 0.0
+            keyed.append((tier, -rate, position, line))
+        keyed.sort()
+        return [item[3] for item in keyed]
+
+    def summary(self, task_lines: List[str]) -> Dict[str, int]:
+        counts = {name: 0 for name in TIER_NAMES.values()}
+        for line in task_lines:
+            if is_active_task_line(line):
+                counts[TIER_NAMES[self.tier(extract_case_path(line))]] += 1
+        return counts
+
+    def prioritized(self, task_lines: List[str]) -> int:
+        """How many lines were moved ahead of the rest"""
+        counts = self.summary(task_lines)
+        return sum(count for name, count in counts.items() if name != TIER_NAMES[REST])
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import shlex
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "taos-ci", "case-registry")
+# bump when the parsing rules change so stale caches are ignored
+PARSER_VERSION = 1
+
+LINUX = "linux"
+WINDOWS = "windows"
+MAC = "mac"
+
+
+def is_active_task_line(line: str) -> bool:
+    stripped = line.strip()
+    return bool(stripped) and not stripped.startswith("#")
+
+
+def normalize_case_token(token: str) -> str:
+    normalized = token.strip().strip('"\'').replace("\\", "/")
+    if normalized.startswith("./"):
+        normalized = normalized[2:]
+    return normalized
+
+
+def extract_case_path(line: str) -> str:
+    """Return the case path referenced by a task line, or "" if there is none"""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return ""
+
+    parts = [part.strip() for part in line.split(",", 4)]
+    if len(parts) < 5:
+        return ""
+
+    case_path_field = normalize_case_token(parts[3])
+    if case_path_field and case_path_field != ".":
+        if case_path_field.startswith("cases/"):
+            return case_path_field
+        if case_path_field.startswith(("tsim/", "sim/")):
+            return case_path_field
+
+    case_cmd = parts[4]
+    # shlex is only needed when the command quotes or escapes something
+    if any(ch in case_cmd for ch in "'\"\\"):
+        cmd_parts = shlex.split(case_cmd)
+    else:
+        cmd_parts = case_cmd.split()
+
+    for token in cmd_parts:
+        normalized = normalize_case_token(token)
+        if normalized.startswith("--tsim="):
+            tsim_path = normalize_case_token(normalized.split("=", 1)[1])
+            if tsim_path:
+                return tsim_path
+        if "cases/" in normalized and normalized.endswith((".py", ".sh")):
+            return normalized[normalized.index("cases/"):]
+        if normalized.startswith(("tsim/", "sim/")) and normalized.endswith(".sim"):
+            return normalized
+
+    return ""
+
+
+class CaseRegistry:
+    """Index of every case across the platform task sources.
+
+    All sources (cases.task, win_cases.task and the mac case list) are parsed
+    once into `case path -> platform -> task lines`. The parsed entries of a
+    task file are cached on disk keyed by the file's content hash, so an
+    unchanged file is never re-parsed:
+
+        registry = CaseRegistry()
+        registry.load_task_file(LINUX, cases_task_path)
+        registry.load_task_file(WINDOWS, win_cases_task_path)
+        registry.add_entries(MAC, mac_case_commands)
+        selection = registry.select(changed_cases)
+    """
+
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None):
+        self.cache_dir = str(cache_dir or os.getenv("CI_CASE_REGISTRY_CACHE") or DEFAULT_CACHE_DIR)
+        self.index: Dict[str, Dict[str, List[str]]] = {}
+        self.platforms: List[str] = []
+
+    def _cache_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def _parse(self, content: str) -> List[Tuple[str, str]]:
+        entries = []
+        for raw_line in content.splitlines():
+            if not is_active_task_line(raw_line):
+                continue
+            case_path = extract_case_path(raw_line)
+            if case_path:
+                entries.append((case_path, raw_line))
+        return entries
+
+    def parse_task_file(self, task_path: Union[str, Path]) -> List[Tuple[str, str]]:
+        """Return [(case_path, task_line)] of a task file, using the on-disk cache"""
+        with open(task_path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data + f"\0v{PARSER_VERSION}".encode()).hexdigest()
+        cache_path = self._cache_path(digest)
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                return [tuple(entry) for entry in json.load(f)]
+        except (OSError, ValueError):
+            pass
+
+        try:
+            content = data.decode("utf-8")
+        except UnicodeDecodeError:
+            content = data.decode("latin-1")
+        entries = self._parse(content)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, separators=(",", ":"))
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Failed to write case registry cache {cache_path}: {e}")
+        return entries
+
+    def add_entries(self, platform: str, entries: Iterable[Tuple[str, str]]) -> None:
+        """Register (case_path, task_line_or_command) pairs for a platform"""
+        if platform not in self.platforms:
+            self.platforms.append(platform)
+        for case_path, line in entries:
+            self.index.setdefault(case_path, {}).setdefault(platform, []).append(line)
+
+    def load_task_file(self, platform: str, task_path: Union[str, Path]) -> None:
+        if not os.path.exists(task_path):
+            print(f"Task file not found, skip {platform} cases: {task_path}")
+            if platform not in self.platforms:
+                self.platforms.append(platform)
+            return
+        self.add_entries(platform, self.parse_task_file(task_path))
+
+    def lines_for(self, case_path: str, platform: str) -> List[str]:
+        return self.index.get(case_path, {}).get(platform, [])
+
+    def select(self, selected_cases: Iterable[str]) -> Dict[str, Dict[str, object]]:
+        """For every platform, the deduplicated lines of `selected_cases` and the cases matched"""
+        result = {
+            platform: {"lines": [], "matched_cases": set()} for platform in self.platforms
+        }
+        seen = {platform: set() for platform in self.platforms}
+        for case_path in sorted(set(selected_cases)):
+            for platform, lines in self.index.get(case_path, {}).items():
+                result[platform]["matched_cases"].add(case_path)
+                for line in lines:
+                    if line not in seen[platform]:
+                        seen[platform].add(line)
+                        result[platform]["lines"].append(line)
+        return result
+
+    def write_task_files(
+        self,
+        selection: Dict[str, Dict[str, object]],
+        targets: Dict[str, Union[str, Path]],
+    ) -> Dict[str, List[str]]:
+        """Write the selected lines of each platform to its target task file in one pass"""
+        written = {}
+        for platform, target in targets.items():
+            lines = selection.get(platform, {}).get("lines", [])
+            if not lines:
+                written[platform] = []
+                continue
+            with open(target, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            written[platform] = lines
+        return written
+
+
+def _bench(lines: int = 50_000):
+    """Compare per-platform re-parsing with shlex against the registry"""
+    import tempfile
+
+    case_names = [f"cases/{i % 90:02d}-Group/test_case_{i}.py" for i in range(lines)]
+    content = "\n".join(
+        f",,y,.,./ci/pytest.sh pytest {name} -N 3 --replica 3" if i % 7 else f"#,,y,.,./ci/pytest.sh pytest {name}"
+        for i, name in enumerate(case_names)
+    ) + "\n"
+    selected = set(case_names[::500])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        linux_task = os.path.join(tmp, "cases.task")
+        win_task = os.path.join(tmp, "win_cases.task")
+        for path in (linux_task, win_task):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+
+        start = time.perf_counter()
+        for path in (linux_task, win_task):
+            index = {}
+            with open(path, encoding="utf-8") as f:
+                for raw_line in f.read().splitlines():
+                    if not is_active_task_line(raw_line):
+                        continue
+                    parts = [part.strip() for part in raw_line.split(",", 4)]
+                    for token in shlex.split(parts[4]):
+                        normalized = normalize_case_token(token)
+                        if "cases/" in normalized and normalized.endswith(".py"):
+                            index.setdefault(normalized, []).append(raw_line)
+                            break
+            [index.get(case) for case in sorted(selected)]
+        legacy = time.perf_counter() - start
+
+        timings = []
+        for _ in range(2):  # cold, then warm on-disk cache
+            start = time.perf_counter()
+            registry = CaseRegistry(cache_dir=os.path.join(tmp, "cache"))
+            registry.load_task_file(LINUX, linux_task)
+            registry.load_task_file(WINDOWS, win_task)
+            registry.select(selected)
+            timings.append(time.perf_counter() - start)
+
+    print(f"{lines} task lines, {len(selected)} selected cases")
+    print(f"  per-platform shlex parse: {legacy * 1000:8.1f} ms")
+    print(f"  registry, cold cache:     {timings[0] * 1000:8.1f} ms")
+    print(f"  registry, warm cache:     {timings[1] * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    _bench(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
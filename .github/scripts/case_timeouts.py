@@ -0,0 +1,118 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from case_registry import extract_case_path, is_active_task_line
+from duration_store import PASS
+
+DEFAULT_FACTOR = 3.0
+DEFAULT_FLOOR = 300.0
+DEFAULT_CEILING = 3600.0
+# fewer runs than this give no reliable p99, such cases keep run.sh's own timeout
+DEFAULT_MIN_RUNS = 5
+# seconds between SIGTERM and SIGKILL of a case over budget
+KILL_AFTER = 30
+
+# commands that are more than one simple command cannot be wrapped by timeout(1)
+_SHELL_OPERATORS = re.compile(r"&&|\|\||[;|`]|\$\(")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+class CaseTimeouts:
+    """Per-case time budgets from the duration history.
+
+    The budget of a case is its p99 duration times `factor`, clamped to
+    [floor, ceiling]. Budgets are embedded in the generated task files by
+    wrapping the case command with timeout(1), so a hung case is cut after
+    its own budget instead of eating the whole run:
+
+        timeouts = CaseTimeouts(store.estimates(cases, branch, q=0.99), run_counts)
+        task_lines = timeouts.apply(task_lines)
+        ...
+        for case, budget, duration in timeouts.killed(results): ...
+
+    Settings: CI_CASE_TIMEOUT_FACTOR (0 disables), CI_CASE_TIMEOUT_FLOOR,
+    CI_CASE_TIMEOUT_CEILING and CI_CASE_TIMEOUT_MIN_RUNS.
+    """
+
+    def __init__(
+        self,
+        p99: Dict[str, float],
+        run_counts: Optional[Dict[str, int]] = None,
+        factor: Optional[float] = None,
+        floor: Optional[float] = None,
+        ceiling: Optional[float] = None,
+        min_runs: Optional[int] = None,
+    ):
+        self.p99 = p99
+        self.run_counts = run_counts or {}
+        self.factor = _env_float("CI_CASE_TIMEOUT_FACTOR", DEFAULT_FACTOR) if factor is None else factor
+        self.floor = _env_float("CI_CASE_TIMEOUT_FLOOR", DEFAULT_FLOOR) if floor is None else floor
+        self.ceiling = _env_float("CI_CASE_TIMEOUT_CEILING", DEFAULT_CEILING) if ceiling is None else ceiling
+        self.min_runs = int(_env_float("CI_CASE_TIMEOUT_MIN_RUNS", DEFAULT_MIN_RUNS)) if min_runs is None else min_runs
+        # case -> budget of the lines wrapped by apply()
+        self.applied: Dict[str, int] = {}
+
+    @classmethod
+    def from_store(cls, store, cases, branch: Optional[str] = None, **kwargs) -> "CaseTimeouts":
+        p99 = {}
+        run_counts = {}
+        for case in cases:
+            stats = store.stats(case, branch)
+            if stats:
+                p99[case] = stats["p99"]
+                run_counts[case] = stats["count"]
+        return cls(p99, run_counts, **kwargs)
+
+    @property
+    def enabled(self) -> bool:
+        return self.factor > 0
+
+    def budget(self, case: str) -> Optional[int]:
+        """Seconds the case may run, None without enough history"""
+        if not self.enabled or case not in self.p99 or self.run_counts.get(case, 0) < self.min_runs:
+            return None
+        return int(min(self.ceiling, max(self.floor, self.p99[case] * self.factor)))
+
+    def wrap(self, task_line: str) -> str:
+        """The task line with its command wrapped in timeout(1), if it has a budget"""
+        parts = task_line.split(",", 4)
+        if len(parts) < 5:
+            return task_line
+        case = extract_case_path(task_line)
+        budget = self.budget(case)
+        command = parts[4].strip()
+        if budget is None or command.startswith("timeout ") or _SHELL_OPERATORS.search(command):
+            return task_line
+        first = command.split(None, 1)[0]
+        # leading VAR=value assignments need env(1) to survive behind timeout
+        prefix = "env " if "=" in first and not first.startswith(("./", "/")) else ""
+        parts[4] = f"timeout -k {KILL_AFTER} {budget} {prefix}{command}"
+        self.applied[case] = budget
+        return ",".join(parts)
+
+    def apply(self, task_lines: List[str]) -> List[str]:
+        return [self.wrap(line) if is_active_task_line(line) else line for line in task_lines]
+
+    def killed(self, results: Dict[str, Tuple[str, float]]) -> List[Tuple[str, int, float]]:
+        """(case, budget, duration) of wrapped cases that failed at their budget"""
+        killed = []
+        for case, (outcome, duration) in results.items():
+            budget = self.applied.get(case)
+            if budget is not None and outcome != PASS and duration >= budget * 0.98:
+                killed.append((case, budget, duration))
+        return sorted(killed)
+
+    def print_report(self, results: Dict[str, Tuple[str, float]]) -> None:
+        if not self.applied:
+            return
+        killed = self.killed(results)
+        print(f"Adaptive timeouts: {len(self.applied)} cases had a budget, {len(killed)} were killed by it")
+        for case, budget, duration in killed:
+            print(f"  killed after {duration:.0f}s (budget {budget}s, p99 {self.p99[case]:.0f}s): {case}")
@@ -0,0 +1,163 @@
+import glob
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+from output_capture import CAPTURE_FULL
+
+# refresh package indexes only when they are older than this (seconds)
+DEFAULT_INDEX_MAX_AGE = 24 * 3600
+
+APT_INDEX_STAMPS = [
+    "/var/lib/apt/periodic/update-success-stamp",
+]
+BREW_INDEX_STAMPS = [
+    "/opt/homebrew/.git/FETCH_HEAD",
+    "/usr/local/Homebrew/.git/FETCH_HEAD",
+]
+
+
+class DependencyPlanner:
+    """Install only what is missing from dependencies.txt.
+
+    Installed packages are queried in one batched call (`dpkg-query -W` or
+    `brew info --json=v2 --installed`), the wanted list is reduced to the
+    missing packages, the package index is refreshed only when it is older
+    than `index_max_age` and everything left is installed in one transaction.
+    On a warm runner nothing but the query runs. An apt install that fails
+    on a stale index is retried once after `apt update`.
+    """
+
+    def __init__(self, utils, platform: str, index_max_age: Optional[float] = None):
+        if platform not in ("linux", "macOS"):
+            raise ValueError(f"Unsupported platform for dependency install: {platform}")
+        self.utils = utils
+        self.platform = platform
+        if index_max_age is None:
+            index_max_age = float(os.getenv("CI_PKG_INDEX_MAX_AGE", DEFAULT_INDEX_MAX_AGE))
+        self.index_max_age = index_max_age
+
+    def _query(self, command: List[str]) -> str:
+        try:
+            result = self.utils.run_command(command, check=False, silent=True, capture=CAPTURE_FULL)
+        except OSError:
+            return ""
+        return result.stdout or ""
+
+    def installed_packages(self) -> Dict[str, str]:
+        """Return {package: version} of installed packages, including virtual ones on linux"""
+        installed = {}
+        if self.platform == "linux":
+            output = self._query([
+                "dpkg-query", "-W",
+                "-f=${Package}\t${db:Status-Status}\t${Version}\t${Provides}\n",
+            ])
+            for line in output.splitlines():
+                fields = line.split("\t")
+                if len(fields) < 3 or fields[1] != "installed":
+                    continue
+                name = fields[0].split(":", 1)[0]
+                installed[name] = fields[2]
+                # virtual packages such as libz-dev are only listed under Provides
+                provides = fields[3] if len(fields) > 3 else ""
+                for item in provides.split(","):
+                    virtual = item.strip().split(" ", 1)[0].split(":", 1)[0]
+                    if virtual:
+                        installed.setdefault(virtual, fields[2])
+        else:
+            installed = self._brew_installed()
+        return installed
+
+    def _brew_installed(self) -> Dict[str, str]:
+        """Installed formulae under every name brew resolves to them,
+        e.g. openssl -> openssl@3 and pkg-config -> pkgconf"""
+        installed = {}
+        try:
+            formulae = json.loads(self._query(["brew", "info", "--json=v2", "--installed"]) or "{}").get("formulae", [])
+        except ValueError:
+            formulae = []
+        for formula in formulae:
+            versions = [item.get("version", "") for item in formula.get("installed", [])]
+            if not versions:
+                continue
+            names = [formula.get("name"), formula.get("full_name"), formula.get("oldname")]
+            names += formula.get("aliases", []) + formula.get("oldnames", [])
+            for name in names:
+                if name:
+                    installed.setdefault(name, versions[-1])
+        if not installed:
+            # older brew without json v2, exact names only
+            for line in self._query(["brew", "list", "--versions"]).splitlines():
+                parts = line.split()
+                if parts:
+                    installed[parts[0]] = parts[-1] if len(parts) > 1 else ""
+        return installed
+
+    def index_age(self) -> float:
+        """Seconds since the package index was last refreshed (inf if unknown)"""
+        if self.platform == "linux":
+            stamps = APT_INDEX_STAMPS + glob.glob("/var/lib/apt/lists/*_Packages")
+        else:
+            stamps = BREW_INDEX_STAMPS
+        mtimes = [os.path.getmtime(p) for p in stamps if os.path.exists(p)]
+        if not mtimes:
+            return float("inf")
+        return time.time() - max(mtimes)
+
+    def plan(self, wanted: List[str]) -> Dict[str, object]:
+        installed = self.installed_packages()
+        missing = [pkg for pkg in wanted if pkg not in installed]
+        return {
+            "missing": missing,
+            "installed": {pkg: installed[pkg] for pkg in wanted if pkg in installed},
+            "refresh_index": bool(missing) and self.index_age() > self.index_max_age,
+        }
+
+    def apply(self, wanted: List[str]) -> List[str]:
+        """Install the missing packages of `wanted`; return what was installed"""
+        start = time.monotonic()
+        plan = self.plan(wanted)
+        missing = plan["missing"]
+        if not missing:
+            print(
+                f"All {len(wanted)} {self.platform} dependencies already installed "
+                f"({time.monotonic() - start:.2f}s)"
+            )
+            return []
+
+        print(f"Missing {self.platform} dependencies: {' '.join(missing)}")
+        if self.platform == "linux":
+            if plan["refresh_index"]:
+                self.utils.run_command("sudo apt update -y")
+            install = f"sudo apt install -y {' '.join(missing)}"
+            if plan["refresh_index"]:
+                self.utils.run_command(install)
+            elif self.utils.run_command(install, check=False).returncode != 0:
+                # the index looked fresh but may still miss these versions
+                print("apt install failed, refresh the package index and retry once")
+                self.utils.run_command("sudo apt update -y")
+                self.utils.run_command(install)
+        else:
+            if plan["refresh_index"]:
+                self.utils.run_command("brew update")
+            # do not let brew refresh its index again on its own
+            env = dict(os.environ, HOMEBREW_NO_AUTO_UPDATE="1")
+            self.utils.run_command(f"brew install {' '.join(missing)}", env=env)
+        return missing
+
+
+def main():
+    from utils import Utils
+
+    utils = Utils()
+    platform = "macOS" if utils.is_mac else "linux"
+    wanted = utils.read_dependencies()[platform]
+    plan = DependencyPlanner(utils, platform).plan(wanted)
+    print(f"installed: {plan['installed']}")
+    print(f"missing: {plan['missing']}")
+    print(f"refresh index: {plan['refresh_index']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".cache", "taos-ci", "durations.sqlite")
+# percentiles are computed over the most recent runs of a case
+DEFAULT_WINDOW = 50
+# rows kept per case and branch, older ones are pruned on ingest
+DEFAULT_KEEP = 200
+
+PASS = "pass"
+FAIL = "fail"
+TIMEOUT = "timeout"
+
+_OUTCOMES = {
+    "success": PASS, "succeed": PASS, "passed": PASS, "pass": PASS, "ok": PASS,
+    "failed": FAIL, "fail": FAIL, "failure": FAIL, "error": FAIL,
+    "timeout": TIMEOUT, "timedout": TIMEOUT,
+}
+# a case path in a log line, shared with the start patterns of result_stream
+CASE_PATTERN = r"(?P<case>(?:cases|tsim|sim)/[^\s,;'\"]+?\.(?:py|sh|sim))"
+_OUTCOME = r"(?P<outcome>success|succeed|passed|pass|ok|failed|failure|fail|error|timeout|timedout)"
+_DURATION = r"(?P<duration>\d+(?:\.\d+)?)\s*(?:s\b|sec\b|secs\b|seconds\b)"
+# run.sh reports a finished case on one line with its task line fields, the
+# elapsed time and the result, colored with ANSI escapes (stripped first):
+#     "   12  DONE  <<<<<  y,.,./ci/pytest.sh pytest cases/a/test_b.py [37s]  success"
+# Other orders of path, result and time are accepted for older branches.
+# CI_DURATION_LOG_REGEX (named groups case/outcome/duration) overrides them.
+RESULT_PATTERNS = [
+    re.compile(CASE_PATTERN + r".*?" + _DURATION + r".*?\b" + _OUTCOME + r"\b", re.IGNORECASE),
+    re.compile(CASE_PATTERN + r".*?\b" + _OUTCOME + r"\b.*?" + _DURATION, re.IGNORECASE),
+    re.compile(r"\b" + _OUTCOME + r"\b.*?" + CASE_PATTERN + r".*?" + _DURATION, re.IGNORECASE),
+]
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+LOG_SUFFIXES = (".log", ".txt")
+
+
+def _result_patterns() -> List["re.Pattern"]:
+    custom = os.getenv("CI_DURATION_LOG_REGEX")
+    return [re.compile(custom, re.IGNORECASE)] if custom else RESULT_PATTERNS
+
+
+def parse_result_lines(lines) -> Iterator[Tuple[str, str, float]]:
+    """Yield (case, outcome, seconds) for every case result line"""
+    for case, outcome, duration, _ in parse_result_records(lines):
+        yield case, outcome, duration
+
+
+def parse_result_records(lines) -> Iterator[Tuple[str, str, float, str]]:
+    """Like parse_result_lines, with the result line itself (without ANSI escapes) last"""
+    patterns = _result_patterns()
+    for line in lines:
+        # cheap filter first, most log lines are case output
+        if "/" not in line:
+            continue
+        if "\x1b" in line:
+            line = ANSI_ESCAPE.sub("", line)
+        for pattern in patterns:
+            match = pattern.search(line)
+            # a custom regex may capture words we do not know, those are no results
+            if match and match.group("outcome").lower() in _OUTCOMES:
+                outcome = _OUTCOMES[match.group("outcome").lower()]
+                yield match.group("case"), outcome, float(match.group("duration")), line.strip()
+                break
+
+
+def read_log_dir_records(log_dir: Union[str, Path]) -> List[Tuple[str, str, float, str]]:
+    """[(case, outcome, seconds, result line)] from the log files of a run.sh log directory"""
+    records = []
+    for dirpath, _, filenames in os.walk(str(log_dir)):
+        for filename in sorted(filenames):
+            if not filename.endswith(LOG_SUFFIXES):
+                continue
+            with open(os.path.join(dirpath, filename), "r", encoding="utf-8", errors="replace") as f:
+                records.extend(parse_result_records(f))
+    if not records:
+        # most likely the result line format changed, see RESULT_PATTERNS
+        print(
+            f"Warning: no case results found in {log_dir}, "
+            f"check RESULT_PATTERNS or set CI_DURATION_LOG_REGEX",
+            file=sys.stderr,
+        )
+    return records
+
+
+def results_by_case(records) -> Dict[str, Tuple[str, float]]:
+    """{case: (outcome, seconds)}; a case reported twice (e.g. rerun or on
+    several task lines) keeps its last result"""
+    return {case: (outcome, duration) for case, outcome, duration, _ in records}
+
+
+def read_log_dir_results(log_dir: Union[str, Path]) -> Dict[str, Tuple[str, float]]:
+    """{case: (outcome, seconds)} from the log files of a run.sh log directory"""
+    return results_by_case(read_log_dir_records(log_dir))
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Linear-interpolated percentile, `q` in [0, 1]"""
+    if not values:
+        raise ValueError("percentile of empty list")
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+class DurationStore:
+    """Per-case durations and outcomes of past runs in a local SQLite file.
+
+        store = DurationStore()
+        store.ingest_log_dir(f"{wkdir}/log/{test_log_dir_name_base}", branch="main")
+        budget = store.estimate("cases/01-DataTypes/test_datatype_bigint.py", "main", q=0.95)
+
+    Percentiles are computed over the latest `window` runs of a case on a
+    branch, falling back to all branches when the branch has no history.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None, window: int = DEFAULT_WINDOW):
+        self.path = str(path or os.getenv("CI_DURATION_DB") or DEFAULT_DB_PATH)
+        self.window = window
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS durations (
+                case_path TEXT NOT NULL,
+                branch TEXT NOT NULL,
+                run_id TEXT NOT NULL,
+                duration REAL NOT NULL,
+                outcome TEXT NOT NULL,
+                recorded REAL NOT NULL,
+                UNIQUE (case_path, branch, run_id)
+            );
+            CREATE INDEX IF NOT EXISTS durations_case
+                ON durations (case_path, branch, recorded);
+            """
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def record(
+        self,
+        case: str,
+        duration: float,
+        outcome: str = PASS,
+        branch: str = "",
+        run_id: Optional[str] = None,
+        recorded: Optional[float] = None,
+    ) -> None:
+        recorded = time.time() if recorded is None else recorded
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO durations VALUES (?, ?, ?, ?, ?, ?)",
+                (case, branch, run_id or f"{recorded:.6f}", duration, outcome, recorded),
+            )
+
+    def ingest_log_dir(
+        self,
+        log_dir: Union[str, Path],
+        branch: str = "",
+        run_id: Optional[str] = None,
+    ) -> int:
+        """Record every case result found in the log files of a run.sh log directory"""
+        log_dir = str(log_dir)
+        run_id = run_id or os.path.basename(log_dir.rstrip("/"))
+        return self.ingest_results(read_log_dir_results(log_dir), branch, run_id)
+
+    def ingest_results(
+        self,
+        results: Dict[str, Tuple[str, float]],
+        branch: str = "",
+        run_id: Optional[str] = None,
+    ) -> int:
+        """Record {case: (outcome, seconds)} of one run"""
+        now = time.time()
+        run_id = run_id or f"{now:.6f}"
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO durations VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (case, branch, run_id, duration, outcome, now)
+                    for case, (outcome, duration) in results.items()
+                ],
+            )
+        self.prune()
+        return len(results)
+
+    def prune(self, keep: int = DEFAULT_KEEP) -> int:
+        """Drop all but the latest `keep` rows of every case and branch"""
+        with self.conn:
+            cursor = self.conn.execute(
+                """
+                DELETE FROM durations WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, ROW_NUMBER() OVER (
+                            PARTITION BY case_path, branch ORDER BY recorded DESC
+                        ) AS n FROM durations
+                    ) WHERE n > ?
+                )
+                """,
+                (keep,),
+            )
+        return cursor.rowcount
+
+    def _recent(self, case: str, branch: Optional[str]) -> List[Tuple[float, str]]:
+        if branch is not None:
+            rows = self.conn.execute(
+                "SELECT duration, outcome FROM durations WHERE case_path = ? AND branch = ? "
+                "ORDER BY recorded DESC LIMIT ?",
+                (case, branch, self.window),
+            ).fetchall()
+            if rows:
+                return rows
+        return self.conn.execute(
+            "SELECT duration, outcome FROM durations WHERE case_path = ? "
+            "ORDER BY recorded DESC LIMIT ?",
+            (case, self.window),
+        ).fetchall()
+
+    def stats(self, case: str, branch: Optional[str] = None) -> Optional[Dict[str, float]]:
+        """p50/p95/p99/max and failure rate of the recent runs, None without history"""
+        rows = self._recent(case, branch)
+        if not rows:
+            return None
+        durations = [row[0] for row in rows]
+        return {
+            "count": len(rows),
+            "p50": percentile(durations, 0.50),
+            "p95": percentile(durations, 0.95),
+            "p99": percentile(durations, 0.99),
+            "max": max(durations),
+            "failure_rate": sum(1 for row in rows if row[1] != PASS) / len(rows),
+        }
+
+    def estimate(
+        self,
+        case: str,
+        branch: Optional[str] = None,
+        q: float = 0.5,
+        default: Optional[float] = None,
+    ) -> Optional[float]:
+        """Percentile `q` of the case's recent durations, `default` without history"""
+        rows = self._recent(case, branch)
+        if not rows:
+            return default
+        return percentile([row[0] for row in rows], q)
+
+    def estimates(self, cases, branch: Optional[str] = None, q: float = 0.5) -> Dict[str, float]:
+        """Percentile `q` of every case in `cases` that has history"""
+        result = {}
+        for case in cases:
+            value = self.estimate(case, branch, q)
+            if value is not None:
+                result[case] = value
+        return result
+
+    def outcome_history(self, branch: Optional[str] = None) -> Dict[str, List[str]]:
+        """Recent outcomes of every case, newest first, in one query"""
+        where, params = ("WHERE branch = ?", (branch,)) if branch is not None else ("", ())
+        rows = self.conn.execute(
+            f"""
+            SELECT case_path, outcome FROM (
+                SELECT case_path, outcome, recorded, ROW_NUMBER() OVER (
+                    PARTITION BY case_path ORDER BY recorded DESC
+                ) AS n FROM durations {where}
+            ) WHERE n <= ? ORDER BY case_path, recorded DESC
+            """,
+            params + (self.window,),
+        )
+        history: Dict[str, List[str]] = {}
+        for case, outcome in rows:
+            history.setdefault(case, []).append(outcome)
+        return history
+
+    def cases(self, branch: Optional[str] = None) -> List[str]:
+        if branch is None:
+            rows = self.conn.execute("SELECT DISTINCT case_path FROM durations")
+        else:
+            rows = self.conn.execute("SELECT DISTINCT case_path FROM durations WHERE branch = ?", (branch,))
+        return sorted(row[0] for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-case duration history")
+    parser.add_argument("--db", default=None, help="SQLite file (default: CI_DURATION_DB)")
+    sub = parser.add_subparsers(dest="action", required=True)
+    ingest = sub.add_parser("ingest", help="record the case results of a run.sh log directory")
+    ingest.add_argument("log_dir")
+    ingest.add_argument("--branch", default="")
+    ingest.add_argument("--run-id", default=None)
+    show = sub.add_parser("show", help="print the duration percentiles of cases")
+    show.add_argument("cases", nargs="*")
+    show.add_argument("--branch", default=None)
+    top = sub.add_parser("top", help="print the slowest cases by p95")
+    top.add_argument("-n", type=int, default=20)
+    top.add_argument("--branch", default=None)
+    args = parser.parse_args()
+
+    with DurationStore(args.db) as store:
+        if args.action == "ingest":
+            count = store.ingest_log_dir(args.log_dir, args.branch, args.run_id)
+            print(f"Recorded {count} case results from {args.log_dir}")
+            return
+
+        cases = args.cases if args.action == "show" and args.cases else store.cases(args.branch)
+        rows = []
+        for case in cases:
+            stats = store.stats(case, args.branch)
+            if stats:
+                rows.append((case, stats))
+        if args.action == "top":
+            rows = sorted(rows, key=lambda row: row[1]["p95"], reverse=True)[:args.n]
+        print(f"{'p50':>8} {'p95':>8} {'p99':>8} {'runs':>5} {'fail':>5}  case")
+        for case, stats in rows:
+            print(
+                f"{stats['p50']:8.1f} {stats['p95']:8.1f} {stats['p99']:8.1f} "
+                f"{stats['count']:5d} {stats['failure_rate']:5.0%}  {case}"
+            )
+
+
+if __name__ == "__main__":
+    main()
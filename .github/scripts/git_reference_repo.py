@@ -0,0 +1,155 @@
+"""Share one git object store between the workspaces of a host.
+
+Run inside a workspace repository (like git_ref_lock_cleaner.py, it only
+needs the standard library so it can be copied to remote hosts):
+
+    python3 git_reference_repo.py          # sync the reference repo and attach it
+    python3 git_reference_repo.py --gc     # also repack it if due
+
+The reference repo is a bare repo per origin URL under CI_GIT_REFERENCE_ROOT
+(~/.cache/taos-ci/git-reference). It is listed in the workspace's
+objects/info/alternates, so a later `git fetch` in the workspace finds the
+objects there and only transfers refs and what the reference lacks; on
+attach the workspace drops its own copies of the shared objects.
+
+Only one process fetches into a reference repo at a time (flock); the
+others wait and skip their fetch if it became fresh meanwhile. The
+reference repo never prunes objects, since workspaces may depend on any of
+them; gc only repacks, under the same lock.
+"""
+import argparse
+import hashlib
+import os
+import subprocess
+import sys
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+DEFAULT_ROOT = os.path.join(os.path.expanduser("~"), ".cache", "taos-ci", "git-reference")
+# a reference fetched less than this many seconds ago is not fetched again
+DEFAULT_MAX_AGE = 600
+GC_INTERVAL = 24 * 3600
+FETCH_REFSPECS = ["+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"]
+
+
+def git(*args, cwd=None, check=True):
+    result = subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True)
+    if check and result.returncode != 0:
+        raise RuntimeError(f"git {' '.join(args)} failed: {result.stderr.strip()}")
+    return result.stdout.strip()
+
+
+class ReferenceRepo:
+    def __init__(self, url, root=None):
+        self.url = url
+        root = root or os.getenv("CI_GIT_REFERENCE_ROOT") or DEFAULT_ROOT
+        name = os.path.basename(url.rstrip("/"))
+        name = (name[:-4] if name.endswith(".git") else name) or "repo"
+        self.path = os.path.join(root, f"{name}-{hashlib.sha1(url.encode()).hexdigest()[:8]}.git")
+        self.lock_path = f"{self.path}.lock"
+
+    def _stamp_age(self, name):
+        try:
+            return time.time() - os.path.getmtime(os.path.join(self.path, name))
+        except OSError:
+            return float("inf")
+
+    def _touch(self, name):
+        with open(os.path.join(self.path, name), "w"):
+            pass
+
+    def _locked(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        lock_file = open(self.lock_path, "w")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _ensure(self):
+        if os.path.exists(os.path.join(self.path, "HEAD")):
+            return
+        git("init", "-q", "--bare", self.path)
+        git("remote", "add", "origin", self.url, cwd=self.path)
+        # fetch must never trigger a gc that prunes objects workspaces borrow
+        git("config", "gc.auto", "0", cwd=self.path)
+        git("config", "gc.pruneExpire", "never", cwd=self.path)
+
+    def sync(self, max_age=DEFAULT_MAX_AGE):
+        """Fetch into the reference repo unless another process just did"""
+        if self._stamp_age("ci-last-fetch") < max_age:
+            print(f"Reference {self.path} is fresh, skip fetch.")
+            return
+        with self._locked():
+            # whoever held the lock before may have fetched already
+            if self._stamp_age("ci-last-fetch") < max_age:
+                print(f"Reference {self.path} was fetched meanwhile, skip fetch.")
+                return
+            self._ensure()
+            start = time.time()
+            git("fetch", "-q", "--prune", "origin", *FETCH_REFSPECS, cwd=self.path)
+            self._touch("ci-last-fetch")
+            print(f"Fetched reference {self.path} in {time.time() - start:.1f}s.")
+
+    def gc(self, interval=GC_INTERVAL):
+        """Repack the reference repo at most once per `interval`; nothing is pruned"""
+        if self._stamp_age("ci-last-gc") < interval:
+            return
+        with self._locked():
+            if self._stamp_age("ci-last-gc") < interval:
+                return
+            git("repack", "-q", "-a", "-d", "--keep-unreachable", cwd=self.path)
+            git("prune-packed", cwd=self.path)
+            self._touch("ci-last-gc")
+            print(f"Repacked reference {self.path}.")
+
+    def attach(self, repo="."):
+        """List the reference objects in the workspace's alternates, once"""
+        alternates = git("rev-parse", "--git-path", "objects/info/alternates", cwd=repo)
+        alternates = os.path.join(repo, alternates) if not os.path.isabs(alternates) else alternates
+        objects = os.path.join(self.path, "objects")
+        if not os.path.isdir(objects):
+            raise RuntimeError(f"reference {self.path} has no object store")
+        lines = []
+        if os.path.exists(alternates):
+            with open(alternates, encoding="utf-8") as f:
+                lines = [line.strip() for line in f if line.strip()]
+        if objects in lines:
+            return
+        os.makedirs(os.path.dirname(alternates), exist_ok=True)
+        with open(alternates, "a", encoding="utf-8") as f:
+            f.write(f"{objects}\n")
+        # once attached, drop the workspace's own copies of shared objects
+        git("repack", "-q", "-a", "-d", "-l", cwd=repo)
+        print(f"Attached reference {self.path} to {os.path.abspath(repo)}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync and attach the host's shared reference repository")
+    parser.add_argument("--gc", action="store_true", help="repack the reference repo if due")
+    parser.add_argument("--max-age", type=float, default=float(os.getenv("CI_GIT_REFERENCE_MAX_AGE", DEFAULT_MAX_AGE)))
+    args = parser.parse_args()
+
+    if fcntl is None:
+        print("No flock on this platform, skip reference repository.")
+        return
+    url = git("remote", "get-url", "origin", check=False)
+    if not url:
+        print("No origin remote, skip reference repository.")
+        return
+    reference = ReferenceRepo(url)
+    try:
+        reference.sync(args.max_age)
+        reference.attach()
+        if args.gc:
+            reference.gc()
+    except RuntimeError as e:
+        # the workspace still works without the reference, only slower
+        print(f"Reference repository not used: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import concurrent.futures
+import os
+import random
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_INITIAL = 10
+DEFAULT_MINIMUM = 2
+DEFAULT_MAXIMUM = 64
+# seconds one host may take before it is given up
+DEFAULT_DEADLINE = 3600.0
+# a completion slower than this many times the median of the recent ones counts as congestion
+LATENCY_FACTOR = 3.0
+# successful completions the median is taken over, and how many it needs first
+LATENCY_WINDOW = 20
+LATENCY_MIN_SAMPLES = 5
+
+OK = "ok"
+FAILED = "failed"
+DEADLINE = "deadline"
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+class AdaptiveLimit:
+    """Concurrency limit that grows additively and shrinks multiplicatively.
+
+    Every successful, uncongested completion raises the limit by one up to
+    `maximum`; an error, a deadline or a completion slower than
+    LATENCY_FACTOR times the median of the last LATENCY_WINDOW successful
+    ones halves it down to `minimum`. Hosts differ in speed, so the median
+    rather than the fastest host is the baseline, and latency is only judged
+    once LATENCY_MIN_SAMPLES completions are known. The limit is halved at
+    most once per `cooldown` seconds, so one burst of slow hosts does not
+    collapse it.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, cooldown: float = 1.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(self.maximum, max(self.minimum, initial))
+        self.cooldown = cooldown
+        self.running = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._last_decrease = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        # created lazily, it belongs to the running event loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self) -> None:
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.running < self.limit)
+            self.running += 1
+
+    async def release(self, latency: float, ok: bool) -> None:
+        async with self.condition:
+            self.running -= 1
+            self.adjust(latency, ok)
+            self.condition.notify_all()
+
+    def adjust(self, latency: float, ok: bool) -> None:
+        congested = (
+            len(self.latencies) >= LATENCY_MIN_SAMPLES
+            and latency > statistics.median(self.latencies) * LATENCY_FACTOR
+        )
+        if ok:
+            self.latencies.append(latency)
+        if ok and not congested:
+            self.limit = min(self.maximum, self.limit + 1)
+            return
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self._last_decrease = now
+            self.limit = max(self.minimum, self.limit // 2)
+
+
+class HostFanout:
+    """Run a blocking per-host operation on many hosts with adaptive concurrency.
+
+    The operation (e.g. TestPreparer._process_single_host, which blocks on
+    SSH) runs in worker threads; an asyncio loop decides how many run at a
+    time through AdaptiveLimit, enforces a deadline per host and prints a
+    progress table while hosts are pending:
+
+        fanout = HostFanout.from_env()
+        results = fanout.run(host_configs, process_host, on_deadline=lambda h: pool.close_host(h["host"]))
+        failed = [r["host"] for r in results if r["status"] != "ok"]
+
+    A host past its deadline is reported as failed right away; since a
+    thread cannot be cancelled, `on_deadline` should make the blocked
+    operation return, e.g. by closing its connection.
+    """
+
+    def __init__(
+        self,
+        initial: int = DEFAULT_INITIAL,
+        minimum: int = DEFAULT_MINIMUM,
+        maximum: int = DEFAULT_MAXIMUM,
+        deadline: Optional[float] = DEFAULT_DEADLINE,
+        progress_interval: float = 10.0,
+    ):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.deadline = deadline
+        self.progress_interval = progress_interval
+        self.limit: Optional[AdaptiveLimit] = None
+        self.states: Dict[str, Dict[str, Any]] = {}
+
+    @classmethod
+    def from_env(cls) -> "HostFanout":
+        """CI_HOST_FANOUT_INITIAL, CI_HOST_FANOUT_MIN, CI_HOST_FANOUT_MAX and CI_HOST_DEADLINE"""
+        return cls(
+            initial=int(_env_number("CI_HOST_FANOUT_INITIAL", DEFAULT_INITIAL)),
+            minimum=int(_env_number("CI_HOST_FANOUT_MIN", DEFAULT_MINIMUM)),
+            maximum=int(_env_number("CI_HOST_FANOUT_MAX", DEFAULT_MAXIMUM)),
+            deadline=_env_number("CI_HOST_DEADLINE", DEFAULT_DEADLINE) or None,
+        )
+
+    async def _run_host(self, executor, name: str, host_config, operation, on_deadline) -> Dict[str, Any]:
+        state = self.states[name]
+        await self.limit.acquire()
+        state["status"] = "running"
+        state["started"] = time.time()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(executor, operation, host_config)
+        ok = False
+        try:
+            ok = bool(await asyncio.wait_for(asyncio.shield(future), self.deadline))
+            state["status"] = OK if ok else FAILED
+        except asyncio.TimeoutError:
+            state["status"] = DEADLINE
+            state["error"] = f"no result after {self.deadline:g}s"
+            if on_deadline:
+                await loop.run_in_executor(None, on_deadline, host_config)
+        except Exception as e:
+            state["status"] = FAILED
+            state["error"] = str(e)
+        state["duration"] = time.time() - state["started"]
+        await self.limit.release(state["duration"], ok)
+        return state
+
+    async def _progress(self) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self.print_table()
+
+    def print_table(self) -> None:
+        counts: Dict[str, int] = {}
+        for state in self.states.values():
+            counts[state["status"]] = counts.get(state["status"], 0) + 1
+        summary = ", ".join(f"{status}={count}" for status, count in sorted(counts.items()))
+        print(f"[hosts] {summary}, limit={self.limit.limit}", flush=True)
+        now = time.time()
+        running = [(state["started"], name) for name, state in self.states.items() if state["status"] == "running"]
+        # the longest running hosts are the likeliest to hit their deadline
+        for started, name in sorted(running)[:10]:
+            print(f"  running  {now - started:7.1f}s  {name}", flush=True)
+        for name, state in self.states.items():
+            if state["status"] in (FAILED, DEADLINE):
+                duration = state.get("duration", now - state["started"])
+                print(f"  {state['status']:<8} {duration:7.1f}s  {name}  {state.get('error', '')}", flush=True)
+
+    async def gather(
+        self,
+        host_configs: List[Any],
+        operation: Callable[[Any], bool],
+        name: Callable[[Any], str] = lambda host_config: host_config["host"],
+        on_deadline: Optional[Callable[[Any], None]] = None,
+    ) -> List[Dict[str, Any]]:
+        self.limit = AdaptiveLimit(self.initial, self.minimum, self.maximum)
+        names = [name(host_config) for host_config in host_configs]
+        self.states = {n: {"host": n, "status": "pending"} for n in names}
+        progress = asyncio.ensure_future(self._progress())
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.limit.maximum)
+        try:
+            results = await asyncio.gather(
+                *(
+                    self._run_host(executor, n, host_config, operation, on_deadline)
+                    for n, host_config in zip(names, host_configs)
+                )
+            )
+        finally:
+            progress.cancel()
+            # threads past their deadline are left to finish on their own
+            executor.shutdown(wait=False)
+        self.print_table()
+        return results
+
+    def run(self, host_configs: List[Any], operation: Callable[[Any], bool], **kwargs) -> List[Dict[str, Any]]:
+        """Synchronous facade of gather, one result dict per host in input order"""
+        return asyncio.run(self.gather(host_configs, operation, **kwargs))
+
+
+class _SimulatedHosts:
+    """Hosts whose operation gets slower once more than `capacity` run at once,
+    like a coordinator uplink or git server shared by all of them"""
+
+    def __init__(self, latency: float, capacity: int, error_rate: float):
+        self.latency = latency
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.running = 0
+        self._lock = threading.Lock()
+
+    def operation(self, host_config) -> bool:
+        with self._lock:
+            self.running += 1
+            load = self.running
+        try:
+            time.sleep(self.latency * random.uniform(0.8, 1.2) * max(1.0, load / self.capacity))
+            return random.random() >= self.error_rate
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def _bench(hosts: int, latency: float, capacity: int, error_rate: float) -> None:
+    host_configs = [{"host": f"sim-{i:03d}"} for i in range(hosts)]
+
+    simulated = _SimulatedHosts(latency, capacity, error_rate)
+    start = time.time()
+    # the previous fixed pool of at most ten threads
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(hosts, 10))) as executor:
+        list(executor.map(simulated.operation, host_configs))
+    fixed = time.time() - start
+
+    simulated = _SimulatedHosts(latency, capacity, error_rate)
+    fanout = HostFanout(progress_interval=max(1.0, latency))
+    start = time.time()
+    results = fanout.run(host_configs, simulated.operation)
+    adaptive = time.time() - start
+    failed = sum(1 for result in results if result["status"] != OK)
+    print(
+        f"{hosts} hosts, {latency:.2f}s each, capacity {capacity}: "
+        f"fixed 10 threads {fixed:.2f}s, adaptive {adaptive:.2f}s "
+        f"(final limit {fanout.limit.limit}, {failed} failed)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the adaptive host fan-out against simulated hosts")
+    parser.add_argument("--hosts", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per host when unloaded")
+    parser.add_argument("--capacity", type=int, default=32, help="hosts that can run before they slow down")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    _bench(args.hosts, args.latency, args.capacity, args.error_rate)
+
+
+if __name__ == "__main__":
+    main()
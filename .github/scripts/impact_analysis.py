@@ -0,0 +1,285 @@
+import argparse
+import fnmatch
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser("~"), ".cache", "taos-ci", "impact", "index.json")
+# coverage older than this is not trusted for selection (seconds)
+DEFAULT_MAX_AGE = 14 * 24 * 3600
+# selecting more than this fraction of the indexed cases is no better than the full suite
+DEFAULT_MAX_FRACTION = 0.5
+
+SOURCE_SUFFIXES = (".c", ".cc", ".cpp", ".h", ".hpp", ".inc")
+# changes that may affect every case, always run the full suite
+FULL_SUITE_PATTERNS = [
+    "CMakeLists.txt",
+    "*/CMakeLists.txt",
+    "cmake/*",
+    "*.cmake",
+    "build.sh",
+    "packaging/*",
+    "contrib/*",
+    # framework, ci scripts, requirements.txt and data files of the cases;
+    # checked after test/cases/**/*.py, which select themselves
+    "test/*",
+]
+# changes that cannot affect any case; fnmatch's * also matches "/"
+IGNORED_PATTERNS = [
+    "docs/*",
+    "*.md",
+    ".github/*",
+    "LICENSE",
+]
+
+INCLUDE_RE = re.compile(r'^\s*#\s*include\s*[<"]([^>"]+)[>"]', re.MULTILINE)
+
+
+def _matches(path: str, patterns: List[str]) -> bool:
+    return any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+
+
+def read_lcov(lcov_path: Union[str, Path], root: Optional[str] = None) -> Set[str]:
+    """Source files with at least one hit line in an lcov tracefile, relative to `root`"""
+    covered = set()
+    current = None
+    with open(lcov_path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("SF:"):
+                current = line[3:].strip()
+            elif line.startswith("LH:") and current:
+                if int(line[3:].strip() or 0) > 0:
+                    covered.add(current)
+            elif line.startswith("end_of_record"):
+                current = None
+    if root:
+        root = os.path.abspath(root)
+        covered = {
+            os.path.relpath(path, root) if os.path.isabs(path) else path
+            for path in covered
+        }
+    return {path.replace("\\", "/") for path in covered}
+
+
+class ImpactIndex:
+    """Reverse index from source files to the cases exercising them.
+
+    Two kinds of edges are recorded:
+      * coverage: the source files each case executed, ingested per case from
+        an lcov tracefile of a coverage build;
+      * includes: the #include graph of the C sources, so a changed header
+        reaches every source file that (transitively) includes it.
+
+    Both are updated incrementally: ingesting a case only replaces that case's
+    edges, and rescanning includes only re-reads files whose size or mtime
+    changed. The index is a JSON file and can be queried offline:
+
+        index = ImpactIndex.load()
+        cases, reason = index.select(["source/libs/parser/src/parAstCreater.c"])
+        # cases is None when the full suite has to run
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None):
+        self.path = str(path or os.getenv("CI_IMPACT_INDEX") or DEFAULT_INDEX_PATH)
+        # case -> {"sources": [...], "updated": ts}
+        self.coverage: Dict[str, Dict[str, object]] = {}
+        # source -> {"stat": [mtime_ns, size], "includes": [...]}
+        self.includes: Dict[str, Dict[str, object]] = {}
+        self._reverse: Optional[Dict[str, Set[str]]] = None
+        self._included_by: Optional[Dict[str, Set[str]]] = None
+
+    @classmethod
+    def load(cls, path: Optional[Union[str, Path]] = None) -> "ImpactIndex":
+        index = cls(path)
+        try:
+            with open(index.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            index.coverage = data.get("coverage", {})
+            index.includes = data.get("includes", {})
+        except (OSError, ValueError):
+            pass
+        return index
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"coverage": self.coverage, "includes": self.includes}, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def _invalidate(self) -> None:
+        self._reverse = None
+        self._included_by = None
+
+    def ingest_coverage(self, case: str, sources: Iterable[str]) -> None:
+        """Replace the recorded coverage of one case"""
+        self.coverage[case] = {"sources": sorted(set(sources)), "updated": time.time()}
+        self._invalidate()
+
+    def remove_case(self, case: str) -> None:
+        self.coverage.pop(case, None)
+        self._invalidate()
+
+    def scan_includes(self, root: Union[str, Path], subdirs: Iterable[str] = ("source", "include")) -> int:
+        """Refresh the include graph under `root`; return how many files were re-read"""
+        root = str(root)
+        seen = set()
+        rescanned = 0
+        headers: Dict[str, List[str]] = {}
+        files = []
+        for subdir in subdirs:
+            for dirpath, _, filenames in os.walk(os.path.join(root, subdir)):
+                for filename in filenames:
+                    if filename.endswith(SOURCE_SUFFIXES):
+                        full_path = os.path.join(dirpath, filename)
+                        rel_path = os.path.relpath(full_path, root).replace("\\", "/")
+                        files.append((rel_path, full_path))
+                        headers.setdefault(filename, []).append(rel_path)
+
+        for rel_path, full_path in files:
+            seen.add(rel_path)
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                continue
+            stat_key = [st.st_mtime_ns, st.st_size]
+            entry = self.includes.get(rel_path)
+            if entry and entry.get("stat") == stat_key:
+                continue
+            with open(full_path, "r", encoding="utf-8", errors="replace") as f:
+                names = INCLUDE_RE.findall(f.read())
+            # includes are resolved by file name, system headers resolve to nothing
+            resolved = sorted({
+                target for name in names for target in headers.get(os.path.basename(name), [])
+                if target != rel_path
+            })
+            self.includes[rel_path] = {"stat": stat_key, "includes": resolved}
+            rescanned += 1
+
+        for rel_path in [path for path in self.includes if path not in seen]:
+            del self.includes[rel_path]
+            rescanned += 1
+        if rescanned:
+            self._invalidate()
+        return rescanned
+
+    def _reverse_coverage(self) -> Dict[str, Set[str]]:
+        if self._reverse is None:
+            self._reverse = {}
+            for case, entry in self.coverage.items():
+                for source in entry["sources"]:
+                    self._reverse.setdefault(source, set()).add(case)
+        return self._reverse
+
+    def _dependents(self, source: str) -> Set[str]:
+        """`source` plus every file including it, transitively"""
+        if self._included_by is None:
+            self._included_by = {}
+            for path, entry in self.includes.items():
+                for target in entry["includes"]:
+                    self._included_by.setdefault(target, set()).add(path)
+        result = {source}
+        stack = [source]
+        while stack:
+            for parent in self._included_by.get(stack.pop(), ()):
+                if parent not in result:
+                    result.add(parent)
+                    stack.append(parent)
+        return result
+
+    def cases_for(self, source: str) -> Set[str]:
+        reverse = self._reverse_coverage()
+        cases = set()
+        for path in self._dependents(source):
+            cases |= reverse.get(path, set())
+        return cases
+
+    def select(
+        self,
+        changed_files: Iterable[str],
+        max_age: Optional[float] = None,
+        max_fraction: Optional[float] = None,
+    ) -> Tuple[Optional[Set[str]], str]:
+        """Return (cases to run, reason); cases is None when the full suite must run"""
+        if max_age is None:
+            max_age = float(os.getenv("CI_IMPACT_MAX_AGE", DEFAULT_MAX_AGE))
+        if max_fraction is None:
+            max_fraction = float(os.getenv("CI_IMPACT_MAX_FRACTION", DEFAULT_MAX_FRACTION))
+        if not self.coverage:
+            return None, "no coverage data in impact index"
+        oldest = min(entry["updated"] for entry in self.coverage.values())
+        if time.time() - oldest > max_age:
+            return None, f"coverage data older than {max_age / 86400:.0f} days"
+
+        changed_files = list(changed_files)
+        selected = set()
+        for path in changed_files:
+            path = path.replace("\\", "/")
+            if path.startswith("test/cases/") and path.endswith(".py"):
+                selected.add(path[len("test/"):])
+            elif _matches(path, FULL_SUITE_PATTERNS):
+                return None, f"{path} may affect every case"
+            elif _matches(path, IGNORED_PATTERNS):
+                continue
+            elif not path.endswith(SOURCE_SUFFIXES):
+                return None, f"no impact rule for {path}"
+            else:
+                cases = self.cases_for(path)
+                if not cases:
+                    return None, f"no case covers {path}"
+                selected |= cases
+
+        if len(selected) > max_fraction * len(self.coverage):
+            return None, f"{len(selected)} of {len(self.coverage)} cases affected"
+        return selected, f"{len(selected)} cases affected by {len(changed_files)} changed files"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the source-to-case impact index")
+    parser.add_argument("--index", default=None, help="index file (default: CI_IMPACT_INDEX)")
+    sub = parser.add_subparsers(dest="action", required=True)
+    ingest = sub.add_parser("ingest", help="record the coverage of one case from an lcov tracefile")
+    ingest.add_argument("case")
+    ingest.add_argument("lcov")
+    ingest.add_argument("--root", default=None, help="strip this prefix from source paths")
+    scan = sub.add_parser("scan-includes", help="refresh the include graph of a source tree")
+    scan.add_argument("root")
+    query = sub.add_parser("query", help="print the cases affected by changed files")
+    query.add_argument("files", nargs="*")
+    query.add_argument("--changed-file", default=None, help="read changed files from docs_changed.txt")
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    index = ImpactIndex.load(args.index)
+    if args.action == "ingest":
+        sources = read_lcov(args.lcov, args.root)
+        index.ingest_coverage(args.case, sources)
+        index.save()
+        print(f"{args.case}: {len(sources)} covered source files")
+    elif args.action == "scan-includes":
+        print(f"Re-read {index.scan_includes(args.root)} files")
+        index.save()
+    elif args.action == "query":
+        files = list(args.files)
+        if args.changed_file:
+            with open(args.changed_file, "r", encoding="utf-8") as f:
+                files.extend(f.read().split())
+        cases, reason = index.select(files)
+        print(reason)
+        if cases is None:
+            print("full suite")
+            sys.exit(1)
+        for case in sorted(cases):
+            print(case)
+    else:
+        sources = index._reverse_coverage()
+        print(f"cases: {len(index.coverage)}, covered sources: {len(sources)}, "
+              f"include graph files: {len(index.includes)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import os
+import selectors
+import subprocess
+import time
+from typing import Callable, Dict, List, Optional
+
+from tracing import poll_with_rusage
+
+OutputCallback = Callable[[bytes], None]
+# seconds between reap attempts of processes that closed their pipes but still run
+REAP_INTERVAL = 0.05
+
+
+class OutputPump:
+    """Single-threaded reader for the stdout/stderr pipes of child processes.
+
+    Each registered process gets one callback per stream which receives raw
+    output chunks as soon as they are readable. One pump can observe any
+    number of concurrently running children from one loop:
+
+        pump = OutputPump()
+        pump.add(proc_a, on_stdout=..., on_stderr=...)
+        pump.add(proc_b, on_stdout=..., on_stderr=..., on_exit=...)
+        pump.run()
+
+    A process whose pipes are closed is reaped without blocking on later
+    iterations, so one that closes its output but keeps running does not
+    hold up the others.
+
+    Uses `selectors` (epoll/kqueue/poll), so it only works on POSIX; Windows
+    pipes are not selectable and callers fall back to reader threads.
+    """
+
+    def __init__(self, chunk_size: int = 64 * 1024):
+        self.chunk_size = chunk_size
+        self._selector = selectors.DefaultSelector()
+        # proc -> number of its streams still open, until the proc is reaped
+        self._open_streams: Dict[subprocess.Popen, int] = {}
+        # processes with all streams closed that have not been reaped yet
+        self._exiting: List[subprocess.Popen] = []
+        self._on_exit: Dict[subprocess.Popen, Optional[Callable[[subprocess.Popen], None]]] = {}
+        # child resource usage of finished processes, where the platform reports it
+        self.rusage: Dict[subprocess.Popen, object] = {}
+
+    def add(
+        self,
+        proc: subprocess.Popen,
+        on_stdout: Optional[OutputCallback] = None,
+        on_stderr: Optional[OutputCallback] = None,
+        on_exit: Optional[Callable[[subprocess.Popen], None]] = None,
+    ) -> None:
+        """Start watching the piped streams of a process"""
+        streams = 0
+        for stream, callback in ((proc.stdout, on_stdout), (proc.stderr, on_stderr)):
+            if stream is None:
+                continue
+            self._selector.register(stream, selectors.EVENT_READ, (proc, callback))
+            streams += 1
+        self._open_streams[proc] = streams
+        self._on_exit[proc] = on_exit
+        if streams == 0:
+            self._exiting.append(proc)
+
+    @property
+    def active(self) -> int:
+        """Number of processes whose output is still being read"""
+        return len(self._open_streams)
+
+    def _reap(self) -> List[subprocess.Popen]:
+        finished = []
+        for proc in list(self._exiting):
+            reaped, rusage = poll_with_rusage(proc)
+            if not reaped:
+                continue
+            self._exiting.remove(proc)
+            del self._open_streams[proc]
+            if rusage is not None:
+                self.rusage[proc] = rusage
+            on_exit = self._on_exit.pop(proc)
+            if on_exit:
+                on_exit(proc)
+            finished.append(proc)
+        return finished
+
+    def poll(self, timeout: Optional[float] = None) -> List[subprocess.Popen]:
+        """Dispatch readable output once; return the processes that finished"""
+        if not self._open_streams:
+            return []
+        if self._exiting:
+            timeout = REAP_INTERVAL if timeout is None else min(timeout, REAP_INTERVAL)
+        if self._selector.get_map():
+            events = self._selector.select(timeout)
+        else:
+            # only processes left to reap
+            time.sleep(timeout or 0)
+            events = []
+        for key, _ in events:
+            proc, callback = key.data
+            try:
+                data = os.read(key.fd, self.chunk_size)
+            except OSError:
+                data = b""
+            if data:
+                if callback:
+                    callback(data)
+                continue
+            self._selector.unregister(key.fileobj)
+            key.fileobj.close()
+            self._open_streams[proc] -= 1
+            if self._open_streams[proc] == 0:
+                self._exiting.append(proc)
+        return self._reap()
+
+    def run(self) -> None:
+        """Pump output until every registered process has exited"""
+        while self._open_streams:
+            self.poll()
+
+    def close(self) -> None:
+        self._selector.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
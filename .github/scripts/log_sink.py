@@ -0,0 +1,199 @@
+import os
+import re
+import sys
+import time
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+
+class LogSink:
+    """Buffered, append-only byte sink for command output logs.
+
+    The file is opened once and raw bytes are passed through unchanged, so no
+    per-line open/decode happens on the hot path. Data is flushed when the
+    buffer fills up or `flush_interval` seconds have passed since the last
+    flush. When `max_bytes` is set the file is rotated to `<name>.1 .. .N`.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        buffer_size: int = 1024 * 1024,
+        flush_interval: float = 1.0,
+        max_bytes: int = 0,
+        backup_count: int = 3,
+    ):
+        self.path = str(path)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._last_flush = time.monotonic()
+        self._open()
+
+    def _open(self):
+        parent = os.path.dirname(self.path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._file = open(self.path, "ab", buffering=self.buffer_size)
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        self._file.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                src = f"{self.path}.{index}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def write(self, data: bytes) -> None:
+        """Append raw bytes to the log"""
+        if not data:
+            return
+        with self._lock:
+            if self._file is None:
+                return
+            if self.max_bytes and self._size and self._size + len(data) > self.max_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._size += len(data)
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = now
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class LogSinkFactory:
+    """Create the stdout/stderr sinks of one command from a shared configuration.
+
+    By default every command appends to `stdout.log`/`stderr.log` in the
+    current directory, as before. When `log_dir` is set, each command gets its
+    own pair of files named `<seq>-<slug>.stdout.log` in that directory.
+
+    The configuration can be given through the environment:
+      - CI_LOG_DIR:            directory for per-command log files
+      - CI_LOG_FLUSH_INTERVAL: seconds between flushes (default 1.0)
+      - CI_LOG_BUFFER_SIZE:    write buffer size in bytes (default 1 MiB)
+      - CI_LOG_MAX_BYTES:      rotate a log file above this size (0 = never)
+      - CI_LOG_BACKUP_COUNT:   number of rotated files to keep (default 3)
+    """
+
+    def __init__(
+        self,
+        log_dir: Optional[Union[str, Path]] = None,
+        buffer_size: int = 1024 * 1024,
+        flush_interval: float = 1.0,
+        max_bytes: int = 0,
+        backup_count: int = 3,
+    ):
+        self.log_dir = str(log_dir) if log_dir else None
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "LogSinkFactory":
+        return cls(
+            log_dir=os.getenv("CI_LOG_DIR") or None,
+            buffer_size=int(os.getenv("CI_LOG_BUFFER_SIZE", 1024 * 1024)),
+            flush_interval=float(os.getenv("CI_LOG_FLUSH_INTERVAL", 1.0)),
+            max_bytes=int(os.getenv("CI_LOG_MAX_BYTES", 0)),
+            backup_count=int(os.getenv("CI_LOG_BACKUP_COUNT", 3)),
+        )
+
+    def _slug(self, command) -> str:
+        text = " ".join(command) if isinstance(command, (list, tuple)) else str(command)
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "_", text).strip("_")
+        return slug[:48] or "command"
+
+    def paths_for(self, command, log_name: Optional[str] = None):
+        """Return the (stdout, stderr) log paths for a command"""
+        if not self.log_dir:
+            return "stdout.log", "stderr.log"
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        base = log_name or f"{seq:04d}-{self._slug(command)}"
+        return (
+            os.path.join(self.log_dir, f"{base}.stdout.log"),
+            os.path.join(self.log_dir, f"{base}.stderr.log"),
+        )
+
+    def open(self, path: Union[str, Path]) -> LogSink:
+        return LogSink(
+            path,
+            buffer_size=self.buffer_size,
+            flush_interval=self.flush_interval,
+            max_bytes=self.max_bytes,
+            backup_count=self.backup_count,
+        )
+
+    def open_for(self, command, log_name: Optional[str] = None):
+        """Open the (stdout, stderr) sinks for a command"""
+        stdout_path, stderr_path = self.paths_for(command, log_name)
+        return self.open(stdout_path), self.open(stderr_path)
+
+
+def _bench(lines: int = 1_000_000):
+    """Compare the old per-line open/decode writer with LogSink"""
+    import subprocess
+    import tempfile
+
+    producer = [sys.executable, "-c", f"import sys\nfor i in range({lines}): sys.stdout.write(f'line {{i}} ' + 'x' * 60 + '\\n')"]
+
+    def per_line(stream, log_file):
+        for line in iter(stream.readline, b""):
+            try:
+                decoded_line = line.decode("utf-8")
+            except UnicodeDecodeError:
+                decoded_line = line.decode("latin-1")
+            with open(log_file, "a", encoding="utf-8") as f:
+                f.write(decoded_line)
+
+    def sink(stream, log_file):
+        with LogSink(log_file) as s:
+            for line in iter(stream.readline, b""):
+                s.write(line)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, reader in (("per-line open", per_line), ("LogSink", sink)):
+            log_file = os.path.join(tmp, f"{name.replace(' ', '_')}.log")
+            proc = subprocess.Popen(producer, stdout=subprocess.PIPE)
+            start = time.perf_counter()
+            reader(proc.stdout, log_file)
+            proc.wait()
+            elapsed = time.perf_counter() - start
+            print(f"{name:>14}: {lines / elapsed:>12,.0f} lines/sec ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    _bench(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,86 @@
+from typing import Optional
+
+# capture modes accepted by Utils.run_command(capture=...)
+CAPTURE_RING = "ring"
+CAPTURE_FULL = "full"
+
+
+class OutputCapture:
+    """Capture of one output stream with bounded memory.
+
+    In ring mode the first `head_bytes` are kept as they are and the rest goes
+    through a fixed-size ring buffer holding the last `tail_bytes`, so memory
+    stays constant no matter how much a command prints. Full mode keeps
+    everything and is meant for small outputs such as `git log -5`.
+    """
+
+    def __init__(self, mode: str = CAPTURE_RING, head_bytes: int = 64 * 1024, tail_bytes: int = 256 * 1024):
+        if mode not in (CAPTURE_RING, CAPTURE_FULL):
+            raise ValueError(f"Invalid capture mode: {mode}")
+        self.mode = mode
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.total_bytes = 0
+        self._head = bytearray()
+        self._ring = bytearray(tail_bytes) if mode == CAPTURE_RING else bytearray()
+        self._ring_pos = 0
+        self._ring_len = 0
+
+    def write(self, data: bytes) -> None:
+        self.total_bytes += len(data)
+        if self.mode == CAPTURE_FULL:
+            self._head += data
+            return
+
+        room = self.head_bytes - len(self._head)
+        if room > 0:
+            self._head += data[:room]
+            data = data[room:]
+        if not data or not self.tail_bytes:
+            return
+
+        size = self.tail_bytes
+        if len(data) >= size:
+            self._ring[:] = data[-size:]
+            self._ring_pos = 0
+            self._ring_len = size
+            return
+        end = self._ring_pos + len(data)
+        if end <= size:
+            self._ring[self._ring_pos:end] = data
+        else:
+            split = size - self._ring_pos
+            self._ring[self._ring_pos:] = data[:split]
+            self._ring[:end - size] = data[split:]
+        self._ring_pos = end % size
+        self._ring_len = min(size, self._ring_len + len(data))
+
+    @property
+    def omitted_bytes(self) -> int:
+        """Bytes dropped between the retained head and tail"""
+        return self.total_bytes - len(self._head) - self._ring_len
+
+    def getbytes(self) -> bytes:
+        if self.mode == CAPTURE_FULL:
+            return bytes(self._head)
+        if self._ring_len < self.tail_bytes:
+            tail = self._ring[:self._ring_len]
+        else:
+            tail = self._ring[self._ring_pos:] + self._ring[:self._ring_pos]
+        omitted = self.omitted_bytes
+        if omitted:
+            marker = f"\n... [{omitted} bytes omitted] ...\n".encode()
+            return bytes(self._head) + marker + bytes(tail)
+        return bytes(self._head) + bytes(tail)
+
+    def getvalue(self) -> str:
+        data = self.getbytes()
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError:
+            return data.decode('latin-1')
+
+
+def new_capture(mode: Optional[str]) -> Optional[OutputCapture]:
+    """Return an OutputCapture for `mode`, or None when capture is disabled"""
+    return OutputCapture(mode) if mode else None
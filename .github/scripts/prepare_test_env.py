@@ -1,8 +1,9 @@
-import concurrent.futures
+import argparse
 import json
 import logging
 import os
 import platform
+import shlex
 import socket
 import sys
 import subprocess
@@ -11,6 +12,15 @@ from pathlib import Path
 from typing import Any, Dict, List
 
 from utils import Utils
+from async_utils import AsyncUtils, CommandSpec
+from output_capture import CAPTURE_FULL, CAPTURE_RING
+from ssh_pool import SSHPool
+from bundle_dist import BundleBuilder, parse_probe, pr_merge_ref
+from host_fanout import OK as HOST_OK, HostFanout
+from remote_plan import FAILED, WARNING, RemotePlan, failed_step
+from tracing import get_tracer
+from proc_table import ensure_job_marker
+from step_cache import add_no_cache_argument, apply_no_cache_argument
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,6 +29,7 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 script_path = (Path(__file__).parent / "git_ref_lock_cleaner.py").resolve()
+reference_script_path = (Path(__file__).parent / "git_reference_repo.py").resolve()
 
 class TestPreparer:
     """Prepare the environment for testing TDengine or TDinternal
@@ -53,24 +64,45 @@ class TestPreparer:
         self.local_ip = self._get_local_ip()
         # Load host configurations
         self.host_configs = self._load_host_configs()
+        # one SSH transport per remote host for the whole run
+        self.ssh_pool = SSHPool()
+        # BundleBuilder per repository once the coordinator has fetched
+        self.code_bundles = None
+        # what _prepare_code_bundles already did here, the local preparation reuses it
+        self.repos_synced = False
+        self.pr_merge_fetched = False
 
         # Set branch variables
         self._set_branch_variables()
         self.temp_dir = self.utils.path(
             self.wkdir, "tmp", f"{self.pr_number}_{self.run_number}_{self.run_attempt}"
         )
+        # one trace file per job, appended to by build.py and test_runner.py too
+        if not self.utils.get_env_var("CI_TRACE_FILE"):
+            self.utils.set_env_var(
+                "CI_TRACE_FILE",
+                self.utils.path(self.temp_dir, "trace.json"),
+                os.getenv("GITHUB_ENV", ""),
+            )
 
     def _run_git_command(self, repo_path, args):
         """Run a git command and return stdout."""
-        result = subprocess.run(
-            ["git", *args],
-            cwd=repo_path,
-            capture_output=True,
-            text=True,
-            check=True,
+        result = self.utils.run_command(
+            ["git", *args], cwd=repo_path, silent=True, capture=CAPTURE_FULL
         )
         return result.stdout
 
+    def _git_log(self, repo_path, count=5):
+        """Return `git log -<count>` of a repository, bounded in size"""
+        result = self.utils.run_command(
+            ["git", "log", f"-{count}"],
+            cwd=repo_path,
+            check=False,
+            silent=True,
+            capture=CAPTURE_RING,
+        )
+        return ((result.stdout or "") + (result.stderr or "")).rstrip("\n")
+
     def _get_merge_base(self, repo_path):
         """Get merge-base between the PR merge commit and target branch."""
         return self._run_git_command(
@@ -163,43 +195,66 @@ class TestPreparer:
             "GITHUB_RUN_ATTEMPT", self.run_attempt, os.getenv("GITHUB_ENV", "")
         )
 
-    def run_git_ref_lock_cleaner(self, repo_path):
-        logger.info(f"Running cleaner script: {script_path}")
-        if not repo_path.exists():
-            logger.warning(
-                f"Repository path {repo_path} does not exist, skip git_ref_lock_cleaner."
-            )
+    def run_git_ref_lock_cleaners(self, repo_paths):
+        """Run git_ref_lock_cleaner in several repositories concurrently"""
+        self._run_repo_script(script_path, repo_paths)
+
+    def run_git_reference_syncs(self, repo_paths):
+        """Sync the host's shared reference repositories and attach them to
+        the workspaces, so their fetches only transfer refs (CI_GIT_REFERENCE=1)"""
+        if os.getenv("CI_GIT_REFERENCE", "0") != "1":
             return
-        try:
-            subprocess.run(
-                [sys.executable, str(script_path)],
-                cwd=repo_path,
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-        except subprocess.CalledProcessError as e:
-            logger.warning(
-                f"git_ref_lock_cleaner.py failed in {repo_path}.\n"
-                f"Stdout: {e.stdout.strip()}\nStderr: {e.stderr.strip()}"
+        self._run_repo_script(reference_script_path, repo_paths, ["--gc"])
+
+    def _run_repo_script(self, script, repo_paths, args=()):
+        """Run a standalone script in several repositories concurrently"""
+        specs = []
+        for repo_path in repo_paths:
+            if not repo_path.exists():
+                logger.warning(
+                    f"Repository path {repo_path} does not exist, skip {script.name}."
+                )
+                continue
+            specs.append(
+                CommandSpec(
+                    [sys.executable, str(script), *args],
+                    cwd=repo_path,
+                    check=False,
+                    silent=True,
+                    log_name=f"{script.stem}-{repo_path.name}",
+                    capture=CAPTURE_RING,
+                )
             )
-        except OSError as e:
-            logger.warning(f"Failed to run git_ref_lock_cleaner.py in {repo_path}: {e}")
+        logger.info(f"Running script: {script}")
+        results = AsyncUtils(self.utils, limit=len(specs) or 1).run_commands_parallel(
+            specs, return_exceptions=True
+        )
+        for spec, result in zip(specs, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to run {script.name} in {spec.cwd}: {result}")
+            elif result.returncode != 0:
+                logger.warning(
+                    f"{script.name} failed in {spec.cwd}.\n"
+                    f"Stdout: {result.stdout.strip()}\nStderr: {result.stderr.strip()}"
+                )
 
     def prepare_repositories(self):
         """
         Prepare both TDengine and TDinternal repositories for CI.
 
         This method:
-        1. Runs git_ref_lock_cleaner for each repo to clean ref lock errors and ensure fetch/prune are done.
+        1. Runs git_ref_lock_cleaner for both repos concurrently to clean ref lock errors and ensure fetch/prune are done.
         2. Prepares each repository to the correct branch (source/target) for testing.
         3. Avoids redundant git fetch/prune since cleaner already synchronizes the repo state.
 
         After this step, all repositories are ready for CI and up-to-date.
         """
         logger.info(f"Preparing TDinternal in {self.wkdir}...")
-        self.run_git_ref_lock_cleaner(self.wk)
-        self.run_git_ref_lock_cleaner(self.wkc)
+        if self.repos_synced:
+            logger.info("Repositories were synchronized for the code bundles, skip cleaners.")
+        else:
+            self.run_git_reference_syncs([self.wk, self.wkc])
+            self.run_git_ref_lock_cleaners([self.wk, self.wkc])
         if (
             self.inputs.get("specified_source_branch") == "unavailable"
             and self.inputs.get("specified_target_branch") == "unavailable"
@@ -252,7 +307,7 @@ class TestPreparer:
         # ]
         # self.utils.run_commands(cmds)
         # 记录日志
-        log = subprocess.getoutput(f"cd {repo_path} && git log -5")
+        log = self._git_log(repo_path)
         with open(f"{self.wkdir}/jenkins.log", "a") as f:
             f.write(f"{repo_log_name} log: {log}\n")
 
@@ -263,7 +318,7 @@ class TestPreparer:
         # cmds = [f"cd {repo_path} && git pull"]
         # self.utils.run_commands(cmds)
         # 记录日志
-        log = subprocess.getoutput(f"cd {repo_path} && git log -5")
+        log = self._git_log(repo_path)
         with open(f"{self.wkdir}/jenkins.log", "a") as f:
             now = datetime.now().strftime("%Y%m%d-%H%M%S")
             f.write(
@@ -272,13 +327,17 @@ class TestPreparer:
             f.write(f"CHANGE_BRANCH:{self.source_branch}\n")
             f.write(f"{repo_log_name} log: {log}\n")
         # fetch PR 并切换
-        cmds = [
-            f"cd {repo_path} && git fetch origin +refs/pull/{pr_number}/merge",
-            f"cd {repo_path} && git checkout -qf FETCH_HEAD",
-        ]
+        if self.pr_merge_fetched:
+            # the commit the remote hosts got in their bundles
+            cmds = [f"cd {repo_path} && git checkout -qf {pr_merge_ref(pr_number)}"]
+        else:
+            cmds = [
+                f"cd {repo_path} && git fetch origin +refs/pull/{pr_number}/merge",
+                f"cd {repo_path} && git checkout -qf FETCH_HEAD",
+            ]
         self.utils.run_commands(cmds)
         # 记录 merge 后日志
-        log_merged = subprocess.getoutput(f"cd {repo_path} && git log -5")
+        log_merged = self._git_log(repo_path)
         with open(f"{self.wkdir}/jenkins.log", "a") as f:
             f.write(f"{repo_log_name} log merged: {log_merged}\n")
 
@@ -337,28 +396,9 @@ class TestPreparer:
         )
 
     def _execute_remote_command(self, host_config, command):
-        """Execute a command on remote host via SSH"""
+        """Execute a command on remote host via SSH, on the host's pooled transport"""
         try:
-            import paramiko
-
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-            # Connect to remote host
-            ssh.connect(
-                hostname=host_config["host"],
-                username=host_config["username"],
-                timeout=30,
-            )
-
-            # Execute command
-            stdin, stdout, stderr = ssh.exec_command(command)
-            stdout_text = stdout.read().decode("utf-8")
-            stderr_text = stderr.read().decode("utf-8")
-            exit_code = stdout.channel.recv_exit_status()
-
-            ssh.close()
-
+            exit_code, stdout_text, stderr_text = self.ssh_pool.execute(host_config, command)
             success = exit_code == 0
             output = stdout_text if success else stderr_text
             return success, output
@@ -366,198 +406,190 @@ class TestPreparer:
         except Exception as e:
             return False, str(e)
 
-    def _prepare_repositories_remote(self, host_config):
-        """Prepare repositories on remote host."""
-        host = host_config["host"]
-        workdir = host_config["workdir"]
-        username = host_config["username"]
-        remote_script = f"{workdir}/git_ref_lock_cleaner.py"
+    def _tdinternal_branch(self):
+        """Branch TDinternal is prepared on, community always uses the target branch"""
+        return self.target_branch if all(
+            self.inputs.get(k) == "unavailable"
+            for k in ["specified_source_branch", "specified_target_branch", "specified_pr_number"]
+        ) else self.source_branch
 
-        logger.info(f"[{host}] Start remote repository preparation.")
+    def _prepare_code_bundles(self):
+        """Fetch once here and set up thin bundles for the remote hosts.
 
-        # 1. Distribute cleaner script
+        Returns {"tdinternal": BundleBuilder, "community": BundleBuilder}, or None
+        when CI_CODE_BUNDLE=0 or the fetch fails; hosts then fetch from origin.
+        The syncs, cleaners and PR fetch done here are not repeated by the
+        local preparation afterwards.
+        """
+        if os.getenv("CI_CODE_BUNDLE", "1") == "0":
+            return None
         try:
-            subprocess.run(
-                ["scp", str(script_path), f"{username}@{host}:{remote_script}"],
-                check=True
-            )
-            logger.info(f"[{host}] Cleaner script sent to {remote_script}.")
+            with get_tracer().span("prepare_code_bundles"):
+                self.run_git_reference_syncs([self.wk, self.wkc])
+                self.run_git_ref_lock_cleaners([self.wk, self.wkc])
+                self.repos_synced = True
+                pr_repo = self.wk if self.enterprise else self.wkc
+                self.utils.run_command(
+                    ["git", "fetch", "origin", f"+refs/pull/{self.pr_number}/merge:{pr_merge_ref(self.pr_number)}"],
+                    cwd=pr_repo,
+                )
+                self.pr_merge_fetched = True
+                bundle_dir = self.utils.path(self.temp_dir, "bundles")
+                tdinternal_refs = [f"refs/remotes/origin/{self._tdinternal_branch()}"]
+                community_refs = [f"refs/remotes/origin/{self.target_branch}"]
+                (tdinternal_refs if self.enterprise else community_refs).append(pr_merge_ref(self.pr_number))
+                return {
+                    "tdinternal": BundleBuilder(self.utils, self.wk, tdinternal_refs, bundle_dir),
+                    "community": BundleBuilder(self.utils, self.wkc, community_refs, bundle_dir),
+                }
         except Exception as e:
-            logger.error(f"[{host}] Failed to send cleaner script: {e}")
-            return False
+            logger.error(f"Code bundles unavailable, remote hosts fetch from origin: {e}")
+            return None
 
-        # 2. Prepare TDinternal
-        branch = self.target_branch if all(
-            self.inputs.get(k) == "unavailable"
-            for k in ["specified_source_branch", "specified_target_branch", "specified_pr_number"]
-        ) else self.source_branch
-        td_cmd = (
+    def _send_code_bundles(self, host_config):
+        """Upload the bundles a host needs, return {repo: remote bundle path or None},
+        or None when the host cannot be probed and has to fetch from origin"""
+        host = host_config["host"]
+        workdir = host_config["workdir"]
+        repos = {"tdinternal": f"{workdir}/TDinternal", "community": f"{workdir}/TDinternal/community"}
+        probe = " && echo -- && ".join(
+            builder.probe_command(repos[repo]) for repo, builder in self.code_bundles.items()
+        )
+        exit_code, stdout, stderr = self.ssh_pool.execute(host_config, probe)
+        sections = stdout.split("--\n")
+        if exit_code != 0 or len(sections) != len(self.code_bundles):
+            logger.warning(f"[{host}] Probe failed ({exit_code}), host fetches from origin: {stderr.strip()}")
+            return None
+        remote_bundles = {}
+        for (repo, builder), section in zip(self.code_bundles.items(), sections):
+            path = builder.bundle_for(parse_probe(section))
+            remote_bundles[repo] = None
+            if path:
+                remote_bundles[repo] = f"{workdir}/{os.path.basename(path)}"
+                self.ssh_pool.put(host_config, path, remote_bundles[repo])
+                logger.info(f"[{host}] Bundle sent to {remote_bundles[repo]}.")
+        return remote_bundles
+
+    def _prepare_repositories_remote(self, host_config, plan, bundles=None):
+        """Add the repository preparation steps of a remote host to its plan;
+        with bundles the refs come from them instead of the cleaner's fetch"""
+        workdir = host_config["workdir"]
+        remote_script = f"{workdir}/git_ref_lock_cleaner.py"
+        cleaner = "" if bundles else f"python3 {remote_script} && "
+        if not bundles and os.getenv("CI_GIT_REFERENCE", "0") == "1":
+            # the host's fetches below then only transfer refs
+            for repo in ("TDinternal", "TDinternal/community"):
+                plan.add(
+                    f"reference-{os.path.basename(repo).lower()}",
+                    f"cd {workdir}/{repo} && python3 {workdir}/git_reference_repo.py --gc",
+                    required=False,
+                )
+
+        # 1. Prepare TDinternal
+        plan.add(
+            "prepare-tdinternal",
             f"cd {workdir}/TDinternal && "
-            f"python3 {remote_script} && "
+            f"{cleaner}"
             "git reset --hard && git clean -f && "
-            f"git checkout -f origin/{branch}"
+            f"git checkout -f origin/{self._tdinternal_branch()}",
         )
-        if not self._execute_remote_command(host_config, td_cmd)[0]:
-            logger.error(f"[{host}] TDinternal preparation failed.")
-            return False
 
-        # 3. Prepare community
-        comm_cmd = (
+        # 2. Prepare community
+        plan.add(
+            "prepare-community",
             f"cd {workdir}/TDinternal/community && "
-            f"python3 {remote_script} && "
+            f"{cleaner}"
             "git reset --hard && git clean -f && "
-            f"git checkout -f origin/{self.target_branch}"
+            f"git checkout -f origin/{self.target_branch}",
         )
-        if not self._execute_remote_command(host_config, comm_cmd)[0]:
-            logger.error(f"[{host}] Community preparation failed.")
-            return False
 
-        logger.info(f"[{host}] Remote repository preparation done.")
-        return True
-
-    def _update_codes_remote(self, host_config):
-        """Update codes on remote host"""
-        host = host_config["host"]
+    def _update_codes_remote(self, host_config, plan, bundles=None):
+        """Add the code update steps of a remote host to its plan"""
         workdir = host_config["workdir"]
 
-        logger.info(f"Updating codes on {host}...")
-
         if self.enterprise:
-            logger.info(f"Updating codes for TDinternal on {host}...")
             job_name = "TDinternalCI"
-            success = self._update_latest_merge_from_pr_remote(
-                host_config, f"{workdir}/TDinternal", self.pr_number, job_name
+            self._update_latest_merge_from_pr_remote(
+                host_config, plan, f"{workdir}/TDinternal", self.pr_number, job_name, bundles
             )
-            if not success:
-                return False
-            success = self._update_latest_from_target_branch_remote(
-                host_config, f"{workdir}/TDinternal/community"
+            self._update_latest_from_target_branch_remote(
+                host_config, plan, f"{workdir}/TDinternal/community"
             )
-            if not success:
-                return False
         else:
-            logger.info(f"Updating codes for community on {host}...")
             job_name = "NewTest"
-            success = self._update_latest_merge_from_pr_remote(
-                host_config, f"{workdir}/TDinternal/community", self.pr_number, job_name
+            self._update_latest_merge_from_pr_remote(
+                host_config, plan, f"{workdir}/TDinternal/community", self.pr_number, job_name, bundles
             )
-            if not success:
-                return False
-            success = self._update_latest_from_target_branch_remote(
-                host_config, f"{workdir}/TDinternal"
+            self._update_latest_from_target_branch_remote(
+                host_config, plan, f"{workdir}/TDinternal"
             )
-            if not success:
-                return False
 
-        return True
+    def _remote_log_command(self, host_config, repo_path, title, header=""):
+        """Command appending `git log -5` of a remote repository to the host's jenkins.log"""
+        header_cmd = f"printf '%s\\n' {shlex.quote(header)}; " if header else ""
+        return (
+            f"cd {repo_path} && log=$(git log -5) && "
+            f"{{ {header_cmd}printf '%s: %s\\n\\n' {shlex.quote(title)} \"$log\"; }} "
+            f">> {host_config['workdir']}/jenkins.log"
+        )
 
-    def _update_latest_from_target_branch_remote(self, host_config, repo_path):
-        """Update latest code from target branch on remote host"""
-        host = host_config["host"]
+    def _update_latest_from_target_branch_remote(self, host_config, plan, repo_path):
+        """Add the target branch steps of a remote repository to the plan"""
         repo_log_name = "community" if "community" in repo_path else "tdinternal"
 
-        # # Pull latest code
-        # success, _ = self._execute_remote_command(
-        #     host_config, f"cd {repo_path} && git remote prune origin && git pull"
-        # )
-        # if not success:
-        #     logger.error(f"Failed to pull latest code from target branch on {host}")
-        #     return False
-
         # Log git history
-        success, log = self._execute_remote_command(
-            host_config, f"cd {repo_path} && git log -5"
+        plan.add(
+            f"log-{repo_log_name}",
+            self._remote_log_command(host_config, repo_path, f"{repo_log_name} log"),
+            required=False,
         )
-        if success:
-            log_content = f"{repo_log_name} log: {log}\n"
-            success, _ = self._execute_remote_command(
-                host_config,
-                f"echo '{log_content}' >> {host_config['workdir']}/jenkins.log",
-            )
-            if not success:
-                logger.error(f"Failed to write log on {host}")
-
-        return True
 
     def _update_latest_merge_from_pr_remote(
-        self, host_config, repo_path, pr_number, job_name=""
+        self, host_config, plan, repo_path, pr_number, job_name="", bundles=None
     ):
-        """Update latest codes and merge from PR on remote host"""
-        host = host_config["host"]
+        """Add the PR merge steps of a remote repository to the plan"""
         repo_log_name = "community" if "community" in repo_path else "tdinternal"
 
-        # # Pull latest code
-        # success, _ = self._execute_remote_command(
-        #     host_config, f"cd {repo_path} && git pull"
-        # )
-        # if not success:
-        #     logger.error(f"Failed to pull latest code on {host}")
-        #     return False
-
         # Log git history
-        success, log = self._execute_remote_command(
-            host_config, f"cd {repo_path} && git log -5"
+        now = datetime.now().strftime("%Y%m%d-%H%M%S")
+        header = f"{now} {job_name}/PR-{pr_number}:{self.run_number}:{self.target_branch}\nCHANGE_BRANCH:{self.source_branch}"
+        plan.add(
+            f"log-{repo_log_name}",
+            self._remote_log_command(host_config, repo_path, f"{repo_log_name} log", header),
+            required=False,
         )
-        if success:
-            now = datetime.now().strftime("%Y%m%d-%H%M%S")
-            log_content = f"{now} {job_name}/PR-{pr_number}:{self.run_number}:{self.target_branch}\nCHANGE_BRANCH:{self.source_branch}\n{repo_log_name} log: {log}\n"
-            success, _ = self._execute_remote_command(
-                host_config,
-                f"echo '{log_content}' >> {host_config['workdir']}/jenkins.log",
-            )
-            if not success:
-                logger.error(f"Failed to write log on {host}")
 
-        # Fetch PR and checkout
-        success, _ = self._execute_remote_command(
-            host_config,
-            f"cd {repo_path} && git fetch origin +refs/pull/{pr_number}/merge && git checkout -qf FETCH_HEAD",
-        )
-        if not success:
-            logger.error(f"Failed to fetch and checkout PR on {host}")
-            return False
+        # Fetch PR and checkout, from the bundle the merge commit is already local
+        if bundles:
+            plan.add(f"checkout-pr-{repo_log_name}", f"cd {repo_path} && git checkout -qf {pr_merge_ref(pr_number)}")
+        else:
+            plan.add(
+                f"fetch-pr-{repo_log_name}",
+                f"cd {repo_path} && git fetch origin +refs/pull/{pr_number}/merge && git checkout -qf FETCH_HEAD",
+            )
 
         # Log merged history
-        success, log_merged = self._execute_remote_command(
-            host_config, f"cd {repo_path} && git log -5"
+        plan.add(
+            f"log-merged-{repo_log_name}",
+            self._remote_log_command(host_config, repo_path, f"{repo_log_name} log merged"),
+            required=False,
         )
-        if success:
-            log_content = f"{repo_log_name} log merged: {log_merged}\n"
-            success, _ = self._execute_remote_command(
-                host_config,
-                f"echo '{log_content}' >> {host_config['workdir']}/jenkins.log",
-            )
-            if not success:
-                logger.error(f"Failed to write merged log on {host}")
 
-        return True
-
-    def _update_submodules_remote(self, host_config):
-        """Update submodules on remote host"""
-        host = host_config["host"]
-        workdir = host_config["workdir"]
-
-        logger.info(f"Updating submodules on {host}...")
-        success, _ = self._execute_remote_command(
-            host_config,
-            f"cd {workdir}/TDinternal/community && git submodule update --init --recursive",
+    def _update_submodules_remote(self, host_config, plan):
+        """Add the submodule update step of a remote host to the plan"""
+        plan.add(
+            "update-submodules",
+            f"cd {host_config['workdir']}/TDinternal/community && git submodule update --init --recursive",
         )
-        if not success:
-            logger.error(f"Failed to update submodules on {host}")
-            return False
-        return True
 
-    def _get_testing_params_remote(self, host_config):
-        """Get testing parameters on remote host"""
-        host = host_config["host"]
+    def _get_testing_params_remote(self, host_config, plan):
+        """Add the testing parameter step of a remote host to the plan"""
         workdir = host_config["workdir"]
-
-        logger.info(f"Getting testing parameters on {host}...")
         cmd = f"""
         log_server_file="/home/log_server.json"
         timeout_cmd=""
         extra_param=""
-        
+
         if [ -f "$log_server_file" ]; then
             log_server_enabled=$(jq -r '.enabled' "$log_server_file")
             timeout_param=$(jq -r '.timeout' "$log_server_file")
@@ -573,41 +605,73 @@ class TestPreparer:
         else
             echo "log_server.json file not found"
         fi
-        
+
         echo "timeout_cmd: $timeout_cmd, extra_param: $extra_param"
         echo "timeout_cmd=$timeout_cmd" >> {workdir}/env_vars.txt
         echo "extra_param=$extra_param" >> {workdir}/env_vars.txt
         """
-        success, _ = self._execute_remote_command(host_config, cmd)
-        if not success:
-            logger.error(f"Failed to get testing parameters on {host}")
-            return False
-        return True
+        plan.add("testing-params", cmd)
+
+    def _compile_host_plan(self, host_config, bundles=None):
+        """All remote preparation steps of a host as one plan, `bundles` as
+        returned by _send_code_bundles"""
+        plan = RemotePlan(f"prepare-{host_config['host']}")
+        if bundles is not None:
+            workdir = host_config["workdir"]
+            repos = {"tdinternal": f"{workdir}/TDinternal", "community": f"{workdir}/TDinternal/community"}
+            for repo, builder in self.code_bundles.items():
+                for name, command in builder.apply_commands(repos[repo], bundles[repo]):
+                    plan.add(f"{name}-{repo}", command)
+        self._prepare_repositories_remote(host_config, plan, bundles)
+        self._update_codes_remote(host_config, plan, bundles)
+        # self._update_submodules_remote(host_config, plan)
+        if platform.system().lower() == "linux":
+            self._get_testing_params_remote(host_config, plan)
+        if bundles is not None:
+            # kept until here, so the plan can be run again after a failure
+            for repo, builder in self.code_bundles.items():
+                for name, command in builder.cleanup_commands(bundles[repo]):
+                    plan.add(f"{name}-{repo}", command, required=False)
+        return plan
 
     def _process_single_host(self, host_config):
-        """Process a single host - prepare and update repositories"""
+        """Process a single host - prepare and update repositories with one remote plan"""
         host = host_config["host"]
+        workdir = host_config["workdir"]
         logger.info(f"Processing host: {host}")
 
         try:
-            # Prepare repositories
-            if not self._prepare_repositories_remote(host_config):
-                return False
-
-            # Update codes
-            if not self._update_codes_remote(host_config):
+            bundles = None
+            if self.code_bundles:
+                # Distribute the code, the host does not fetch from origin
+                bundles = self._send_code_bundles(host_config)
+            if bundles is None:
+                # Distribute cleaner script, the plan runs it
+                remote_script = f"{workdir}/git_ref_lock_cleaner.py"
+                self.ssh_pool.put(host_config, script_path, remote_script)
+                logger.info(f"[{host}] Cleaner script sent to {remote_script}.")
+                if os.getenv("CI_GIT_REFERENCE", "0") == "1":
+                    self.ssh_pool.put(host_config, reference_script_path, f"{workdir}/git_reference_repo.py")
+
+            plan = self._compile_host_plan(host_config, bundles)
+            remote_plan = f"{workdir}/prepare_plan_{self.pr_number}_{self.run_number}_{self.run_attempt}.py"
+            result = plan.run(self.ssh_pool, host_config, remote_plan)
+            for step in result["steps"]:
+                line = f"[{host}] {step['status']:>7} {step.get('duration', 0):7.1f}s {step['name']}"
+                if step["status"] in (FAILED, WARNING):
+                    logger.error(f"{line}: {(step['stderr'] or step['stdout']).strip()[-2000:]}")
+                else:
+                    logger.info(line)
+            if not result["ok"]:
+                step = failed_step(result)
+                reason = step["name"] if step else f"startup: {result.get('error', '').strip()}"
+                logger.error(f"[{host}] Remote plan failed at {reason}")
                 return False
 
-            # # Update submodules
-            # if not self._update_submodules_remote(host_config):
-            #     return False
-
-            # Get testing parameters
-            if platform.system().lower() == "linux":
-                if not self._get_testing_params_remote(host_config):
-                    return False
-
-            logger.info(f"Successfully processed host: {host}")
+            logger.info(
+                f"Successfully processed host: {host} "
+                f"({len(result['steps'])} steps in {result['duration']:.1f}s)"
+            )
             return True
 
         except Exception as e:
@@ -625,21 +689,27 @@ class TestPreparer:
             # Process remote hosts if configured
             if self.host_configs:
                 logger.info(f"Processing {len(self.host_configs)} remote hosts...")
-                success = self._process_remote_hosts()
+                self.code_bundles = self._prepare_code_bundles()
+                with get_tracer().span("process_remote_hosts", hosts=len(self.host_configs)):
+                    try:
+                        success = self._process_remote_hosts()
+                    finally:
+                        self.ssh_pool.close()
                 if not success:
                     logger.error("Failed to process some remote hosts")
                     return False
 
             # Process local environment
             logger.info("Processing local environment...")
-            if platform.system().lower() == "linux":
-                self.output_environment_info()
-            self.prepare_repositories()
-            self.update_codes()
-            # self.update_submodules()
-            self.output_file_no_doc_change()
-            if platform.system().lower() == "linux":
-                self.get_testing_params()
+            with get_tracer().span("prepare_local"):
+                if platform.system().lower() == "linux":
+                    self.output_environment_info()
+                self.prepare_repositories()
+                self.update_codes()
+                # self.update_submodules()
+                self.output_file_no_doc_change()
+                if platform.system().lower() == "linux":
+                    self.get_testing_params()
 
             logger.info("Preparation phase completed successfully.")
             return True
@@ -663,31 +733,25 @@ class TestPreparer:
         logger.info(
             f"Starting remote host processing: {len(self.host_configs)} hosts in total."
         )
-        max_threads = max(1, min(len(self.host_configs), 10))
+        hosts = [
+            host_config
+            for host_config in self.host_configs
+            if host_config["host"] != self.local_ip
+        ]
+        # hosts block on SSH I/O, the fan-out adapts how many run at once
+        fanout = HostFanout.from_env()
         results = []
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
-            future_to_host = {
-                executor.submit(self._process_single_host, host_config): host_config
-                for host_config in self.host_configs
-                if host_config["host"] != self.local_ip
-            }
-
-            for future in concurrent.futures.as_completed(future_to_host):
-                host_config = future_to_host[future]
-                host = host_config["host"]
-                try:
-                    result = future.result()
-                    results.append((host, result))
-                    if result:
-                        logger.info(f"[{host}] ✓ Host processed successfully.")
-                    else:
-                        logger.error(f"[{host}] ✗ Host processing failed.")
-                except Exception as e:
-                    logger.error(
-                        f"[{host}] ✗ Host processing failed with exception: {e}"
-                    )
-                    results.append((host, False))
+        for state in fanout.run(
+            hosts,
+            self._process_single_host,
+            on_deadline=lambda host_config: self.ssh_pool.close_host(host_config["host"]),
+        ):
+            host = state["host"]
+            if state["status"] == HOST_OK:
+                logger.info(f"[{host}] ✓ Host processed successfully.")
+            else:
+                logger.error(f"[{host}] ✗ Host processing failed. {state.get('error', '')}".rstrip())
+            results.append((host, state["status"] == HOST_OK))
 
         failed_hosts = [host for host, success in results if not success]
         if failed_hosts:
@@ -702,5 +766,9 @@ class TestPreparer:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prepare the repositories of the coordinator and the remote hosts")
+    add_no_cache_argument(parser)
+    apply_no_cache_argument(parser.parse_args())
+    ensure_job_marker()
     prepare = TestPreparer()
     assert prepare.run() == True
@@ -0,0 +1,190 @@
+import os
+import re
+import signal
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+# set once by the entry points (build.py, test_runner.py, prepare_test_env.py);
+# every command they start inherits it, so processes of this job can be told
+# apart from other jobs on a shared runner even after re-parenting to init
+JOB_MARKER_ENV = "CI_JOB_MARKER"
+
+
+def ensure_job_marker() -> str:
+    """Set the job marker in our environment (inherited by children) and return it"""
+    marker = os.environ.get(JOB_MARKER_ENV)
+    if not marker:
+        run_id = os.getenv("GITHUB_RUN_ID", "local")
+        attempt = os.getenv("GITHUB_RUN_ATTEMPT", "0")
+        marker = f"{run_id}-{attempt}-{os.getpid()}"
+        os.environ[JOB_MARKER_ENV] = marker
+    return marker
+
+
+class ProcessInfo:
+    """One /proc entry"""
+
+    __slots__ = ("pid", "ppid", "pgid", "sid", "name", "cmdline")
+
+    def __init__(self, pid: int, ppid: int, pgid: int, sid: int, name: str, cmdline: List[str]):
+        self.pid = pid
+        self.ppid = ppid
+        self.pgid = pgid
+        self.sid = sid
+        self.name = name
+        self.cmdline = cmdline
+
+    @property
+    def command(self) -> str:
+        return " ".join(self.cmdline) if self.cmdline else f"[{self.name}]"
+
+    def environ_value(self, key: str) -> Optional[str]:
+        """Read one variable of the process environment (None if absent or not readable)"""
+        try:
+            with open(f"/proc/{self.pid}/environ", "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        prefix = key.encode() + b"="
+        for item in data.split(b"\0"):
+            if item.startswith(prefix):
+                return item[len(prefix):].decode(errors="replace")
+        return None
+
+    def __repr__(self):
+        return f"ProcessInfo(pid={self.pid}, ppid={self.ppid}, name={self.name!r})"
+
+
+class ProcessTable:
+    """Snapshot of /proc, indexed by pid, name and parent pid.
+
+    Replaces pgrep/pkill/killall shell-outs: the table is read once in-process
+    and can be queried many times. Linux only.
+
+        table = ProcessTable.snapshot()
+        pids = [p.pid for p in table.find(cmdline="run_case.sh")]
+        ProcessTable.terminate(pids)
+    """
+
+    def __init__(self, processes: Iterable[ProcessInfo]):
+        self.by_pid: Dict[int, ProcessInfo] = {}
+        self.by_name: Dict[str, List[ProcessInfo]] = {}
+        self.children: Dict[int, List[ProcessInfo]] = {}
+        for proc in processes:
+            self.by_pid[proc.pid] = proc
+            self.by_name.setdefault(proc.name, []).append(proc)
+            self.children.setdefault(proc.ppid, []).append(proc)
+
+    @staticmethod
+    def supported() -> bool:
+        return os.path.isdir("/proc/self") and os.path.exists("/proc/self/stat")
+
+    @classmethod
+    def _read_process(cls, pid: int) -> Optional[ProcessInfo]:
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                stat = f.read().decode(errors="replace")
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                raw_cmdline = f.read()
+        except OSError:
+            return None  # the process exited while scanning
+        # comm is enclosed in parentheses and may itself contain spaces or ')'
+        name = stat[stat.index("(") + 1:stat.rindex(")")]
+        fields = stat[stat.rindex(")") + 2:].split()
+        cmdline = [arg.decode(errors="replace") for arg in raw_cmdline.split(b"\0") if arg]
+        return ProcessInfo(pid, int(fields[1]), int(fields[2]), int(fields[3]), name, cmdline)
+
+    @classmethod
+    def snapshot(cls) -> "ProcessTable":
+        processes = []
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                proc = cls._read_process(int(entry))
+                if proc is not None:
+                    processes.append(proc)
+        return cls(processes)
+
+    def find(self, name: Optional[str] = None, cmdline: Optional[str] = None) -> List[ProcessInfo]:
+        """Processes with exactly this `name` (like killall) and/or whose command
+        line matches the regex `cmdline` (like pgrep -f); our own process is never
+        returned. A `cmdline` that is not a valid regex is matched literally."""
+        candidates = self.by_name.get(name, []) if name is not None else self.by_pid.values()
+        pattern = None
+        if cmdline is not None:
+            try:
+                pattern = re.compile(cmdline)
+            except re.error:
+                pattern = re.compile(re.escape(cmdline))
+        own = os.getpid()
+        return [
+            proc for proc in candidates
+            if proc.pid != own and (pattern is None or pattern.search(proc.command))
+        ]
+
+    def descendants(self, pid: int) -> List[ProcessInfo]:
+        """All processes below `pid` in the process tree"""
+        result = []
+        stack = list(self.children.get(pid, []))
+        while stack:
+            proc = stack.pop()
+            result.append(proc)
+            stack.extend(self.children.get(proc.pid, []))
+        return result
+
+    def job_processes(self, marker: Optional[str] = None) -> List[ProcessInfo]:
+        """Processes of this job: our descendants plus orphans carrying the job marker"""
+        marker = marker or os.environ.get(JOB_MARKER_ENV)
+        scoped = {proc.pid: proc for proc in self.descendants(os.getpid())}
+        if marker:
+            for proc in self.by_pid.values():
+                if proc.pid not in scoped and proc.pid != os.getpid() \
+                        and proc.environ_value(JOB_MARKER_ENV) == marker:
+                    scoped[proc.pid] = proc
+                    for child in self.descendants(proc.pid):
+                        scoped.setdefault(child.pid, child)
+        return list(scoped.values())
+
+    @staticmethod
+    def _alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        # a zombie is dead for our purposes
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                return f.read().rsplit(b")", 1)[1].split()[0] != b"Z"
+        except (OSError, IndexError):
+            return False
+
+    @classmethod
+    def terminate(cls, pids: Iterable[int], timeout: float = 5.0) -> Set[int]:
+        """Send SIGTERM, then SIGKILL to whatever is still alive after `timeout`.
+        Return the pids that had to be killed with SIGKILL."""
+        pending = set()
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                pending.add(pid)
+            except (ProcessLookupError, PermissionError):
+                continue
+        deadline = time.monotonic() + timeout
+        while pending and time.monotonic() < deadline:
+            pending = {pid for pid in pending if cls._alive(pid)}
+            if pending:
+                time.sleep(0.1)
+        killed = set()
+        for pid in pending:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                killed.add(pid)
+            except (ProcessLookupError, PermissionError):
+                continue
+        return killed
+
+    def kill_tree(self, pid: int, timeout: float = 5.0) -> Set[int]:
+        """Terminate `pid` and all its descendants, children first"""
+        tree = [proc.pid for proc in reversed(self.descendants(pid))] + [pid]
+        return self.terminate(tree, timeout)
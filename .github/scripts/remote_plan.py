@@ -0,0 +1,116 @@
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+# the JSON result is the stdout line after this marker
+RESULT_MARKER = "@@REMOTE_PLAN_RESULT@@"
+# bytes of each step's stdout/stderr kept in the result
+OUTPUT_TAIL = 64 * 1024
+
+OK = "ok"
+FAILED = "failed"
+WARNING = "warning"
+SKIPPED = "skipped"
+
+# Executed by python3 on the remote host; it only needs the standard library.
+_RUNNER = '''import json
+import subprocess
+import sys
+import time
+
+STEPS = json.loads(%(steps)r)
+results = []
+ok = True
+for step in STEPS:
+    if not ok:
+        results.append({"name": step["name"], "status": "skipped"})
+        continue
+    start = time.time()
+    proc = subprocess.run(["bash", "-c", step["command"]], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode == 0:
+        status = "ok"
+    elif step["required"]:
+        status = "failed"
+        ok = False
+    else:
+        status = "warning"
+    results.append({
+        "name": step["name"],
+        "status": status,
+        "exit_code": proc.returncode,
+        "duration": round(time.time() - start, 3),
+        "stdout": proc.stdout[-%(tail)d:].decode("utf-8", "replace"),
+        "stderr": proc.stderr[-%(tail)d:].decode("utf-8", "replace"),
+    })
+print(%(marker)r + json.dumps({"ok": ok, "steps": results}))
+sys.exit(0 if ok else 1)
+'''
+
+
+class RemotePlan:
+    """Remote preparation steps compiled into one script.
+
+    Instead of a network round trip per command, the steps of a host are
+    collected here, rendered into a single Python script, uploaded and run
+    once. The script runs the steps in order with bash, stops at the first
+    failing required step and prints a JSON result with the status, exit
+    code, duration and output tail of every step:
+
+        plan = RemotePlan("prepare")
+        plan.add("checkout", f"cd {repo} && git checkout -f origin/main")
+        plan.add("log", f"cd {repo} && git log -5 >> jenkins.log", required=False)
+        result = plan.run(ssh_pool, host_config, f"{workdir}/prepare_plan.py")
+
+    Steps should be idempotent, so a plan can simply be run again.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.steps: List[Dict[str, Any]] = []
+
+    def add(self, name: str, command: str, required: bool = True) -> None:
+        """Add a step; a failing step that is not required is only a warning"""
+        self.steps.append({"name": name, "command": command, "required": required})
+
+    def render(self) -> str:
+        return _RUNNER % {"steps": json.dumps(self.steps), "tail": OUTPUT_TAIL, "marker": RESULT_MARKER}
+
+    def run(self, ssh_pool, host_config: Dict[str, Any], remote_path: str) -> Dict[str, Any]:
+        """Upload and run the plan on a host, return its result"""
+        start = time.time()
+        with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False, encoding="utf-8") as f:
+            f.write(self.render())
+            local_path = f.name
+        try:
+            ssh_pool.put(host_config, local_path, remote_path)
+        finally:
+            os.unlink(local_path)
+        exit_code, stdout, stderr = ssh_pool.execute(
+            host_config, f"python3 {remote_path}; rc=$?; rm -f {remote_path}; exit $rc"
+        )
+        result = parse_result(stdout)
+        if result is None:
+            # the runner itself failed, e.g. no python3 on the host
+            result = {"ok": False, "steps": [], "error": (stderr or stdout)[-OUTPUT_TAIL:]}
+        result["exit_code"] = exit_code
+        result["duration"] = round(time.time() - start, 3)
+        return result
+
+
+def parse_result(stdout: str) -> Optional[Dict[str, Any]]:
+    for line in reversed(stdout.splitlines()):
+        if line.startswith(RESULT_MARKER):
+            try:
+                return json.loads(line[len(RESULT_MARKER):])
+            except ValueError:
+                return None
+    return None
+
+
+def failed_step(result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    for step in result.get("steps", []):
+        if step.get("status") == FAILED:
+            return step
+    return None
@@ -0,0 +1,178 @@
+import argparse
+import hashlib
+import os
+import re
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from case_registry import extract_case_path, is_active_task_line
+from duration_store import PASS
+from step_cache import StepCache, file_digest
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "taos-ci", "results")
+# entries unused for this long are evicted (seconds)
+DEFAULT_MAX_AGE = 14 * 24 * 3600
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+CACHED_PASS = "cached-pass"
+RUN = "run"
+
+
+class ResultCache(StepCache):
+    """Passed test cases keyed by everything that can change their result.
+
+    The key of a task line is a hash of the case file, the task line itself,
+    the built binaries (taosd, taos, libtaos) and the given config files. A
+    line whose key was recorded as passed is reported as cached-pass and not
+    run again, e.g. on attempt 2 of a PR whose attempt 1 failed elsewhere:
+
+        cache = ResultCache(binaries=[taosd, taos], configs=[run_sh])
+        to_run, decisions = cache.filter(task_lines, case_root=f"{wkc}/test")
+        ...  # run to_run
+        cache.record_passes(read_log_dir_records(log_dir))
+
+    Entries share the StepCache storage format, eviction and stats. The
+    cache disables itself when a binary is missing, because the key would
+    then not tell builds apart.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Union[str, Path]] = None,
+        enabled: Optional[bool] = None,
+        binaries: Iterable[Union[str, Path]] = (),
+        configs: Iterable[Union[str, Path]] = (),
+    ):
+        super().__init__(cache_dir or os.getenv("CI_RESULT_CACHE_DIR") or DEFAULT_CACHE_DIR, enabled)
+        self.binaries = [str(p) for p in binaries]
+        self.configs = [str(p) for p in configs]
+        missing = [p for p in self.binaries if not os.path.exists(p)]
+        if self.enabled and missing:
+            print(f"Result cache disabled, binaries not found: {missing}")
+            self.enabled = False
+        self._environment = None
+        # task line -> key of the lines returned by filter()
+        self.pending: Dict[str, Tuple[str, str]] = {}
+
+    def environment_digest(self) -> str:
+        """Digest of binaries and configs, computed once per run"""
+        if self._environment is None:
+            digest = hashlib.sha256()
+            for path in self.binaries + self.configs:
+                digest.update(f"{path}={file_digest(path)}\0".encode())
+            self._environment = digest.hexdigest()
+        return self._environment
+
+    def line_key(self, task_line: str, case_file: Union[str, Path]) -> str:
+        digest = hashlib.sha256()
+        digest.update(task_line.strip().encode())
+        digest.update(f"\0case={file_digest(case_file)}".encode())
+        digest.update(f"\0env={self.environment_digest()}".encode())
+        return digest.hexdigest()
+
+    def filter(self, task_lines: List[str], case_root: Union[str, Path]) -> Tuple[List[str], List[Tuple[str, str, str]]]:
+        """Return (lines to run, [(decision, case, line)]) for the active lines"""
+        to_run = []
+        decisions = []
+        for line in task_lines:
+            if not is_active_task_line(line):
+                continue
+            case = extract_case_path(line)
+            if not case or not self.enabled:
+                to_run.append(line)
+                decisions.append((RUN, case, line))
+                continue
+            key = self.line_key(line, os.path.join(str(case_root), case))
+            if self.lookup(key):
+                decisions.append((CACHED_PASS, case, line))
+            else:
+                to_run.append(line)
+                decisions.append((RUN, case, line))
+                self.pending[line] = (case, key)
+        return to_run, decisions
+
+    def record_passes(self, records: Iterable[Sequence]) -> int:
+        """Store the lines handed out by filter() that passed.
+
+        `records` are (case, outcome, seconds, result line) in log order, see
+        duration_store.read_log_dir_records. run.sh prints the task fields on
+        the result line, so a result belongs to the pending line whose
+        command it shows; a case on several task lines (e.g. with different
+        -N) is judged per line. A result line without the command only
+        counts for a case with a single pending line.
+        """
+        by_case: Dict[str, List[Tuple[str, str]]] = {}
+        for case, outcome, _, text in records:
+            by_case.setdefault(case, []).append((outcome, text))
+        lines_per_case = Counter(case for case, _ in self.pending.values())
+        stored = 0
+        for line, (case, key) in self.pending.items():
+            results = by_case.get(case, [])
+            command = task_command(line)
+            # the command must end where the result line's time or end follows
+            own = re.compile(re.escape(command) + r"\s*(?:\[|$)") if command else None
+            outcomes = [outcome for outcome, text in results if own and own.search(text)]
+            if not outcomes and lines_per_case[case] == 1:
+                outcomes = [outcome for outcome, _ in results]
+            if outcomes and outcomes[-1] == PASS:
+                self.store(key, line, [case])
+                stored += 1
+        return stored
+
+    def invalidate(self, cases: Optional[Iterable[str]] = None) -> int:
+        """Drop the entries of `cases`, or every entry"""
+        if cases is None:
+            return self.clear()
+        cases = set(cases)
+        removed = 0
+        for entry in self.entries():
+            if set(entry.get("inputs", [])) & cases:
+                try:
+                    os.remove(entry["path"])
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+def task_command(task_line: str) -> str:
+    """The case command of a task line, its last comma separated field"""
+    parts = task_line.strip().split(",", 4)
+    return parts[4].strip() if len(parts) == 5 else ""
+
+
+def write_decision_log(path: Union[str, Path], decisions: List[Tuple[str, str, str]]) -> None:
+    """One "<decision>\\t<case>\\t<task line>" row per line, next to the filtered task file"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"# result cache decisions {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        for decision, case, line in decisions:
+            f.write(f"{decision}\t{case}\t{line}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect, evict or invalidate the test result cache")
+    parser.add_argument("action", choices=["stats", "evict", "invalidate"])
+    parser.add_argument("cases", nargs="*", help="cases to invalidate (default: all)")
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--max-age", type=float, default=DEFAULT_MAX_AGE, help="seconds since last use")
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES)
+    args = parser.parse_args()
+
+    cache = ResultCache(args.cache_dir, enabled=True)
+    if args.action == "stats":
+        stats = cache.stats()
+        entries = cache.entries()
+        total = stats.get("hits", 0) + stats.get("misses", 0)
+        ratio = stats.get("hits", 0) / total if total else 0.0
+        print(f"cached passes: {len(entries)} ({sum(e['size'] for e in entries)} bytes)")
+        print(f"hits: {stats.get('hits', 0)}, misses: {stats.get('misses', 0)}, hit ratio: {ratio:.1%}")
+    elif args.action == "evict":
+        print(f"Evicted {cache.evict(args.max_age, args.max_bytes)} entries")
+    else:
+        print(f"Invalidated {cache.invalidate(args.cases or None)} entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+from xml.sax.saxutils import escape, quoteattr
+
+from duration_store import ANSI_ESCAPE, PASS, TIMEOUT, CASE_PATTERN, parse_result_records
+
+# run.sh announces a case only with its START line (ANSI escapes stripped first):
+#     "    2  START >>>>>  y,.,./ci/pytest.sh pytest cases/a/test_b.py -N 3 [10:02:11]"
+# other lines naming a case, like the "error info begin" banner printed after
+# a failure, must not mark it running again
+START_PATTERNS = [
+    re.compile(r"\bSTART\s+>+.*?" + CASE_PATTERN),
+]
+# characters XML 1.0 does not allow, even escaped
+_XML_INVALID = re.compile("[^\x09\x0a\x0d\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]")
+# longest line kept while waiting for its newline
+MAX_LINE = 64 * 1024
+# at most this many characters of a failing line go into the JUnit message
+MAX_MESSAGE = 2000
+
+
+class JUnitWriter:
+    """JUnit XML file that is valid after every added test case.
+
+    Each case is appended in place of the closing tags, which are written
+    again behind it; the counts in the header have a fixed width so they can
+    be patched without moving anything. Nothing but the current offsets is
+    kept in memory.
+    """
+
+    _COUNT_WIDTH = 9
+
+    def __init__(self, path: Union[str, Path], suite: str):
+        self.path = str(path)
+        self.tests = 0
+        self.failures = 0
+        self.time = 0.0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "w+", encoding="utf-8")
+        self._file.write('<?xml version="1.0" encoding="UTF-8"?>\n<testsuites>\n')
+        self._header_offset = self._file.tell()
+        self._file.write(self._suite_header(suite))
+        self._body_offset = self._file.tell()
+        self._suite = suite
+        self._write_footer()
+
+    def _suite_header(self, suite: str) -> str:
+        width = self._COUNT_WIDTH
+        return (
+            f"<testsuite name={quoteattr(suite)} tests=\"{self.tests:>{width}}\" "
+            f"failures=\"{self.failures:>{width}}\" time=\"{self.time:>{width + 3}.1f}\">\n"
+        )
+
+    def _write_footer(self) -> None:
+        self._file.write("</testsuite>\n</testsuites>\n")
+        self._file.truncate()
+        self._file.flush()
+
+    def add(self, case: str, outcome: str, duration: float, message: str = "") -> None:
+        case = _XML_INVALID.sub("", case)
+        message = _XML_INVALID.sub("", message)
+        self.tests += 1
+        self.time += duration
+        classname = os.path.dirname(case).replace("/", ".") or "cases"
+        entry = f"  <testcase classname={quoteattr(classname)} name={quoteattr(case)} time=\"{duration:.1f}\""
+        if outcome == PASS:
+            entry += "/>\n"
+        else:
+            self.failures += 1
+            kind = "timeout" if outcome == TIMEOUT else "failure"
+            entry += (
+                f">\n    <failure type={quoteattr(kind)} message={quoteattr(message[:200])}>"
+                f"{escape(message[:MAX_MESSAGE])}</failure>\n  </testcase>\n"
+            )
+        self._file.seek(self._body_offset)
+        self._file.write(entry)
+        self._body_offset = self._file.tell()
+        self._write_footer()
+        self._file.seek(self._header_offset)
+        self._file.write(self._suite_header(self._suite))
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ResultStream:
+    """Output consumer that follows case results while run.sh is running.
+
+    Fed stdout through Utils.run_command(consumers=[...]) or run_commands. It
+    recognizes case start and finish lines, keeps counts and the set of
+    running cases, appends every finished case to a JUnit XML file and keeps
+    a compact JSON summary up to date. A table of passed/failed/running cases
+    is printed when a case fails and at most every `table_interval` seconds.
+    Memory use depends on the number of cases, not on the amount of output.
+
+        stream = ResultStream(f"{log_dir}_results.xml", f"{log_dir}_results.json")
+        utils.run_commands(cmds, persistent_shell=True, consumers=[stream])
+        stream.close()
+    """
+
+    def __init__(
+        self,
+        junit_path: Union[str, Path],
+        summary_path: Union[str, Path],
+        suite: str = "function",
+        table_interval: float = 60.0,
+    ):
+        self.junit = JUnitWriter(junit_path, suite)
+        self.summary_path = str(summary_path)
+        self.table_interval = table_interval
+        self.started_at = time.time()
+        self.passed = 0
+        self.failed: List[Dict[str, object]] = []
+        self.running: Dict[str, float] = {}
+        # consumers never stop the command themselves
+        self.stop_reason: Optional[str] = None
+        self._partial = b""
+        self._last_table = self.started_at
+        self._last_summary = 0.0
+        self.write_summary()
+
+    @property
+    def finished(self) -> int:
+        return self.passed + len(self.failed)
+
+    def feed(self, data: bytes) -> None:
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()[-MAX_LINE:]
+        failed_before = len(self.failed)
+        for raw_line in lines:
+            # plain substring tests skip the regexes for ordinary output lines
+            if b"cases/" in raw_line or b"sim/" in raw_line:
+                self._feed_line(raw_line.decode(errors="replace"))
+        now = time.time()
+        if len(self.failed) > failed_before or now - self._last_table >= self.table_interval:
+            self.print_table()
+        if now - self._last_summary >= 1.0:
+            self.write_summary()
+
+    def _feed_line(self, line: str) -> None:
+        for case, outcome, duration, text in parse_result_records([line]):
+            self.running.pop(case, None)
+            if outcome == PASS:
+                self.passed += 1
+            else:
+                self.failed.append({"case": case, "outcome": outcome, "duration": duration})
+            self.junit.add(case, outcome, duration, text)
+            return
+        if "\x1b" in line:
+            line = ANSI_ESCAPE.sub("", line)
+        for pattern in START_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                self.running.setdefault(match.group("case"), time.time())
+                return
+
+    def print_table(self) -> None:
+        self._last_table = time.time()
+        now = time.time()
+        print(
+            f"[results] passed={self.passed} failed={len(self.failed)} running={len(self.running)} "
+            f"elapsed={now - self.started_at:.0f}s",
+            flush=True,
+        )
+        for item in self.failed[-5:]:
+            print(f"  FAILED  {item['duration']:7.0f}s  {item['case']}", flush=True)
+        # the longest running cases are the likeliest to hang
+        for case, start in sorted(self.running.items(), key=lambda kv: kv[1])[:5]:
+            print(f"  RUNNING {now - start:7.0f}s  {case}", flush=True)
+
+    def summary(self) -> Dict[str, object]:
+        now = time.time()
+        return {
+            "passed": self.passed,
+            "failed": len(self.failed),
+            "running": len(self.running),
+            "elapsed": round(now - self.started_at, 1),
+            "failures": self.failed,
+            "running_cases": {case: round(now - start, 1) for case, start in self.running.items()},
+        }
+
+    def write_summary(self) -> None:
+        self._last_summary = time.time()
+        tmp_path = f"{self.summary_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.summary(), f, separators=(",", ":"))
+            os.replace(tmp_path, self.summary_path)
+        except OSError as e:
+            print(f"Failed to write result summary {self.summary_path}: {e}", file=sys.stderr)
+
+    def close(self) -> None:
+        if self._partial:
+            self._feed_line(self._partial.decode(errors="replace"))
+            self._partial = b""
+        self.write_summary()
+        self.junit.close()
+        self.print_table()
+
+
+class ResultStreams:
+    """Combined counts of the ResultStreams of parallel run.sh shards, so
+    one Watchdog can judge the whole run:
+
+        streams = ResultStreams()
+        watchdog = Watchdog.from_env(streams)
+        for ...: streams.append(ResultStream(...))
+    """
+
+    def __init__(self):
+        self.streams: List[ResultStream] = []
+
+    def append(self, stream: ResultStream) -> None:
+        self.streams.append(stream)
+
+    @property
+    def passed(self) -> int:
+        return sum(stream.passed for stream in self.streams)
+
+    @property
+    def failed(self) -> List[Dict[str, object]]:
+        return [item for stream in self.streams for item in stream.failed]
+
+    @property
+    def finished(self) -> int:
+        return self.passed + len(self.failed)
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+class Watchdog:
+    """Output consumer that stops the run once too many cases have failed.
+
+    It reads the counts of a ResultStream (or ResultStreams) fed before it and sets
+    `stop_reason` when `max_failures` cases have failed, or when at least
+    `min_finished` cases have finished and the failed share reaches
+    `max_ratio`. Utils then terminates the command's process tree.
+
+        stream = ResultStream(...)
+        watchdog = Watchdog.from_env(stream)
+        utils.run_commands(cmds, persistent_shell=True, consumers=[stream, watchdog])
+    """
+
+    def __init__(self, stream: ResultStream, max_failures: int = 0, max_ratio: float = 0.0, min_finished: int = 20):
+        self.stream = stream
+        self.max_failures = max_failures
+        self.max_ratio = max_ratio
+        self.min_finished = min_finished
+        self.stop_reason: Optional[str] = None
+
+    @classmethod
+    def from_env(cls, stream: ResultStream) -> Optional["Watchdog"]:
+        """CI_WATCHDOG_MAX_FAILURES (or CI_FAIL_FAST), CI_WATCHDOG_MAX_RATIO and
+        CI_WATCHDOG_MIN_FINISHED; None when no threshold is set"""
+        max_failures = int(_env_number("CI_WATCHDOG_MAX_FAILURES", _env_number("CI_FAIL_FAST", 0)))
+        max_ratio = _env_number("CI_WATCHDOG_MAX_RATIO", 0.0)
+        if max_failures <= 0 and max_ratio <= 0:
+            return None
+        min_finished = int(_env_number("CI_WATCHDOG_MIN_FINISHED", 20))
+        return cls(stream, max(0, max_failures), max(0.0, max_ratio), min_finished)
+
+    def feed(self, data: bytes) -> None:
+        if self.stop_reason is not None:
+            return
+        failed = len(self.stream.failed)
+        finished = self.stream.finished
+        if self.max_failures and failed >= self.max_failures:
+            self.stop_reason = f"{failed} cases failed (limit {self.max_failures})"
+        elif self.max_ratio and finished >= self.min_finished and failed / finished >= self.max_ratio:
+            self.stop_reason = (
+                f"{failed} of {finished} finished cases failed "
+                f"({failed / finished:.0%}, limit {self.max_ratio:.0%})"
+            )
+        if self.stop_reason:
+            cases = ", ".join(str(item["case"]) for item in self.stream.failed[:10])
+            self.stop_reason = f"watchdog: {self.stop_reason}: {cases}"
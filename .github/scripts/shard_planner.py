@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import statistics
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from case_registry import extract_case_path, is_active_task_line
+from duration_store import DEFAULT_DB_PATH, DurationStore
+
+# cost of a case without history when nothing else is known (seconds)
+DEFAULT_CASE_COST = 60.0
+
+
+class Host:
+    """One entry of /home/m.json; `threads` cases run on it at a time"""
+
+    def __init__(self, name: str, threads: int = 1, weight: float = 1.0, entry: Optional[Dict] = None):
+        self.name = name
+        self.threads = max(1, int(threads))
+        # relative speed, a host with weight 2 finishes a case in half the time
+        self.weight = float(weight) if weight else 1.0
+        self.entry = entry or {"host": name, "thread": self.threads}
+
+    def __repr__(self):
+        return f"Host({self.name!r}, threads={self.threads}, weight={self.weight})"
+
+
+def load_hosts(path: Union[str, Path] = "/home/m.json") -> List[Host]:
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    return [
+        Host(entry["host"], entry.get("thread", 1), entry.get("weight", 1.0), entry)
+        for entry in entries
+    ]
+
+
+def synthetic_hosts(spec: str) -> List[Host]:
+    """Hosts from "threads[:weight],..." e.g. "8,8,4:0.5" (no m.json, no SSH)"""
+    hosts = []
+    for i, item in enumerate(spec.split(",")):
+        threads, _, weight = item.partition(":")
+        hosts.append(Host(f"host{i}", int(threads), float(weight or 1.0)))
+    return hosts
+
+
+class ShardPlan:
+    """Assignment of task lines to hosts and the predicted finish time of each host"""
+
+    def __init__(self, hosts: List[Host]):
+        self.hosts = hosts
+        self.lines: Dict[str, List[str]] = {host.name: [] for host in hosts}
+        self.costs: Dict[str, float] = {host.name: 0.0 for host in hosts}
+        self.finish: Dict[str, float] = {host.name: 0.0 for host in hosts}
+        self.total_cost = 0.0
+        self.unknown_cases = 0
+
+    @property
+    def makespan(self) -> float:
+        return max(self.finish.values(), default=0.0)
+
+    @property
+    def lower_bound(self) -> float:
+        capacity = sum(host.threads * host.weight for host in self.hosts)
+        return self.total_cost / capacity if capacity else 0.0
+
+    def write(self, out_dir: Union[str, Path], prefix: str = "shard") -> Dict[str, Dict[str, str]]:
+        """Write a task file and a single-host m.json per host that got cases"""
+        os.makedirs(out_dir, exist_ok=True)
+        written = {}
+        for i, host in enumerate(self.hosts):
+            lines = self.lines[host.name]
+            if not lines:
+                continue
+            task_path = os.path.join(out_dir, f"{prefix}_{i}.task")
+            hosts_path = os.path.join(out_dir, f"{prefix}_{i}.json")
+            with open(task_path, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            with open(hosts_path, "w", encoding="utf-8") as f:
+                json.dump([host.entry], f, indent=2)
+            written[host.name] = {"task": task_path, "hosts": hosts_path}
+        return written
+
+    def print_report(self) -> None:
+        print(f"Shard plan for {sum(len(v) for v in self.lines.values())} task lines "
+              f"on {len(self.hosts)} hosts ({self.unknown_cases} without duration history):")
+        for host in self.hosts:
+            print(
+                f"  {host.name:<20} threads={host.threads:<3} weight={host.weight:<4g} "
+                f"cases={len(self.lines[host.name]):<5} work={self.costs[host.name]:9.0f}s "
+                f"finish={self.finish[host.name]:8.0f}s"
+            )
+        print(f"Predicted makespan: {self.makespan:.0f}s (lower bound {self.lower_bound:.0f}s)")
+
+
+class ShardPlanner:
+    """Longest-processing-time-first scheduling of task lines over hosts.
+
+    Every host thread is a slot. Cases are taken longest first and each goes
+    to the slot that would finish it earliest, with case cost divided by the
+    host weight. Costs come from the duration history; cases without history
+    cost the median of the known ones (or DEFAULT_CASE_COST).
+
+        plan = ShardPlanner(load_hosts("/home/m.json")).plan(task_lines, costs)
+        plan.print_report()
+        plan.write(f"{wkc}/test/ci")
+    """
+
+    def __init__(self, hosts: List[Host], default_cost: Optional[float] = None):
+        if not hosts:
+            raise ValueError("No hosts to plan for")
+        self.hosts = hosts
+        self.default_cost = default_cost
+
+    def plan(self, task_lines: List[str], costs: Optional[Dict[str, float]] = None) -> ShardPlan:
+        """`costs` maps case path to expected seconds"""
+        costs = costs or {}
+        default_cost = self.default_cost
+        if default_cost is None:
+            default_cost = statistics.median(costs.values()) if costs else DEFAULT_CASE_COST
+
+        shard_plan = ShardPlan(self.hosts)
+        weighted = []
+        for position, line in enumerate(task_lines):
+            if not is_active_task_line(line):
+                continue
+            cost = costs.get(extract_case_path(line))
+            if cost is None:
+                cost = default_cost
+                shard_plan.unknown_cases += 1
+            weighted.append((cost, position, line))
+        # longest first, ties keep the task file order
+        weighted.sort(key=lambda item: (-item[0], item[1]))
+
+        # [finish time, host index] per thread; a few hundred slots at most,
+        # so a linear scan is cheaper than keeping a weighted heap consistent
+        slots = [[0.0, index] for index, host in enumerate(self.hosts) for _ in range(host.threads)]
+        for cost, _, line in weighted:
+            slot = min(slots, key=lambda s: (s[0] + cost / self.hosts[s[1]].weight, s[1]))
+            host = self.hosts[slot[1]]
+            slot[0] += cost / host.weight
+            shard_plan.lines[host.name].append(line)
+            shard_plan.costs[host.name] += cost
+            shard_plan.total_cost += cost
+            shard_plan.finish[host.name] = max(shard_plan.finish[host.name], slot[0])
+        return shard_plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan the split of a task file across test hosts")
+    parser.add_argument("task_file")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--hosts", default="/home/m.json", help="m.json host list")
+    group.add_argument("--synthetic", default=None, help='synthetic hosts, e.g. "8,8,4:0.5"')
+    parser.add_argument("--db", default=None, help="duration store (default: CI_DURATION_DB)")
+    parser.add_argument("--branch", default=None)
+    parser.add_argument("--out-dir", default=None, help="write per-host task files here")
+    args = parser.parse_args()
+
+    hosts = synthetic_hosts(args.synthetic) if args.synthetic else load_hosts(args.hosts)
+    with open(args.task_file, "r", encoding="utf-8") as f:
+        task_lines = f.read().splitlines()
+    costs = {}
+    db_path = args.db or os.getenv("CI_DURATION_DB") or DEFAULT_DB_PATH
+    if os.path.exists(db_path):
+        with DurationStore(db_path) as store:
+            cases = {extract_case_path(line) for line in task_lines if is_active_task_line(line)}
+            costs = store.estimates(cases, args.branch)
+
+    shard_plan = ShardPlanner(hosts).plan(task_lines, costs)
+    shard_plan.print_report()
+    if args.out_dir:
+        for host, paths in shard_plan.write(args.out_dir).items():
+            print(f"{host}: {paths['task']}")
+
+
+if __name__ == "__main__":
+    main()
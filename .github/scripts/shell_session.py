@@ -0,0 +1,202 @@
+import os
+import selectors
+import shlex
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+from output_capture import new_capture
+from tracing import get_tracer
+
+
+class _FramedStream:
+    """Split one output stream of the session at the end-of-command marker"""
+
+    def __init__(self, marker: bytes):
+        self.marker = marker
+        self._pending = b""
+
+    def feed(self, data: bytes, handler: Callable[[bytes], None]) -> Optional[bytes]:
+        """Forward output to `handler`; return the text after the marker once it is seen"""
+        data = self._pending + data
+        index = data.find(self.marker)
+        if index >= 0:
+            if index:
+                handler(data[:index])
+            self._pending = b""
+            return data[index + len(self.marker):]
+        # keep a possible partial marker for the next chunk
+        keep = len(self.marker) - 1
+        if len(data) > keep:
+            handler(data[:-keep] if keep else data)
+            self._pending = data[-keep:] if keep else b""
+        else:
+            self._pending = data
+        return None
+
+
+class ShellSession:
+    """Long-lived bash process that runs commands sent over a pipe.
+
+    Every command runs in the same shell, so `cd`, `export` and `source`
+    survive across commands and no fork+exec+bashrc happens per command.
+    Each command is framed with a random sentinel which carries its exit
+    status; output is echoed and logged through the given Utils instance just
+    like Utils.run_command.
+
+        with ShellSession(utils) as session:
+            session.run("export DEFAULT_RETRY_TIME=1", cwd=ci_dir)
+            session.run("./run.sh ...")
+
+    POSIX only. Commands run with stdin from /dev/null because the session's
+    stdin carries the commands.
+    """
+
+    def __init__(self, utils, env: Optional[Dict[str, str]] = None, shell: str = "/bin/bash"):
+        self.utils = utils
+        self.env = env
+        self.shell = shell
+        self.proc = None
+        self._token = uuid.uuid4().hex
+
+    def start(self) -> None:
+        self.proc = subprocess.Popen(
+            [self.shell, "--noprofile", "--norc"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=self.env or os.environ,
+            # own process group, stop_process_tree reaches every command's children
+            start_new_session=True,
+        )
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def _frame(self, command: str, cwd: Optional[str]) -> bytes:
+        marker = f"__CI_SESSION_{self._token}__"
+        # eval a quoted copy: a syntax error or an unbalanced quote in the
+        # command fails that command instead of swallowing the sentinel lines
+        body = f"eval {shlex.quote(command)}"
+        if cwd:
+            body = f"cd -- {shlex.quote(cwd)} && {body}"
+        script = (
+            f"{{\n{body}\n}} < /dev/null\n"
+            f"__ci_rc=$?\n"
+            f"printf '%s%d\\n' '{marker}' \"$__ci_rc\"\n"
+            f"printf '%s\\n' '{marker}' >&2\n"
+        )
+        return script.encode()
+
+    def run(
+        self,
+        command: Union[str, List[str]],
+        cwd: Optional[Union[str, Path]] = None,
+        check: bool = True,
+        silent: bool = False,
+        log_name: Optional[str] = None,
+        capture: Optional[str] = None,
+        consumers: Optional[List] = None,
+    ) -> subprocess.CompletedProcess:
+        """Run one command in the session, with the same contract as Utils.run_command.
+        Stopping on behalf of `consumers` terminates the whole session."""
+        if isinstance(command, (list, tuple)):
+            command = " ".join(shlex.quote(str(x)) for x in command)
+        if not self.alive:
+            self.start()
+        cwd = str(cwd) if cwd else None
+
+        print(f"Running command: {command} (cwd={cwd or 'session'}, session={self.proc.pid})")
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        start = time.time()
+        returncode = None
+        marker = f"__CI_SESSION_{self._token}__".encode()
+        stdout_sink, stderr_sink = self.utils.log_sinks.open_for(command, log_name)
+        stdout_capture, stderr_capture = new_capture(capture), new_capture(capture)
+        handlers = {
+            self.proc.stdout.fileno(): self.utils._consumer_handler(
+                self.utils._output_handler("stdout", silent, stdout_sink, stdout_capture),
+                consumers,
+                lambda pid=self.proc.pid: self.utils.stop_process_tree(pid),
+            ),
+            self.proc.stderr.fileno(): self.utils._output_handler("stderr", silent, stderr_sink, stderr_capture),
+        }
+        frames = {fd: _FramedStream(marker) for fd in handlers}
+        trailers: Dict[int, bytes] = {}
+        try:
+            self.proc.stdin.write(self._frame(command, cwd))
+            self.proc.stdin.flush()
+            with selectors.DefaultSelector() as selector:
+                for fd in handlers:
+                    selector.register(fd, selectors.EVENT_READ)
+                while len(trailers) < len(handlers):
+                    for key, _ in selector.select():
+                        fd = key.fd
+                        data = os.read(fd, 64 * 1024)
+                        if not data:
+                            raise EOFError("shell session exited")
+                        rest = frames[fd].feed(data, handlers[fd])
+                        if rest is not None:
+                            trailers[fd] = rest
+                            selector.unregister(fd)
+                # the stdout trailer is "<rc>\n"
+                stdout_trailer = trailers[self.proc.stdout.fileno()]
+                while not stdout_trailer.endswith(b"\n"):
+                    data = os.read(self.proc.stdout.fileno(), 64)
+                    if not data:
+                        raise EOFError("shell session exited")
+                    stdout_trailer += data
+            returncode = int(stdout_trailer.strip() or 0)
+        except (EOFError, BrokenPipeError):
+            # the command ended the shell itself, e.g. with `exit`
+            self.proc.wait()
+            returncode = self.proc.returncode
+            self._release()
+        finally:
+            stdout_sink.close()
+            stderr_sink.close()
+            if not silent:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            get_tracer().add_command(command, cwd or "session", start, time.time(), returncode)
+
+        stdout = stdout_capture.getvalue() if stdout_capture else None
+        stderr = stderr_capture.getvalue() if stderr_capture else None
+        if check and returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, output=stdout, stderr=stderr)
+
+        return subprocess.CompletedProcess(args=command, returncode=returncode, stdout=stdout, stderr=stderr)
+
+    def close(self) -> None:
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.write(b"exit 0\n")
+            self.proc.stdin.flush()
+            self.proc.wait(timeout=5)
+        except (BrokenPipeError, subprocess.TimeoutExpired):
+            self.proc.kill()
+            self.proc.wait()
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        for stream in (self.proc.stdin, self.proc.stdout, self.proc.stderr):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        self.proc = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,307 @@
+import argparse
+import os
+import select
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+try:
+    from paramiko import SSHException
+except ImportError:  # only LocalTransport can be used
+    SSHException = None
+
+# seconds between keepalive packets on idle transports
+KEEPALIVE_INTERVAL = 30
+CONNECT_TIMEOUT = 30
+
+
+class SSHPool:
+    """One authenticated SSH transport per host, one channel per command.
+
+    The first command for a host connects and authenticates; later commands
+    and SFTP uploads open channels on the same transport, so a host costs
+    one TCP and SSH handshake per run instead of one per command:
+
+        with SSHPool() as pool:
+            exit_code, stdout, stderr = pool.execute(host_config, "cd /x && git log -5")
+            pool.put(host_config, local_script, remote_script)
+
+    A transport that is no longer active, or fails to open a channel, is
+    dropped and connected again once. `connect(host, username)` can be
+    replaced, e.g. by LocalTransport to run without any sshd.
+    """
+
+    def __init__(self, connect: Optional[Callable[[str, str], Any]] = None, timeout: float = CONNECT_TIMEOUT):
+        self.timeout = timeout
+        self._connect = connect or self._paramiko_connect
+        self._transports: Dict[str, Any] = {}
+        self._sftp: Dict[str, Any] = {}
+        # reentrant, sftp() holds it while transport() takes it again
+        self._host_locks: Dict[str, threading.RLock] = {}
+        self._lock = threading.Lock()
+        self.connects = 0
+
+    def _paramiko_connect(self, host: str, username: str):
+        import paramiko
+
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(hostname=host, username=username, timeout=self.timeout)
+        transport = client.get_transport()
+        transport.set_keepalive(KEEPALIVE_INTERVAL)
+        # the client owns the transport, keep it referenced as long as the transport
+        transport.pool_client = client
+        return transport
+
+    def _host_lock(self, host: str) -> threading.RLock:
+        with self._lock:
+            return self._host_locks.setdefault(host, threading.RLock())
+
+    def transport(self, host_config: Dict[str, Any], reconnect: bool = False):
+        """The live transport of a host, connecting on first use or when it died"""
+        host = host_config["host"]
+        with self._host_lock(host):
+            transport = self._transports.get(host)
+            if transport is not None and (reconnect or not transport.is_active()):
+                print(f"[{host}] SSH transport is down, reconnecting")
+                self._drop(host)
+                transport = None
+            if transport is None:
+                transport = self._connect(host, host_config["username"])
+                self._transports[host] = transport
+                self.connects += 1
+            return transport
+
+    def _drop(self, host: str) -> None:
+        sftp = self._sftp.pop(host, None)
+        transport = self._transports.pop(host, None)
+        for item in (sftp, transport):
+            try:
+                if item is not None:
+                    item.close()
+            except Exception:
+                pass
+
+    def _open_session(self, host_config: Dict[str, Any]):
+        try:
+            return self.transport(host_config).open_session()
+        except Exception as e:
+            print(f"[{host_config['host']}] Failed to open SSH channel ({e}), reconnecting")
+            return self.transport(host_config, reconnect=True).open_session()
+
+    def execute(self, host_config: Dict[str, Any], command: str, timeout: Optional[float] = None) -> Tuple[int, str, str]:
+        """Run `command` on a new channel, return (exit code, stdout, stderr)"""
+        channel = self._open_session(host_config)
+        try:
+            channel.exec_command(command)
+            stdout, stderr = [], []
+            deadline = time.time() + timeout if timeout else None
+
+            def remaining() -> Optional[float]:
+                if deadline is None:
+                    return None
+                left = deadline - time.time()
+                if left <= 0:
+                    raise TimeoutError(f"command timed out after {timeout}s: {command}")
+                return left
+
+            # drain both streams together, a full stderr window would stall stdout;
+            # the channel's fileno becomes readable on data of either stream or EOF
+            while True:
+                select.select([channel], [], [], remaining())
+                while channel.recv_ready():
+                    stdout.append(channel.recv(32768))
+                while channel.recv_stderr_ready():
+                    stderr.append(channel.recv_stderr(32768))
+                if channel.eof_received and not channel.recv_ready() and not channel.recv_stderr_ready():
+                    break
+            # the exit status may arrive after EOF
+            if not channel.status_event.wait(remaining()):
+                raise TimeoutError(f"command timed out after {timeout}s: {command}")
+            exit_code = channel.recv_exit_status()
+            return (
+                exit_code,
+                b"".join(stdout).decode("utf-8", errors="replace"),
+                b"".join(stderr).decode("utf-8", errors="replace"),
+            )
+        finally:
+            channel.close()
+
+    def sftp(self, host_config: Dict[str, Any]):
+        """SFTP client on the host's transport, opened once"""
+        host = host_config["host"]
+        with self._host_lock(host):
+            sftp = self._sftp.get(host)
+            if sftp is None:
+                sftp = self.transport(host_config).open_sftp_client()
+                self._sftp[host] = sftp
+            return sftp
+
+    def _session_lost(self, host: str, error: Exception) -> bool:
+        """True if `error` comes from a dead SFTP session rather than from the upload itself"""
+        if isinstance(error, EOFError):
+            return True
+        if SSHException is None or not isinstance(error, SSHException):
+            return False
+        transport = self._transports.get(host)
+        return transport is None or not transport.is_active()
+
+    def put(self, host_config: Dict[str, Any], local_path: Union[str, Path], remote_path: str) -> None:
+        """Upload a file; errors like a missing file or no permission are raised right away"""
+        try:
+            self.sftp(host_config).put(str(local_path), remote_path)
+        except Exception as e:
+            if not self._session_lost(host_config["host"], e):
+                raise
+            # a stale SFTP session, retry once on a fresh transport
+            self.transport(host_config, reconnect=True)
+            self.sftp(host_config).put(str(local_path), remote_path)
+
+    def close_host(self, host: str) -> None:
+        """Close the transport of one host; commands blocked on it return"""
+        with self._host_lock(host):
+            self._drop(host)
+
+    def close(self) -> None:
+        with self._lock:
+            for host in list(self._transports):
+                self._drop(host)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _LocalChannel:
+    """Channel of LocalTransport, runs the command with bash on this machine"""
+
+    def __init__(self):
+        self._stdout = b""
+        self._stderr = b""
+        self._exit_code = None
+        self.eof_received = False
+        self.status_event = threading.Event()
+        # readable once the command is done, like a paramiko channel at EOF
+        self._pipe = os.pipe()
+
+    def fileno(self) -> int:
+        return self._pipe[0]
+
+    def exec_command(self, command: str) -> None:
+        result = subprocess.run(["bash", "-c", command], capture_output=True)
+        self._stdout, self._stderr, self._exit_code = result.stdout, result.stderr, result.returncode
+        self.eof_received = True
+        self.status_event.set()
+        os.write(self._pipe[1], b"x")
+
+    def recv_ready(self) -> bool:
+        return bool(self._stdout)
+
+    def recv(self, size: int) -> bytes:
+        data, self._stdout = self._stdout[:size], self._stdout[size:]
+        return data
+
+    def recv_stderr_ready(self) -> bool:
+        return bool(self._stderr)
+
+    def recv_stderr(self, size: int) -> bytes:
+        data, self._stderr = self._stderr[:size], self._stderr[size:]
+        return data
+
+    def exit_status_ready(self) -> bool:
+        return self._exit_code is not None
+
+    def recv_exit_status(self) -> int:
+        return self._exit_code
+
+    def close(self) -> None:
+        for fd in self._pipe:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._pipe = ()
+
+
+class _LocalSFTP:
+    def put(self, local_path: str, remote_path: str) -> None:
+        shutil.copyfile(local_path, remote_path)
+
+    def close(self) -> None:
+        pass
+
+
+class LocalTransport:
+    """In-process stand-in for a paramiko Transport that runs everything locally.
+
+        pool = SSHPool(connect=lambda host, username: LocalTransport())
+    """
+
+    def __init__(self):
+        self.active = True
+
+    def is_active(self) -> bool:
+        return self.active
+
+    def open_session(self) -> _LocalChannel:
+        if not self.active:
+            raise EOFError("transport closed")
+        return _LocalChannel()
+
+    def open_sftp_client(self) -> _LocalSFTP:
+        return _LocalSFTP()
+
+    def close(self) -> None:
+        self.active = False
+
+
+def _bench(host: str, username: str, commands: int) -> None:
+    """Compare a new connection per command with the pooled transport"""
+    host_config = {"host": host, "username": username}
+    if host == "local":
+        pool = SSHPool(connect=lambda h, u: LocalTransport())
+    else:
+        pool = SSHPool()
+
+    start = time.time()
+    for _ in range(commands):
+        with SSHPool(connect=pool._connect) as fresh:
+            fresh.execute(host_config, "true")
+    per_command = time.time() - start
+
+    start = time.time()
+    with pool:
+        for _ in range(commands):
+            pool.execute(host_config, "true")
+        connects = pool.connects
+    pooled = time.time() - start
+    print(f"{commands} commands on {host}: connect per command {per_command:.2f}s, pooled {pooled:.2f}s ({connects} connects)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run commands through a pooled SSH transport")
+    parser.add_argument("host", help='host name, "local" for the in-process transport')
+    parser.add_argument("command", nargs="?", default=None)
+    parser.add_argument("--user", default=os.getenv("USER", "root"))
+    parser.add_argument("--bench", type=int, default=0, metavar="N", help="time N commands with and without the pool")
+    args = parser.parse_args()
+
+    if args.bench:
+        _bench(args.host, args.user, args.bench)
+        return
+    connect = (lambda h, u: LocalTransport()) if args.host == "local" else None
+    with SSHPool(connect=connect) as pool:
+        exit_code, stdout, stderr = pool.execute({"host": args.host, "username": args.user}, args.command or "true")
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "taos-ci", "steps")
+
+
+def cache_disabled() -> bool:
+    """True when caching is turned off with CI_NO_CACHE=1 or an entry point's --no-cache"""
+    return os.getenv("CI_NO_CACHE", "").lower() in ("1", "true", "yes")
+
+
+def add_no_cache_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="run every step and rebuild cached state (same as CI_NO_CACHE=1)",
+    )
+
+
+def apply_no_cache_argument(args: argparse.Namespace) -> None:
+    """Turn --no-cache into CI_NO_CACHE=1, so the caches of this process and of
+    the scripts it starts all see it"""
+    if args.no_cache:
+        os.environ["CI_NO_CACHE"] = "1"
+
+
+def file_digest(path: Union[str, Path]) -> str:
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    except FileNotFoundError:
+        return "missing"
+    return digest.hexdigest()
+
+
+class StepCache:
+    """Local store of successful results keyed by content fingerprints.
+
+    A key is a hash of a command, its cwd and the content of its input
+    files; lookup() reports whether the key was stored, run() skips an
+    idempotent setup step whose key succeeded before:
+
+        StepCache().run("apt install ...", install, inputs=["dependencies.txt"], ttl=86400)
+
+    Entries live as small JSON files under the cache dir (CI_STEP_CACHE_DIR,
+    ~/.cache/taos-ci/steps by default) with hit/miss stats, LRU eviction
+    and the `python3 step_cache.py stats|evict|clear` CLI. ResultCache
+    builds the test result cache on it.
+    """
+
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None, enabled: Optional[bool] = None):
+        self.cache_dir = str(cache_dir or os.getenv("CI_STEP_CACHE_DIR") or DEFAULT_CACHE_DIR)
+        self.enabled = (not cache_disabled()) if enabled is None else enabled
+        self.hits = 0
+        self.misses = 0
+
+    def key(
+        self,
+        command: Union[str, List[str]],
+        inputs: Optional[List[Union[str, Path]]] = None,
+        cwd: Optional[Union[str, Path]] = None,
+    ) -> str:
+        text = " ".join(map(str, command)) if isinstance(command, (list, tuple)) else str(command)
+        digest = hashlib.sha256()
+        digest.update(text.encode())
+        digest.update(f"\0cwd={cwd or ''}".encode())
+        for path in sorted(str(p) for p in (inputs or [])):
+            digest.update(f"\0{path}={file_digest(path)}".encode())
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._entry_path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_entry(self, key: str, entry: Dict[str, Any]) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self._entry_path(key) + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._entry_path(key))
+
+    def _record_stat(self, field: str) -> None:
+        path = os.path.join(self.cache_dir, "stats.json")
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # concurrent jobs share the stats, serialize the read-modify-write
+            with open(f"{path}.lock", "w") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                stats = self.stats()
+                stats[field] = stats.get(field, 0) + 1
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(stats, f)
+                os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def lookup(self, key: str, ttl: Optional[float] = None) -> bool:
+        """Return True (a hit) if `key` is recorded, and less than `ttl` seconds ago if given"""
+        if not self.enabled:
+            return False
+        entry = self._read_entry(key)
+        hit = entry is not None and (ttl is None or time.time() - entry.get("created", 0) <= ttl)
+        if hit:
+            self.hits += 1
+            entry["last_used"] = time.time()
+            self._write_entry(key, entry)
+            self._record_stat("hits")
+        else:
+            self.misses += 1
+            self._record_stat("misses")
+        return hit
+
+    def store(self, key: str, command, inputs: Optional[List[Union[str, Path]]] = None) -> None:
+        if not self.enabled:
+            return
+        now = time.time()
+        self._write_entry(key, {
+            "command": " ".join(map(str, command)) if isinstance(command, (list, tuple)) else str(command),
+            "inputs": [str(p) for p in (inputs or [])],
+            "created": now,
+            "last_used": now,
+        })
+
+    def run(
+        self,
+        command: Union[str, List[str]],
+        action: Callable[[], Any],
+        inputs: Optional[List[Union[str, Path]]] = None,
+        cwd: Optional[Union[str, Path]] = None,
+        ttl: Optional[float] = None,
+    ) -> bool:
+        """Call `action` unless `command` with the same inputs succeeded (within
+        `ttl`); it is recorded only if `action` returns. True when skipped."""
+        key = self.key(command, inputs, cwd)
+        if self.lookup(key, ttl):
+            print(f"Skip step, unchanged since its last success: {command}")
+            return True
+        action()
+        self.store(key, command, inputs)
+        return False
+
+    def entries(self) -> List[Dict[str, Any]]:
+        result = []
+        if not os.path.isdir(self.cache_dir):
+            return result
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json") or name == "stats.json":
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                entry["path"] = path
+                entry["size"] = os.path.getsize(path)
+                result.append(entry)
+            except (OSError, ValueError):
+                continue
+        return result
+
+    def evict(self, max_age: Optional[float] = None, max_bytes: Optional[int] = None) -> int:
+        """Remove entries unused for `max_age` seconds, then the least recently used above `max_bytes`"""
+        now = time.time()
+        entries = sorted(self.entries(), key=lambda e: e.get("last_used", 0), reverse=True)
+        drop = []
+        total = 0
+        for entry in entries:
+            if max_age is not None and now - entry.get("last_used", 0) > max_age:
+                drop.append(entry)
+                continue
+            total += entry["size"]
+            if max_bytes is not None and total > max_bytes:
+                drop.append(entry)
+        for entry in drop:
+            try:
+                os.remove(entry["path"])
+            except OSError:
+                pass
+        return len(drop)
+
+    def clear(self) -> int:
+        return self.evict(max_bytes=0)
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self.cache_dir, "stats.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"hits": 0, "misses": 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clean the CI step cache")
+    parser.add_argument("action", choices=["stats", "evict", "clear"])
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--max-age", type=float, default=None, help="seconds since last use")
+    parser.add_argument("--max-bytes", type=int, default=None)
+    args = parser.parse_args()
+
+    cache = StepCache(args.cache_dir, enabled=True)
+    if args.action == "stats":
+        stats = cache.stats()
+        entries = cache.entries()
+        total = stats.get("hits", 0) + stats.get("misses", 0)
+        ratio = stats.get("hits", 0) / total if total else 0.0
+        print(f"entries: {len(entries)} ({sum(e['size'] for e in entries)} bytes)")
+        print(f"hits: {stats.get('hits', 0)}, misses: {stats.get('misses', 0)}, hit ratio: {ratio:.1%}")
+    elif args.action == "evict":
+        print(f"Evicted {cache.evict(args.max_age, args.max_bytes)} entries")
+    else:
+        print(f"Removed {cache.clear()} entries")
+
+
+if __name__ == "__main__":
+    main()
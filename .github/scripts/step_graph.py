@@ -0,0 +1,177 @@
+import asyncio
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from utils import Utils
+from async_utils import AsyncUtils
+
+SUCCESS = "success"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class Step:
+    """A command in a StepGraph together with what it depends on"""
+
+    def __init__(
+        self,
+        name: str,
+        command: Union[str, List[str]],
+        cwd: Optional[Union[str, Path]] = None,
+        deps: Optional[List[str]] = None,
+        env: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.name = name
+        self.command = command
+        self.cwd = cwd
+        self.deps = list(deps or [])
+        self.env = env
+        self.timeout = timeout
+        self.status = None
+        self.error = None
+        self.start = 0.0
+        self.end = 0.0
+
+    @property
+    def duration(self) -> float:
+        return max(0.0, self.end - self.start)
+
+
+class StepGraph:
+    """Dependency-aware executor for CI steps.
+
+    Steps whose dependencies have succeeded run in parallel, at most
+    `max_workers` at a time. When a step fails, every step depending on it
+    (directly or not) is skipped while independent branches keep running.
+
+        graph = StepGraph(max_workers=2)
+        graph.add("configure", "cmake ..", cwd=debug_dir)
+        graph.add("make", "make -j 4", cwd=debug_dir, deps=["configure"])
+        graph.run()
+    """
+
+    def __init__(
+        self,
+        utils: Optional[Utils] = None,
+        max_workers: int = 4,
+    ):
+        self.async_utils = AsyncUtils(utils, limit=max_workers)
+        self.max_workers = max(1, max_workers)
+        self.steps: Dict[str, Step] = {}
+        self.wall_time = 0.0
+        # steps whose command is running right now
+        self.running = 0
+
+    def add(self, name: str, command: Union[str, List[str]], **kwargs) -> Step:
+        if name in self.steps:
+            raise ValueError(f"Duplicate step name: {name}")
+        step = Step(name, command, **kwargs)
+        self.steps[name] = step
+        return step
+
+    def _topological_order(self) -> List[Step]:
+        order = []
+        state = {}  # name -> "visiting" | "done"
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+            if name not in self.steps:
+                raise ValueError(f"Unknown dependency '{name}' of step '{path[-1]}'")
+            state[name] = "visiting"
+            for dep in self.steps[name].deps:
+                visit(dep, path + [name])
+            state[name] = "done"
+            order.append(self.steps[name])
+
+        for name in self.steps:
+            visit(name, [])
+        return order
+
+    async def _run_step(self, step: Step, tasks: Dict[str, asyncio.Task], semaphore) -> str:
+        dep_status = [await tasks[dep] for dep in step.deps]
+        if any(status != SUCCESS for status in dep_status):
+            step.status = SKIPPED
+            print(f"Skip step '{step.name}': a dependency did not succeed")
+            return step.status
+
+        async with semaphore:
+            step.start = time.monotonic()
+            self.running += 1
+            try:
+                await self.async_utils.run_command_async(
+                    step.command,
+                    cwd=step.cwd,
+                    env=step.env,
+                    timeout=step.timeout,
+                    log_name=step.name,
+                    # prefix lines only while another step's output may interleave
+                    label=lambda: step.name if self.running > 1 else None,
+                )
+                step.status = SUCCESS
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+                step.status = FAILED
+                step.error = e
+                print(f"Step '{step.name}' failed: {e}")
+            finally:
+                self.running -= 1
+                step.end = time.monotonic()
+        return step.status
+
+    async def run_async(self) -> Dict[str, str]:
+        order = self._topological_order()
+        semaphore = asyncio.Semaphore(self.max_workers)
+        tasks: Dict[str, asyncio.Task] = {}
+        start = time.monotonic()
+        for step in order:
+            tasks[step.name] = asyncio.ensure_future(self._run_step(step, tasks, semaphore))
+        await asyncio.gather(*tasks.values())
+        self.wall_time = time.monotonic() - start
+        return {name: step.status for name, step in self.steps.items()}
+
+    def run(self, check: bool = True, summary: bool = True) -> Dict[str, str]:
+        """Run the graph; if `check`, raise the error of the first failed step
+        (CalledProcessError, TimeoutExpired or OSError)"""
+        statuses = asyncio.run(self.run_async())
+        if summary:
+            self.print_summary()
+        if check:
+            for step in self._topological_order():
+                if step.status == FAILED:
+                    raise step.error
+        return statuses
+
+    def critical_path(self) -> List[Step]:
+        """Longest chain of executed steps by duration, following dependencies"""
+        best: Dict[str, float] = {}
+        previous: Dict[str, Optional[str]] = {}
+        for step in self._topological_order():
+            ran_deps = [dep for dep in step.deps if self.steps[dep].status in (SUCCESS, FAILED)]
+            prev = max(ran_deps, key=lambda dep: best[dep], default=None)
+            best[step.name] = step.duration + (best[prev] if prev else 0.0)
+            previous[step.name] = prev
+        if not best:
+            return []
+        name = max(best, key=best.get)
+        path = []
+        while name:
+            path.append(self.steps[name])
+            name = previous[name]
+        return list(reversed(path))
+
+    def print_summary(self) -> None:
+        print("Step summary:")
+        for step in self._topological_order():
+            status = step.status or "pending"
+            print(f"  {status:<8} {step.duration:8.1f}s  {step.name}")
+        path = self.critical_path()
+        total = sum(step.duration for step in path)
+        print(
+            f"Critical path ({total:.1f}s of {self.wall_time:.1f}s wall time): "
+            f"{' -> '.join(step.name for step in path)}"
+        )
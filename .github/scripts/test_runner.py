@@ -1,9 +1,39 @@
+import argparse
 from datetime import datetime
 import os
 import platform
-import shlex
+import shutil
+import sqlite3
 
 from utils import Utils
+from async_utils import AsyncUtils, CommandSpec
+from tracing import get_tracer
+from case_registry import CaseRegistry, LINUX, MAC, WINDOWS, extract_case_path, is_active_task_line
+from impact_analysis import ImpactIndex
+from duration_store import DurationStore, read_log_dir_records, results_by_case
+from result_cache import CACHED_PASS, ResultCache, write_decision_log
+from shard_planner import ShardPlanner, load_hosts
+from case_order import CaseOrder
+from case_timeouts import CaseTimeouts
+from result_stream import ResultStream, ResultStreams, Watchdog
+from proc_table import ProcessTable, ensure_job_marker
+from step_cache import add_no_cache_argument, apply_no_cache_argument
+from venv_cache import VenvCache
+from worker_pool import WorkerPool
+
+# fixed case list of the mac function test
+MAC_CASES = [
+    "cases/01-DataTypes/test_datatype_bigint.py",
+    "cases/81-Tools/03-Benchmark/test_benchmark_taosc.py",
+]
+# server port of mac worker i is MAC_BASE_PORT + i * MAC_WORKER_PORT_STRIDE
+MAC_BASE_PORT = 6030
+MAC_WORKER_PORT_STRIDE = 1000
+# hosts run.sh distributes the linux cases to
+SHARD_HOSTS_PATH = "/home/m.json"
+# bounds of the local test result cache
+RESULT_CACHE_MAX_AGE = 14 * 24 * 3600
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
 
 
 class TestRunner:
@@ -41,6 +71,9 @@ class TestRunner:
         self.win_cases_task_path = self.utils.path(self.wkc, "test", "ci", "win_cases.task")
         self.temp_cases_task_path = self.utils.path(self.wkc, "test", "ci", "temp_run_cases.task")
         self.temp_win_cases_task_path = self.utils.path(self.wkc, "test", "ci", "temp_run_win_cases.task")
+        self.case_registry = None
+        self.result_cache = None
+        self.case_timeouts = None
 
     def _read_changed_files(self):
         if not self.utils.file_exists(self.changed_files_path):
@@ -64,47 +97,8 @@ class TestRunner:
             for file_path in changed_files
         )
 
-    def _is_active_task_line(self, line):
-        stripped = line.strip()
-        return bool(stripped) and not stripped.startswith("#")
-
-    def _normalize_case_token(self, token):
-        normalized = token.strip().strip('"\'').replace("\\", "/")
-        if normalized.startswith("./"):
-            normalized = normalized[2:]
-        return normalized
-
     def _extract_case_path_from_task_line(self, line):
-        line = line.strip()
-        if not line or line.startswith("#"):
-            return ""
-
-        parts = [part.strip() for part in line.split(",", 4)]
-        if len(parts) < 5:
-            return ""
-
-        case_path_field = self._normalize_case_token(parts[3])
-        if case_path_field and case_path_field != ".":
-            if case_path_field.startswith("cases/"):
-                return case_path_field
-            if case_path_field.startswith(("tsim/", "sim/")):
-                return case_path_field
-
-        case_cmd = parts[4]
-        cmd_parts = shlex.split(case_cmd)
-
-        for token in cmd_parts:
-            normalized = self._normalize_case_token(token)
-            if normalized.startswith("--tsim="):
-                tsim_path = self._normalize_case_token(normalized.split("=", 1)[1])
-                if tsim_path:
-                    return tsim_path
-            if "cases/" in normalized and normalized.endswith((".py", ".sh")):
-                return normalized[normalized.index("cases/") :]
-            if normalized.startswith(("tsim/", "sim/")) and normalized.endswith(".sim"):
-                return normalized
-
-        return ""
+        return extract_case_path(line)
 
     def _read_cases_task_diff(self):
         if not self.utils.file_exists(self.cases_task_diff_path):
@@ -118,68 +112,53 @@ class TestRunner:
                 continue
             if raw_line.startswith("+"):
                 task_line = raw_line[1:]
-                if self._is_active_task_line(task_line):
+                if is_active_task_line(task_line):
                     added_lines.append(task_line)
             elif raw_line.startswith("-"):
                 task_line = raw_line[1:]
-                if self._is_active_task_line(task_line):
+                if is_active_task_line(task_line):
                     removed_lines.append(task_line)
 
         return {"added_lines": added_lines, "removed_lines": removed_lines}
 
-    def _build_task_line_index(self, task_lines):
-        line_index = {}
-        for raw_line in task_lines:
-            if not self._is_active_task_line(raw_line):
-                continue
-            case_path = self._extract_case_path_from_task_line(raw_line)
-            if not case_path:
-                continue
-            line_index.setdefault(case_path, []).append(raw_line)
-        return line_index
-
-    def _dedupe_lines(self, task_lines):
-        deduped_lines = []
-        seen_lines = set()
-        for raw_line in task_lines:
-            if raw_line in seen_lines:
-                continue
-            deduped_lines.append(raw_line)
-            seen_lines.add(raw_line)
-        return deduped_lines
-
-    def _resolve_task_lines_for_cases(self, task_path, selected_cases):
-        task_content = self.utils.read_file(task_path)
-        task_lines = task_content.splitlines()
-        task_line_index = self._build_task_line_index(task_lines)
-
-        matched_lines = []
-        matched_cases = set()
-        for case_path in sorted(selected_cases):
-            if case_path in task_line_index:
-                matched_lines.extend(task_line_index[case_path])
-                matched_cases.add(case_path)
-
-        return self._dedupe_lines(matched_lines), matched_cases
-
-    def _write_task_file(self, target_task_path, task_lines):
-        if not task_lines:
-            return []
-
-        self.utils.write_file(target_task_path, "\n".join(task_lines) + "\n")
-        return task_lines
+    def _get_case_registry(self):
+        """Index of cases.task, win_cases.task and the mac case list, parsed once"""
+        if self.case_registry is None:
+            registry = CaseRegistry()
+            registry.load_task_file(LINUX, self.cases_task_path)
+            registry.load_task_file(WINDOWS, self.win_cases_task_path)
+            registry.add_entries(MAC, self._get_mac_case_commands())
+            self.case_registry = registry
+        return self.case_registry
+
+    def _get_impacted_cases(self, changed_files):
+        """Cases affected by non-case changes per the impact index, empty to run the full suite"""
+        cases, reason = ImpactIndex.load().select(changed_files)
+        if cases is None:
+            print(f"Impact analysis not conclusive ({reason}), run the full suite.")
+            return set()
+        print(f"Impact analysis: {reason}")
+        return cases
+
+    def _full_suite_selection(self):
+        return {
+            "enabled": False,
+            "skip": False,
+            "changed_cases": set(),
+            "selected_cases": set(),
+            "linux_task_lines": [],
+            "unmatched_cases": set(),
+            "platform_selection": {},
+        }
 
     def _get_case_selection(self):
         changed_files = self._read_changed_files()
-        if not self._is_cases_only_change(changed_files):
-            return {
-                "enabled": False,
-                "skip": False,
-                "changed_cases": set(),
-                "selected_cases": set(),
-                "linux_task_lines": [],
-                "unmatched_cases": set(),
-            }
+        cases_only = self._is_cases_only_change(changed_files)
+        impacted_cases = set()
+        if changed_files and not cases_only:
+            impacted_cases = self._get_impacted_cases(changed_files)
+        if not cases_only and not impacted_cases:
+            return self._full_suite_selection()
 
         changed_cases = {
             file_path[len("test/"):] for file_path in changed_files if file_path.startswith("test/cases/")
@@ -191,11 +170,10 @@ class TestRunner:
             for line in cases_task_diff["added_lines"]
             if self._extract_case_path_from_task_line(line)
         }
-        selected_cases = changed_cases | added_cases
-        linux_task_lines, matched_cases = self._resolve_task_lines_for_cases(
-            self.cases_task_path,
-            selected_cases,
-        )
+        selected_cases = changed_cases | added_cases | impacted_cases
+        platform_selection = self._get_case_registry().select(selected_cases)
+        linux_task_lines = platform_selection[LINUX]["lines"]
+        matched_cases = platform_selection[LINUX]["matched_cases"]
         unmatched_cases = changed_cases - matched_cases
 
         if unmatched_cases:
@@ -204,6 +182,12 @@ class TestRunner:
                 f"{sorted(unmatched_cases)}"
             )
 
+        if not linux_task_lines and not cases_only:
+            # stale coverage or only commented-out cases hit, source changes
+            # must never go untested
+            print("No active cases.task entry for the affected cases, run the full suite.")
+            return self._full_suite_selection()
+
         if not linux_task_lines:
             print("Only cases.task comment/removal changes detected, skip function test.")
             return {
@@ -213,12 +197,16 @@ class TestRunner:
                 "selected_cases": matched_cases,
                 "linux_task_lines": [],
                 "unmatched_cases": unmatched_cases,
+                "platform_selection": platform_selection,
             }
 
-        print(
-            "Only cases-related files changed, run selected cases only: "
-            f"{sorted(matched_cases)}"
-        )
+        if cases_only:
+            print(
+                "Only cases-related files changed, run selected cases only: "
+                f"{sorted(matched_cases)}"
+            )
+        else:
+            print(f"Run cases affected by the changed sources only: {sorted(matched_cases)}")
         return {
             "enabled": True,
             "skip": False,
@@ -226,30 +214,77 @@ class TestRunner:
             "selected_cases": matched_cases,
             "linux_task_lines": linux_task_lines,
             "unmatched_cases": unmatched_cases,
+            "platform_selection": platform_selection,
         }
 
     def _get_mac_case_commands(self):
-        base_command = (
-            f"cd {self.wkc}/test && source .venv/bin/activate && sudo "
-            f"TAOS_BIN_PATH={self.wk}/debug/build/bin WORK_DIR=`pwd`/yourtest "
-            f"DYLD_LIBRARY_PATH={self.wk}/debug/build/lib"
+        return [(case_path, self._mac_case_command(case_path)) for case_path in MAC_CASES]
+
+    def _mac_case_command(self, case_path, worker=None, venv=".venv"):
+        """Command of one mac case; with a worker it gets its own WORK_DIR,
+        ports and log dir, otherwise the shared yourtest dir of a serial run"""
+        log_dir = self.mac_test_log_dir_name
+        env = f"TAOS_BIN_PATH={self.wk}/debug/build/bin DYLD_LIBRARY_PATH={self.wk}/debug/build/lib"
+        if worker is None:
+            work_dir = "`pwd`/yourtest"
+            sim_dir = f"{self.wk}/sim"
+            marker = ""
+            collect_cores = f"[ -d /cores ] && ls /cores/core* 1>/dev/null 2>&1 && cp -rf /cores/core* {log_dir}/"
+        else:
+            work_dir = f"{self.wkc}/test/yourtest_w{worker}"
+            sim_dir = work_dir
+            log_dir = f"{log_dir}/w{worker}/{os.path.splitext(os.path.basename(case_path))[0]}"
+            env += " " + " ".join(f"{name}={value}" for name, value in self._mac_worker_env(worker).items())
+            # /cores is shared by all workers, only cores dumped during this case are its own
+            marker = f"mkdir -p {log_dir} && touch {log_dir}/.started && "
+            collect_cores = (
+                f"[ -d /cores ] && find /cores -maxdepth 1 -name 'core*' -newer {log_dir}/.started "
+                f"-exec cp -f {{}} {log_dir}/ \\;"
+            )
+        return (
+            f"cd {self.wkc}/test && source {venv}/bin/activate && {marker}"
+            f"sudo {env} WORK_DIR={work_dir} pytest --clean {case_path} "
+            f"|| (cp -rf {sim_dir}/* {log_dir}/; {collect_cores} || true)"
         )
-        return [
-            (
-                "cases/01-DataTypes/test_datatype_bigint.py",
-                f"{base_command} pytest --clean cases/01-DataTypes/test_datatype_bigint.py "
-                f"|| (cp -rf {self.wk}/sim/* {self.mac_test_log_dir_name}/; "
-                f"[ -d /cores ] && ls /cores/core* 1>/dev/null 2>&1 && "
-                f"cp -rf /cores/core* {self.mac_test_log_dir_name}/ || true)",
-            ),
-            (
-                "cases/81-Tools/03-Benchmark/test_benchmark_taosc.py",
-                f"{base_command} pytest --clean cases/81-Tools/03-Benchmark/test_benchmark_taosc.py "
-                f"|| (cp -rf {self.wk}/sim/* {self.mac_test_log_dir_name}/; "
-                f"[ -d /cores ] && ls /cores/core* 1>/dev/null 2>&1 && "
-                f"cp -rf /cores/core* {self.mac_test_log_dir_name}/ || true)",
-            ),
-        ]
+
+    def _mac_worker_env(self, worker):
+        """Server ports of a mac worker, far enough apart for multi-dnode cases"""
+        port = MAC_BASE_PORT + worker * MAC_WORKER_PORT_STRIDE
+        return {"TAOS_SERVER_PORT": str(port), "TAOS_FIRST_EP": f"localhost:{port}"}
+
+    def _mac_workers(self, case_count):
+        try:
+            workers = int(os.getenv("CI_MAC_WORKERS", "") or 1)
+        except ValueError:
+            workers = 1
+        return max(1, min(workers, case_count))
+
+    def _run_mac_function_test(self, mac_case_commands):
+        test_dir = f"{self.wkc}/test"
+        self.utils.run_command("date")
+        self.utils.run_command(f"mkdir -p {self.mac_test_log_dir_name}")
+        venv = VenvCache(self.utils, "python3.9").ensure(f"{test_dir}/requirements.txt")
+        workers = self._mac_workers(len(mac_case_commands))
+        print(f"Run {len(mac_case_commands)} mac cases on {workers} workers")
+        if workers == 1:
+            # a single worker keeps the default ports and shared WORK_DIR
+            for case_path, _ in mac_case_commands:
+                self.utils.run_command(self._mac_case_command(case_path, venv=venv))
+        else:
+            jobs = [
+                (
+                    case_path,
+                    lambda worker, case_path=case_path: CommandSpec(
+                        self._mac_case_command(case_path, worker, venv), log_name=f"mac-case-w{worker}"
+                    ),
+                )
+                for case_path, _ in mac_case_commands
+            ]
+            results = WorkerPool(AsyncUtils(self.utils), workers).run(jobs)
+            failed = [case for (case, _), result in zip(jobs, results) if isinstance(result, BaseException)]
+            if failed:
+                raise RuntimeError(f"mac cases did not run to completion: {failed}")
+        self.utils.run_command("date")
 
     def run_assert_test(self):
         cmd = (
@@ -261,6 +296,21 @@ class TestRunner:
         cmd = f"cd {self.wkc}/test/ci && ./run_check_void_container.sh -d {self.wkdir}"
         self.utils.run_command(cmd, silent=False)
 
+    def run_static_checks(self):
+        """Run the assert and void-function checks concurrently"""
+        AsyncUtils(self.utils, limit=2).run_commands_parallel([
+            CommandSpec(
+                f"./run_check_assert_container.sh -d {self.wkdir}",
+                cwd=f"{self.wkc}/test/ci",
+                log_name="check-assert",
+            ),
+            CommandSpec(
+                f"./run_check_void_container.sh -d {self.wkdir}",
+                cwd=f"{self.wkc}/test/ci",
+                log_name="check-void",
+            ),
+        ])
+
     def run_function_return_test(self):
         print(
             f"PR number: {self.pr_number}, run number: {self.run_number}, attempt: {self.run_attempt}, extra param: {self.extra_param}"
@@ -277,18 +327,19 @@ class TestRunner:
         cases_task_name = "cases.task"
         windows_task_path = "ci/win_cases.task"
         if case_selection["enabled"]:
-            matched_case_lines = self._write_task_file(
-                self.temp_cases_task_path,
-                case_selection["linux_task_lines"],
-            )
-            matched_win_task_lines, matched_win_cases = self._resolve_task_lines_for_cases(
-                self.win_cases_task_path,
-                case_selection["selected_cases"],
-            )
-            matched_win_case_lines = self._write_task_file(
-                self.temp_win_cases_task_path,
-                matched_win_task_lines,
+            platform_selection = case_selection["platform_selection"]
+            case_order = self._get_case_order(case_selection["changed_cases"])
+            for platform_name in (LINUX, WINDOWS):
+                platform_selection[platform_name]["lines"] = self._order_task_lines(
+                    case_order, platform_selection[platform_name]["lines"], platform_name
+                )
+            written = self._get_case_registry().write_task_files(
+                platform_selection,
+                {LINUX: self.temp_cases_task_path, WINDOWS: self.temp_win_cases_task_path},
             )
+            matched_case_lines = written[LINUX]
+            matched_win_case_lines = written[WINDOWS]
+            matched_win_cases = platform_selection[WINDOWS]["matched_cases"]
 
             if matched_case_lines:
                 cases_task_name = "temp_run_cases.task"
@@ -308,29 +359,19 @@ class TestRunner:
                     "Skip selected cases not present in active win_cases.task entries: "
                     f"{sorted(unmatched_win_cases)}"
                 )
+        else:
+            cases_task_name, windows_task_path = self._write_ordered_full_task_files()
 
-        linux_cmds = [
-            f"cd {self.wkc}/test/ci && export DEFAULT_RETRY_TIME=1",
-            "date",
-            f"cd {self.wkc}/test/ci && {self.timeout} time ./run.sh -e -m /home/m.json -t {cases_task_name} -b {self.test_log_dir_name_base} -l {self.wkdir}/log -o 1230 {self.extra_param}",
-        ]
-        mac_cmds = [
-            "date",
-            f"mkdir -p {self.mac_test_log_dir_name}",
-            f"cd {self.wkc}/test && python3.9 -m venv .venv",
-            f"cd {self.wkc}/test && source .venv/bin/activate && pip install --upgrade pip",
-            f"cd {self.wkc}/test && source .venv/bin/activate && pip install -r requirements.txt",
-            "date",
-        ]
         windows_copy_dll_cmd = f"copy {self.wkc}\\..\\debug\\build\\bin\\taos.dll C:\\Windows\\System32 && copy {self.wkc}\\..\\debug\\build\\bin\\pthreadVC3.dll C:\\Windows\\System32 && copy {self.wkc}\\..\\debug\\build\\bin\\taosnative.dll C:\\Windows\\System32"
         windows_cmds = f"cd {self.wkc}/test && python3 ci/run_win_cases.py {windows_task_path} c:/workspace/0/ci-log/{self.test_log_dir_name}"
 
         mac_case_commands = self._get_mac_case_commands()
         if case_selection["enabled"]:
+            matched_mac_cases = case_selection["platform_selection"][MAC]["matched_cases"]
             mac_case_commands = [
                 (case_path, command)
                 for case_path, command in mac_case_commands
-                if case_path in case_selection["selected_cases"]
+                if case_path in matched_mac_cases
             ]
             if mac_case_commands:
                 print(
@@ -340,22 +381,233 @@ class TestRunner:
             else:
                 print("No matching mac case found in fixed mac case list, skip mac function test.")
 
-        mac_cmds[5:5] = [command for _, command in mac_case_commands]
-
         if self.platform == "linux":
             if case_selection["enabled"] and cases_task_name == "cases.task":
                 return
-            self.utils.run_commands(linux_cmds)
+            cases_task_name = self._apply_result_cache(cases_task_name)
+            if cases_task_name is None:
+                return
+            cases_task_name = self._apply_case_timeouts(
+                cases_task_name, self.temp_cases_task_path, "temp_run_cases.task"
+            )
+            if self._shard_plan_enabled():
+                self._run_linux_shards(cases_task_name)
+                return
+            linux_cmds = [
+                f"cd {self.wkc}/test/ci && export DEFAULT_RETRY_TIME=1",
+                "date",
+                f"cd {self.wkc}/test/ci && {self.timeout} time ./run.sh -e -m /home/m.json -t {cases_task_name} -b {self.test_log_dir_name_base} -l {self.wkdir}/log -o 1230 {self.extra_param}",
+            ]
+            results_base = os.path.join(self.wkdir, "log", f"{self.test_log_dir_name_base}_results")
+            result_stream = ResultStream(f"{results_base}.xml", f"{results_base}.json")
+            consumers = [result_stream]
+            watchdog = Watchdog.from_env(result_stream)
+            if watchdog:
+                consumers.append(watchdog)
+            try:
+                self.utils.run_commands(linux_cmds, persistent_shell=True, consumers=consumers)
+            finally:
+                result_stream.close()
+                print(f"Live results: {results_base}.xml, {results_base}.json")
+                if watchdog and watchdog.stop_reason:
+                    self._collect_aborted_run(watchdog.stop_reason)
+                self._record_durations()
         elif self.platform == "darwin":
             if case_selection["enabled"] and not mac_case_commands:
                 return
-            self.utils.run_commands(mac_cmds)
+            self._run_mac_function_test(mac_case_commands)
         elif self.platform == "windows":
             if case_selection["enabled"] and windows_task_path == "ci/win_cases.task":
                 return
             self.utils.run_command(windows_copy_dll_cmd)
             self.utils.run_command(windows_cmds)
 
+    def _get_case_order(self, changed_cases):
+        history = {}
+        try:
+            with DurationStore() as store:
+                history = store.outcome_history(os.getenv("TARGET_BRANCH", ""))
+        except (OSError, sqlite3.Error) as e:
+            print(f"No case outcome history, order by changed cases only: {e}")
+        return CaseOrder(changed_cases, history)
+
+    def _order_task_lines(self, case_order, task_lines, platform_name):
+        """Changed, recently failed and flaky cases first"""
+        if not task_lines:
+            return task_lines
+        print(f"Order of {platform_name} task lines: {case_order.summary(task_lines)}")
+        return case_order.order(task_lines)
+
+    def _write_ordered_full_task_files(self):
+        """Write reordered copies of the full task files when some case should run first"""
+        changed_cases = {
+            file_path[len("test/"):]
+            for file_path in self._read_changed_files()
+            if file_path.startswith("test/cases/")
+        }
+        case_order = self._get_case_order(changed_cases)
+        names = {LINUX: "cases.task", WINDOWS: "ci/win_cases.task"}
+        sources = {LINUX: self.cases_task_path, WINDOWS: self.win_cases_task_path}
+        targets = {
+            LINUX: (self.temp_cases_task_path, "temp_run_cases.task"),
+            WINDOWS: (self.temp_win_cases_task_path, "ci/temp_run_win_cases.task"),
+        }
+        for platform_name, source in sources.items():
+            if not self.utils.file_exists(source):
+                continue
+            task_lines = self.utils.read_file(source).splitlines()
+            if not case_order.prioritized(task_lines):
+                continue
+            target_path, target_name = targets[platform_name]
+            self.utils.write_file(
+                target_path,
+                "\n".join(self._order_task_lines(case_order, task_lines, platform_name)) + "\n",
+            )
+            names[platform_name] = target_name
+            print(f"Use reordered {platform_name} task file: {target_path}")
+        return names[LINUX], names[WINDOWS]
+
+    def _record_durations(self, log_dir_names=None):
+        """Store the per-case timings of this run.sh run for later scheduling decisions,
+        and the passed cases in the result cache"""
+        for log_dir_name in log_dir_names or [self.test_log_dir_name_base]:
+            log_dir = os.path.join(self.wkdir, "log", log_dir_name)
+            if not os.path.isdir(log_dir):
+                continue
+            records = read_log_dir_records(log_dir)
+            results = results_by_case(records)
+            try:
+                with DurationStore() as store:
+                    count = store.ingest_results(results, os.getenv("TARGET_BRANCH", ""), log_dir_name)
+                print(f"Recorded {count} case durations from {log_dir}")
+            except (OSError, sqlite3.Error) as e:
+                print(f"Failed to record case durations: {e}")
+            if self.result_cache is not None:
+                print(f"Result cache: recorded {self.result_cache.record_passes(records)} passed task lines")
+            if self.case_timeouts is not None:
+                self.case_timeouts.print_report(results)
+
+    def _apply_case_timeouts(self, task_name, target_path, target_name):
+        """Embed adaptive per-case budgets into a copy of the task file; return the name to run"""
+        task_lines = self.utils.read_file(self.utils.path(self.wkc, "test", "ci", task_name)).splitlines()
+        cases = {extract_case_path(line) for line in task_lines if is_active_task_line(line)}
+        try:
+            with DurationStore() as store:
+                timeouts = CaseTimeouts.from_store(store, cases, os.getenv("TARGET_BRANCH", ""))
+        except (OSError, sqlite3.Error) as e:
+            print(f"No case duration history, keep run.sh timeouts: {e}")
+            return task_name
+        task_lines = timeouts.apply(task_lines)
+        if not timeouts.applied:
+            return task_name
+        self.case_timeouts = timeouts
+        self.utils.write_file(target_path, "\n".join(task_lines) + "\n")
+        print(
+            f"Adaptive timeouts for {len(timeouts.applied)} of {len(cases)} cases "
+            f"(p99 x {timeouts.factor:g}, {timeouts.floor:.0f}s..{timeouts.ceiling:.0f}s): {target_path}"
+        )
+        return target_name
+
+    def _apply_result_cache(self, cases_task_name):
+        """Skip task lines that already passed with identical inputs.
+        Return the task file name to run, None when nothing is left to run."""
+        build_dir = f"{self.wk}/debug/build"
+        test_dir = f"{self.wkc}/test"
+        cache = ResultCache(
+            binaries=[f"{build_dir}/bin/taosd", f"{build_dir}/bin/taos", f"{build_dir}/lib/libtaos.so"],
+            configs=[f"{test_dir}/ci/run.sh", f"{test_dir}/ci/pytest.sh", f"{test_dir}/requirements.txt"],
+        )
+        if not cache.enabled:
+            return cases_task_name
+        cache.evict(RESULT_CACHE_MAX_AGE, RESULT_CACHE_MAX_BYTES)
+        self.result_cache = cache
+
+        task_lines = self.utils.read_file(self.utils.path(test_dir, "ci", cases_task_name)).splitlines()
+        to_run, decisions = cache.filter(task_lines, test_dir)
+        decision_log = f"{self.temp_cases_task_path}.cache.log"
+        write_decision_log(decision_log, decisions)
+        cached = sorted({case for decision, case, _ in decisions if decision == CACHED_PASS})
+        if not cached:
+            return cases_task_name
+        print(f"Result cache: {len(cached)} cases cached-pass, skipped (see {decision_log}): {cached}")
+        if not to_run:
+            print("All cases already passed with identical inputs, skip linux function test.")
+            return None
+        self.utils.write_file(self.temp_cases_task_path, "\n".join(to_run) + "\n")
+        return "temp_run_cases.task"
+
+    def _shard_plan_enabled(self):
+        return (
+            os.getenv("CI_SHARD_PLAN", "").lower() in ("1", "true", "yes")
+            and os.path.exists(SHARD_HOSTS_PATH)
+        )
+
+    def _plan_linux_shards(self, cases_task_name):
+        """Split the task file over the m.json hosts, longest cases first"""
+        task_path = self.utils.path(self.wkc, "test", "ci", cases_task_name)
+        task_lines = self.utils.read_file(task_path).splitlines()
+        cases = {extract_case_path(line) for line in task_lines if is_active_task_line(line)}
+        costs = {}
+        try:
+            with DurationStore() as store:
+                costs = store.estimates(cases, os.getenv("TARGET_BRANCH", ""))
+        except (OSError, sqlite3.Error) as e:
+            print(f"No case duration history, plan with static costs: {e}")
+        shard_plan = ShardPlanner(load_hosts(SHARD_HOSTS_PATH)).plan(task_lines, costs)
+        shard_plan.print_report()
+        return shard_plan
+
+    def _run_linux_shards(self, cases_task_name):
+        """Run one run.sh per host, each on its own shard of the task file.
+
+        The shards share test/ci but nothing they write: each run.sh gets its
+        own task and hosts file, its own -b log dir (where run.sh keeps its
+        case index, locks and case logs) and its own TMPDIR. Each shard
+        streams its results like the single run.sh; one Watchdog judges the
+        counts of all shards and stops every shard once it trips. The
+        exports of the single run go into each shard's command line, which
+        runs in one shell, so no persistent shell is needed."""
+        ci_dir = f"{self.wkc}/test/ci"
+        shard_plan = self._plan_linux_shards(cases_task_name)
+        specs = []
+        log_dir_names = []
+        streams = ResultStreams()
+        watchdog = Watchdog.from_env(streams)
+        for i, (host, paths) in enumerate(shard_plan.write(ci_dir, prefix="temp_shard").items()):
+            log_dir_name = f"{self.test_log_dir_name_base}_shard{i}"
+            log_dir_names.append(log_dir_name)
+            tmp_dir = os.path.join(self.wkdir, "tmp", log_dir_name)
+            os.makedirs(tmp_dir, exist_ok=True)
+            results_base = os.path.join(self.wkdir, "log", f"{log_dir_name}_results")
+            stream = ResultStream(f"{results_base}.xml", f"{results_base}.json", suite=f"function-{host}")
+            streams.append(stream)
+            specs.append(CommandSpec(
+                f"export DEFAULT_RETRY_TIME=1 && {self.timeout} time ./run.sh -e -m {paths['hosts']} "
+                f"-t {os.path.basename(paths['task'])} -b {log_dir_name} -l {self.wkdir}/log "
+                f"-o 1230 {self.extra_param}",
+                cwd=ci_dir,
+                env=dict(os.environ, TMPDIR=tmp_dir),
+                label=host,
+                consumers=[stream] + ([watchdog] if watchdog else []),
+            ))
+        if not specs:
+            print(f"No active task line in {cases_task_name}, skip linux function test.")
+            return
+        try:
+            results = AsyncUtils(self.utils, limit=len(specs)).run_commands_parallel(
+                specs, return_exceptions=True
+            )
+        finally:
+            for stream, log_dir_name in zip(streams.streams, log_dir_names):
+                stream.close()
+                print(f"Live results: {self.wkdir}/log/{log_dir_name}_results.xml")
+            if watchdog and watchdog.stop_reason:
+                self._collect_aborted_run(watchdog.stop_reason, log_dir_names)
+            self._record_durations(log_dir_names)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
     def run_upgrade_compat_test(self):
         """Run cold/hot upgrade compatibility tests in an isolated Docker container (Linux only)"""
         print(f"PR number: {self.pr_number}, run number: {self.run_number}, attempt: {self.run_attempt}")
@@ -369,19 +621,31 @@ class TestRunner:
     def run_tdgpt_test(self):
         print(f"timeout: {self.timeout}")
 
+        if self.platform != "linux":
+            return
+        # per-case budgets cut a hung case early, the 900s limit stays as the overall bound
+        tdgpt_task_name = self._apply_case_timeouts(
+            "tdgpt_cases.task",
+            self.utils.path(self.wkc, "test", "ci", "temp_run_tdgpt_cases.task"),
+            "temp_run_tdgpt_cases.task",
+        )
         linux_cmds = [
             f"cd {self.wkc}/test/ci && export DEFAULT_RETRY_TIME=2",
             "date",
-            f"cd {self.wkc}/test/ci && timeout 900 time ./run.sh -e -m /home/m.json -t tdgpt_cases.task -b {self.test_log_dir_name_base} -l {self.wkdir}/log -o 900 {self.extra_param}",
+            f"cd {self.wkc}/test/ci && timeout 900 time ./run.sh -e -m /home/m.json -t {tdgpt_task_name} -b {self.test_log_dir_name_base} -l {self.wkdir}/log -o 900 {self.extra_param}",
         ]
-        if self.platform == "linux":
-            self.utils.run_commands(linux_cmds)
+        try:
+            self.utils.run_commands(linux_cmds, persistent_shell=True)
+        finally:
+            self._record_durations()
 
     def run(self):
         if self.test_type == "assert":
             self.run_assert_test()
         elif self.test_type == "void":
             self.run_void_function_test()
+        elif self.test_type == "static":
+            self.run_static_checks()
         elif self.test_type == "function_returns":
             self.run_function_return_test()
         elif self.test_type == "function":
@@ -395,13 +659,37 @@ class TestRunner:
         else:
             raise Exception("Invalid test type")
 
+    def _collect_aborted_run(self, reason, log_dir_names=None):
+        """Make sure nothing of an aborted run.sh survives and keep its logs"""
+        print(f"Run aborted by {reason}")
+        if ProcessTable.supported():
+            table = ProcessTable.snapshot()
+            leftovers = [
+                proc for proc in table.job_processes()
+                if any(name in proc.command for name in ("run.sh", "run_case.sh"))
+            ]
+            for proc in leftovers:
+                print(f"Terminating leftover process tree {proc.pid}: {proc.command[:200]}")
+                table.kill_tree(proc.pid)
+        for log_dir_name in log_dir_names or [self.test_log_dir_name_base]:
+            log_dir = os.path.join(self.wkdir, "log", log_dir_name)
+            if os.path.isdir(log_dir):
+                self.utils.write_file(os.path.join(log_dir, "watchdog_abort.txt"), reason + "\n")
+                archive = shutil.make_archive(f"{log_dir}_aborted", "gztar", log_dir)
+                print(f"Collected logs of the aborted run: {archive}")
+
     def cleanup(self):
-        """Clean up any remaining test processes"""
+        """Clean up remaining test processes started by this job"""
         print("Cleaning up running processes...")
         if self.platform == "linux":
-            self.utils.kill_process("run_case.sh")
+            self.utils.kill_process("run_case.sh", job_only=True)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the test cases of TEST_TYPE")
+    add_no_cache_argument(parser)
+    apply_no_cache_argument(parser.parse_args())
+    ensure_job_marker()
     test_runner = TestRunner()
-    test_runner.run()
+    with get_tracer().span(f"test:{test_runner.test_type}"):
+        test_runner.run()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the scripts are flat modules run from .github/scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,82 @@
+import os
+import subprocess
+import time
+
+import pytest
+
+from async_utils import AsyncUtils, CommandSpec
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # a zombie left to init counts as gone
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().split(")")[-1].split()[0] != "Z"
+    except OSError:
+        return True
+
+
+def _wait_gone(pid, timeout=5.0):
+    deadline = time.time() + timeout
+    while _alive(pid) and time.time() < deadline:
+        time.sleep(0.05)
+    return not _alive(pid)
+
+
+@pytest.fixture(autouse=True)
+def _in_tmp(tmp_path, monkeypatch):
+    # log sinks write next to the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+def test_timeout_kills_processes_started_by_the_shell(tmp_path):
+    pid_file = tmp_path / "pid"
+    with pytest.raises(subprocess.TimeoutExpired):
+        AsyncUtils().run_command(f"sleep 30 & echo $! > {pid_file}; wait", timeout=1, silent=True)
+    assert _wait_gone(int(pid_file.read_text()))
+
+
+def test_failure_cancels_sibling_commands(tmp_path):
+    pid_file = tmp_path / "pid"
+    start = time.time()
+    with pytest.raises(subprocess.CalledProcessError):
+        AsyncUtils().run_commands_parallel([
+            CommandSpec(f"sleep 30 & echo $! > {pid_file}; wait", silent=True),
+            CommandSpec("sleep 0.5; exit 3", silent=True),
+        ])
+    assert time.time() - start < 10
+    assert _wait_gone(int(pid_file.read_text()))
+
+
+def test_results_in_input_order():
+    results = AsyncUtils().run_commands_parallel(
+        [CommandSpec(f"sleep 0.{3 - i}; exit {i}", check=False, silent=True) for i in range(3)]
+    )
+    assert [r.returncode for r in results] == [0, 1, 2]
+
+
+class _StopOn:
+    """Consumer asking to stop once `word` was seen"""
+
+    def __init__(self, word):
+        self.word = word
+        self.seen = b""
+        self.stop_reason = None
+
+    def feed(self, data):
+        self.seen += data
+        if self.word in self.seen:
+            self.stop_reason = f"saw {self.word!r}"
+
+
+def test_consumers_can_stop_a_command():
+    consumer = _StopOn(b"ready")
+    start = time.time()
+    result = AsyncUtils().run_command("echo ready; sleep 30", consumers=[consumer], check=False, silent=True)
+    assert time.time() - start < 10
+    assert result.returncode != 0
+    assert consumer.stop_reason == "saw b'ready'"
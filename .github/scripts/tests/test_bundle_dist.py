@@ -0,0 +1,77 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from bundle_dist import BundleBuilder, parse_probe
+from utils import Utils
+
+
+def _git(repo, *args):
+    return subprocess.run(["git", *args], cwd=repo, check=True, capture_output=True, text=True).stdout.strip()
+
+
+@pytest.fixture
+def repo(tmp_path):
+    path = tmp_path / "repo"
+    path.mkdir()
+    _git(path, "init", "-q")
+    _git(path, "config", "user.email", "ci@example.com")
+    _git(path, "config", "user.name", "ci")
+    for i in range(2):
+        (path / "file").write_text(f"{i}\n")
+        _git(path, "add", "file")
+        _git(path, "commit", "-q", "-m", f"commit {i}")
+    return path
+
+
+def test_parse_probe_accepts_sha1_and_sha256_ids():
+    sha1 = "a" * 40
+    sha256 = "b" * 64
+    output = f"{sha1}\nfatal: not a ref\n{sha256}\n{'c' * 50}\n"
+    assert parse_probe(output) == [sha1, sha256]
+
+
+def test_probe_skips_missing_refs(repo):
+    builder = BundleBuilder(Utils(), repo, ["HEAD"])
+    command = builder.probe_command(str(repo)).replace("HEAD^{commit}", "refs/missing^{commit}", 1)
+    result = subprocess.run(["bash", "-c", command], capture_output=True, text=True)
+    assert result.returncode == 0
+    assert parse_probe(result.stdout) == [_git(repo, "rev-parse", "HEAD")]
+
+
+def test_probe_fails_without_repository(repo, tmp_path):
+    builder = BundleBuilder(Utils(), repo, ["HEAD"])
+    result = subprocess.run(["bash", "-c", builder.probe_command(str(tmp_path / "absent"))], capture_output=True)
+    assert result.returncode != 0
+
+
+def test_bundle_only_carries_commits_beyond_host_tips(repo, tmp_path):
+    builder = BundleBuilder(Utils(), repo, ["HEAD"], tmp_path / "bundles")
+    head = _git(repo, "rev-parse", "HEAD")
+    assert builder.bundle_for([head]) is None
+    path = builder.bundle_for([_git(repo, "rev-parse", "HEAD~1")])
+    assert path and path == builder.bundle_for([_git(repo, "rev-parse", "HEAD~1")])
+    assert _git(repo, "bundle", "list-heads", path).split()[0] == head
+
+
+def test_apply_commands_can_run_again(repo, tmp_path):
+    host = tmp_path / "host"
+    _git(tmp_path, "clone", "-q", str(repo), str(host))
+    (repo / "file").write_text("2\n")
+    _git(repo, "commit", "-q", "-am", "commit 2")
+    _git(repo, "update-ref", "refs/ci/target", "HEAD")
+    builder = BundleBuilder(Utils(), repo, ["refs/ci/target"], tmp_path / "bundles")
+    probe = subprocess.run(["bash", "-c", builder.probe_command(str(host))], capture_output=True, text=True)
+    path = builder.bundle_for(parse_probe(probe.stdout))
+    remote_bundle = str(host / "target.bundle")
+    steps = builder.apply_commands(str(host), remote_bundle) + builder.cleanup_commands(remote_bundle)
+    shutil.copyfile(path, remote_bundle)
+    # the second run finds the bundle removed and the commits in place
+    for _ in range(2):
+        for name, command in steps:
+            result = subprocess.run(["bash", "-c", command], capture_output=True, text=True)
+            assert result.returncode == 0, f"{name}: {result.stderr}"
+        assert _git(host, "rev-parse", "refs/ci/target") == _git(repo, "rev-parse", "HEAD")
+    assert not os.path.exists(remote_bundle)
@@ -0,0 +1,47 @@
+import pytest
+
+import test_runner
+
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch):
+    monkeypatch.setenv("WKDIR", str(tmp_path))
+    monkeypatch.setenv("PR_NUMBER", "1")
+    monkeypatch.setenv("GITHUB_RUN_NUMBER", "2")
+    monkeypatch.setenv("GITHUB_RUN_ATTEMPT", "3")
+    ci_dir = tmp_path / "TDinternal" / "community" / "test" / "ci"
+    ci_dir.mkdir(parents=True)
+    (ci_dir / "cases.task").write_text(
+        ",,y,.,./ci/pytest.sh pytest cases/a/test_active.py\n"
+        "#,,y,.,./ci/pytest.sh pytest cases/a/test_disabled.py\n"
+    )
+    (tmp_path / "tmp" / "1_2_3").mkdir(parents=True)
+    return test_runner.TestRunner()
+
+
+def _changed(runner, *files):
+    runner.changed_files_path.write_text("\n".join(files) + "\n")
+
+
+def test_source_change_without_active_case_runs_full_suite(runner, monkeypatch):
+    _changed(runner, "source/libs/parser/src/parAstCreater.c")
+    monkeypatch.setattr(
+        test_runner.TestRunner, "_get_impacted_cases", lambda self, files: {"cases/a/test_disabled.py"}
+    )
+    selection = runner._get_case_selection()
+    assert selection["enabled"] is False and selection["skip"] is False
+
+
+def test_source_change_runs_impacted_cases(runner, monkeypatch):
+    _changed(runner, "source/libs/parser/src/parAstCreater.c")
+    monkeypatch.setattr(
+        test_runner.TestRunner, "_get_impacted_cases", lambda self, files: {"cases/a/test_active.py"}
+    )
+    selection = runner._get_case_selection()
+    assert selection["enabled"] is True and selection["selected_cases"] == {"cases/a/test_active.py"}
+
+
+def test_disabled_case_change_only_skips(runner):
+    _changed(runner, "test/cases/a/test_disabled.py")
+    selection = runner._get_case_selection()
+    assert selection["enabled"] is True and selection["skip"] is True
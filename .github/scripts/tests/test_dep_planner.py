@@ -0,0 +1,76 @@
+import json
+import subprocess
+
+import pytest
+
+from dep_planner import DependencyPlanner
+
+
+class FakeUtils:
+    """Answers queries from a table and records every command"""
+
+    def __init__(self, outputs=None, failures=()):
+        self.outputs = outputs or {}
+        self.failures = list(failures)
+        self.commands = []
+
+    def run_command(self, command, check=True, **kwargs):
+        text = command if isinstance(command, str) else " ".join(command)
+        self.commands.append(text)
+        returncode = 1 if text in self.failures else 0
+        if returncode and text in self.failures:
+            self.failures.remove(text)
+        if check and returncode:
+            raise subprocess.CalledProcessError(returncode, text)
+        return subprocess.CompletedProcess(text, returncode, stdout=self.outputs.get(text, ""))
+
+
+BREW_INFO = json.dumps({
+    "formulae": [
+        {"name": "openssl@3", "full_name": "openssl@3", "aliases": ["openssl"], "oldnames": [],
+         "installed": [{"version": "3.3.1"}]},
+        {"name": "pkgconf", "full_name": "pkgconf", "aliases": ["pkg-config"], "oldnames": [],
+         "installed": [{"version": "2.3.0"}]},
+        {"name": "gawk", "full_name": "gawk", "aliases": [], "installed": [{"version": "5.3.0"}]},
+    ],
+    "casks": [],
+})
+
+
+def test_brew_aliases_count_as_installed():
+    utils = FakeUtils({"brew info --json=v2 --installed": BREW_INFO})
+    plan = DependencyPlanner(utils, "macOS").plan(["openssl", "pkg-config", "gawk", "snappy"])
+    assert plan["missing"] == ["snappy"]
+    assert plan["installed"] == {"openssl": "3.3.1", "pkg-config": "2.3.0", "gawk": "5.3.0"}
+
+
+def test_brew_list_fallback():
+    utils = FakeUtils({"brew list --versions": "gawk 5.3.0\nsnappy 1.2.1\n"})
+    assert DependencyPlanner(utils, "macOS").plan(["gawk", "snappy"])["missing"] == []
+
+
+DPKG = "dpkg-query -W -f=${Package}\t${db:Status-Status}\t${Version}\t${Provides}\n"
+
+
+def test_apt_install_retries_once_after_update(monkeypatch):
+    install = "sudo apt install -y cmake"
+    utils = FakeUtils({DPKG: "gawk\tinstalled\t1:5.1\t\n"}, failures=[install])
+    planner = DependencyPlanner(utils, "linux", index_max_age=float("inf"))
+    monkeypatch.setattr(planner, "index_age", lambda: 0.0)
+    assert planner.apply(["gawk", "cmake"]) == ["cmake"]
+    assert utils.commands[1:] == [install, "sudo apt update -y", install]
+
+
+def test_apt_install_failure_after_refresh_is_raised(monkeypatch):
+    install = "sudo apt install -y cmake"
+    utils = FakeUtils(failures=[install])
+    planner = DependencyPlanner(utils, "linux", index_max_age=0)
+    monkeypatch.setattr(planner, "index_age", lambda: 10.0)
+    with pytest.raises(subprocess.CalledProcessError):
+        planner.apply(["cmake"])
+    assert utils.commands[1:] == ["sudo apt update -y", install]
+
+
+def test_virtual_packages_from_provides():
+    utils = FakeUtils({DPKG: "zlib1g-dev\tinstalled\t1:1.2\tlibz-dev\n"})
+    assert DependencyPlanner(utils, "linux").plan(["libz-dev"])["missing"] == []
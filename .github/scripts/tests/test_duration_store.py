@@ -0,0 +1,45 @@
+import os
+
+from duration_store import FAIL, PASS, TIMEOUT, DurationStore, parse_result_lines, read_log_dir_results
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "run_sh_log")
+
+
+def test_reads_run_sh_done_lines():
+    results = read_log_dir_results(FIXTURE_DIR)
+    assert results == {
+        "cases/01-DataTypes/test_datatype_bigint.py": (PASS, 37.0),
+        "cases/13-StreamProcessing/test_stream_basic.py": (FAIL, 214.0),
+        "cases/22-Users/test_user_privilege.py": (PASS, 8.0),
+        "tsim/parser/join.sim": (PASS, 61.0),
+    }
+
+
+def test_other_orders_and_outcomes():
+    lines = [
+        "cases/a/test_x.py passed in 12.5 seconds",
+        "TIMEOUT cases/a/test_y.py after 1200s",
+        "cases/a/test_z.py: 3 checks, 3s",
+    ]
+    assert list(parse_result_lines(lines)) == [
+        ("cases/a/test_x.py", PASS, 12.5),
+        ("cases/a/test_y.py", TIMEOUT, 1200.0),
+    ]
+
+
+def test_unknown_outcome_from_custom_regex_is_skipped(monkeypatch):
+    monkeypatch.setenv("CI_DURATION_LOG_REGEX", r"(?P<case>cases/\S+) (?P<outcome>\w+) (?P<duration>\d+)s")
+    lines = ["cases/a/test_x.py skipped 0s", "cases/a/test_y.py failed 4s"]
+    assert list(parse_result_lines(lines)) == [("cases/a/test_y.py", FAIL, 4.0)]
+
+
+def test_empty_log_dir_warns(tmp_path, capsys):
+    (tmp_path / "taosd.log").write_text("no results here\n")
+    assert read_log_dir_results(tmp_path) == {}
+    assert "no case results found" in capsys.readouterr().err
+
+
+def test_ingest_and_estimate(tmp_path):
+    with DurationStore(tmp_path / "durations.sqlite") as store:
+        store.ingest_results(read_log_dir_results(FIXTURE_DIR), "main", "run-1")
+        assert store.estimate("cases/01-DataTypes/test_datatype_bigint.py", "main", q=0.5) == 37.0
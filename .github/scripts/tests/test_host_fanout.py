@@ -0,0 +1,44 @@
+import time
+
+from host_fanout import DEADLINE, OK, AdaptiveLimit, HostFanout
+
+
+def test_one_slow_host_among_fast_ones_does_not_shrink_limit():
+    limit = AdaptiveLimit(initial=10, minimum=2, maximum=64, cooldown=0)
+    # a fast host first used to make every later one look congested
+    for latency in [0.1, 2.0, 2.5, 1.8, 2.2, 3.0, 2.1]:
+        limit.adjust(latency, ok=True)
+    assert limit.limit == 17
+
+
+def test_latency_far_above_median_halves_limit():
+    limit = AdaptiveLimit(initial=10, minimum=2, maximum=64, cooldown=0)
+    for _ in range(6):
+        limit.adjust(1.0, ok=True)
+    assert limit.limit == 16
+    limit.adjust(10.0, ok=True)
+    assert limit.limit == 8
+
+
+def test_errors_halve_limit_once_per_cooldown():
+    limit = AdaptiveLimit(initial=16, minimum=2, maximum=64, cooldown=60)
+    limit.adjust(1.0, ok=False)
+    limit.adjust(1.0, ok=False)
+    assert limit.limit == 8
+
+
+def test_run_reports_deadline_and_calls_hook():
+    closed = []
+
+    def operation(host_config):
+        time.sleep(0.5 if host_config["host"] == "slow" else 0.01)
+        return True
+
+    fanout = HostFanout(deadline=0.2, progress_interval=60)
+    results = fanout.run(
+        [{"host": "fast"}, {"host": "slow"}],
+        operation,
+        on_deadline=lambda host_config: closed.append(host_config["host"]),
+    )
+    assert [result["status"] for result in results] == [OK, DEADLINE]
+    assert closed == ["slow"]
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+from impact_analysis import ImpactIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = ImpactIndex(tmp_path / "index.json")
+    index.ingest_coverage("cases/parser/test_parser.py", ["source/libs/parser/src/parser.c"])
+    index.ingest_coverage("cases/query/test_query.py", ["source/libs/executor/src/exec.c"])
+    index.ingest_coverage("cases/insert/test_insert.py", ["source/dnode/vnode/src/write.c"])
+    index.ingest_coverage("cases/misc/test_misc.py", ["source/util/src/misc.c"])
+    index.includes = {
+        "source/libs/parser/src/parser.c": {"stat": [0, 0], "includes": ["include/libs/parser/parser.h"]},
+        "include/libs/parser/parser.h": {"stat": [0, 0], "includes": []},
+    }
+    return index
+
+
+def select(index, *files):
+    return index.select(list(files), max_fraction=0.5)
+
+
+def test_no_coverage_runs_full_suite(tmp_path):
+    cases, reason = ImpactIndex(tmp_path / "empty.json").select(["source/util/src/misc.c"])
+    assert cases is None and "no coverage" in reason
+
+
+def test_stale_coverage_runs_full_suite(index):
+    index.coverage["cases/misc/test_misc.py"]["updated"] = time.time() - 30 * 86400
+    cases, reason = index.select(["source/util/src/misc.c"], max_age=14 * 86400)
+    assert cases is None and "older than" in reason
+
+
+def test_source_change_selects_covering_cases(index):
+    cases, _ = select(index, "source/libs/executor/src/exec.c")
+    assert cases == {"cases/query/test_query.py"}
+
+
+def test_header_change_reaches_including_sources(index):
+    cases, _ = select(index, "include/libs/parser/parser.h")
+    assert cases == {"cases/parser/test_parser.py"}
+
+
+def test_mixed_changes(index):
+    cases, _ = select(
+        index,
+        "docs/en/intro.md",
+        "README.md",
+        "test/cases/new/test_new.py",
+        "source/libs/executor/src/exec.c",
+    )
+    assert cases == {"cases/new/test_new.py", "cases/query/test_query.py"}
+
+
+def test_docs_only_selects_nothing(index):
+    assert select(index, "docs/zh/index.md", ".github/workflows/ci.yml") == (set(), "0 cases affected by 2 changed files")
+
+
+@pytest.mark.parametrize("path", [
+    "test/requirements.txt",
+    "test/cases/parser/data/rows.txt",
+    "test/ci/run.sh",
+    "test/new_test_framework/utils/sql.py",
+    "cmake/define.cmake",
+    "source/CMakeLists.txt",
+    "tools/CMakeLists.txt",
+])
+def test_shared_inputs_run_full_suite(index, path):
+    cases, reason = select(index, "source/util/src/misc.c", path)
+    assert cases is None and path in reason
+
+
+def test_unknown_file_runs_full_suite(index):
+    cases, reason = select(index, "tools/taos-tools/src/benchMain.go")
+    assert cases is None and "no impact rule" in reason
+
+
+def test_uncovered_source_runs_full_suite(index):
+    cases, reason = select(index, "source/libs/new/src/new.c")
+    assert cases is None and "no case covers" in reason
+
+
+def test_too_many_cases_runs_full_suite(index):
+    cases, reason = select(
+        index, "source/libs/executor/src/exec.c", "source/dnode/vnode/src/write.c", "source/util/src/misc.c"
+    )
+    assert cases is None and "3 of 4" in reason
@@ -0,0 +1,56 @@
+import subprocess
+import time
+
+from io_pump import OutputPump
+
+
+def _popen(command):
+    return subprocess.Popen(["bash", "-c", command], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def test_pumps_output_of_several_processes():
+    outputs = {}
+    exit_codes = {}
+    with OutputPump() as pump:
+        for i in range(4):
+            proc = _popen(f"for n in 1 2 3; do echo {i}-$n; echo err{i} >&2; done; exit {i}")
+            outputs[proc] = []
+            pump.add(
+                proc,
+                on_stdout=outputs[proc].append,
+                on_exit=lambda p: exit_codes.__setitem__(p, p.returncode),
+            )
+        pump.run()
+    assert pump.active == 0
+    for i, (proc, chunks) in enumerate(outputs.items()):
+        assert b"".join(chunks).split() == [f"{i}-{n}".encode() for n in (1, 2, 3)]
+        assert exit_codes[proc] == i
+
+
+def test_process_with_closed_pipes_does_not_stall_others():
+    events = []
+    start = time.time()
+    with OutputPump() as pump:
+        # closes its output right away but keeps running
+        silent = _popen("exec >&- 2>&-; sleep 2")
+        talker = _popen("for n in 1 2 3; do echo $n; sleep 0.2; done")
+        pump.add(silent, on_exit=lambda p: events.append(("silent", time.time() - start)))
+        pump.add(
+            talker,
+            on_stdout=lambda data: events.append(("out", time.time() - start)),
+            on_exit=lambda p: events.append(("talker", time.time() - start)),
+        )
+        pump.run()
+    finished = dict((name, at) for name, at in events if name != "out")
+    assert finished["talker"] < 1.5 <= finished["silent"]
+    assert all(at < 1.5 for name, at in events if name == "out")
+    assert silent.returncode == 0 and talker.returncode == 0
+
+
+def test_rusage_is_recorded():
+    with OutputPump() as pump:
+        proc = _popen("true")
+        pump.add(proc, on_stdout=lambda data: None)
+        pump.run()
+    assert proc.returncode == 0
+    assert proc in pump.rusage
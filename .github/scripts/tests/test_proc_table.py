@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from proc_table import JOB_MARKER_ENV, ProcessTable, ensure_job_marker
+from utils import Utils
+
+pytestmark = pytest.mark.skipif(not ProcessTable.supported(), reason="needs /proc")
+
+
+@pytest.fixture
+def sleeper():
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)", "ci-proc-table-test"])
+    # wait for the exec, before it the child still shows our command line
+    deadline = time.time() + 5
+    while "ci-proc-table-test" not in open(f"/proc/{proc.pid}/cmdline").read() and time.time() < deadline:
+        time.sleep(0.01)
+    yield proc
+    proc.kill()
+    proc.wait()
+
+
+def test_cmdline_is_matched_as_regex(sleeper):
+    table = ProcessTable.snapshot()
+    assert sleeper.pid in {p.pid for p in table.find(cmdline=r"sleep\(3\d\) ci-proc-table")}
+    assert sleeper.pid in {p.pid for p in table.find(cmdline=r"^\S*python\S* -c .*table-test$")}
+    assert not table.find(cmdline="^table-test")
+
+
+def test_invalid_regex_is_matched_literally(sleeper):
+    assert sleeper.pid in {p.pid for p in ProcessTable.snapshot().find(cmdline="time.sleep(30")}
+
+
+def test_process_exists(sleeper):
+    assert Utils().process_exists("time.sleep.* ci-proc-table-.*")
+    assert not Utils().process_exists("no-such-process-[0-9]+x")
+
+
+def test_utils_does_not_set_job_marker(monkeypatch):
+    monkeypatch.delenv(JOB_MARKER_ENV, raising=False)
+    Utils()
+    assert JOB_MARKER_ENV not in os.environ
+    marker = ensure_job_marker()
+    assert os.environ[JOB_MARKER_ENV] == marker == ensure_job_marker()
@@ -0,0 +1,81 @@
+import pytest
+
+from duration_store import FAIL, PASS
+from result_cache import CACHED_PASS, RUN, ResultCache
+
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / "bin").mkdir()
+    (tmp_path / "test" / "cases" / "a").mkdir(parents=True)
+    (tmp_path / "bin" / "taosd").write_bytes(b"taosd v1")
+    (tmp_path / "run.sh").write_text("#!/bin/bash\n")
+    (tmp_path / "test" / "cases" / "a" / "test_a.py").write_text("def test(): pass\n")
+    (tmp_path / "test" / "cases" / "a" / "test_b.py").write_text("def test(): pass\n")
+    return tmp_path
+
+
+LINE_A = ",,y,.,./ci/pytest.sh pytest cases/a/test_a.py"
+LINE_A3 = ",,y,.,./ci/pytest.sh pytest cases/a/test_a.py -N 3"
+LINE_B = ",,y,.,./ci/pytest.sh pytest cases/a/test_b.py"
+
+
+def cache_for(tree):
+    return ResultCache(tree / "cache", enabled=True, binaries=[tree / "bin" / "taosd"], configs=[tree / "run.sh"])
+
+
+def done(line, outcome, seconds=5.0):
+    case = line.split()[-1] if line.endswith(".py") else line.split()[-3]
+    info = line.split(",", 2)[2]
+    return case, outcome, seconds, f"1  DONE  <<<<<  {info} [{int(seconds)}s]  {'success' if outcome == PASS else 'failed'}"
+
+
+def run_once(tree, lines, records):
+    cache = cache_for(tree)
+    to_run, _ = cache.filter(lines, tree / "test")
+    cache.record_passes(records)
+    return to_run
+
+
+def decisions(tree, lines):
+    return [decision for decision, _, _ in cache_for(tree).filter(lines, tree / "test")[1]]
+
+
+def test_passed_line_is_cached(tree):
+    run_once(tree, [LINE_A, LINE_B], [done(LINE_A, PASS), done(LINE_B, FAIL)])
+    assert decisions(tree, [LINE_A, LINE_B]) == [CACHED_PASS, RUN]
+
+
+def test_case_on_several_lines_is_judged_per_line(tree):
+    run_once(tree, [LINE_A, LINE_A3], [done(LINE_A3, FAIL), done(LINE_A, PASS)])
+    assert decisions(tree, [LINE_A, LINE_A3]) == [CACHED_PASS, RUN]
+
+
+def test_result_without_command_needs_a_single_line(tree):
+    bare = ("cases/a/test_a.py", PASS, 5.0, "cases/a/test_a.py passed in 5s")
+    run_once(tree, [LINE_A, LINE_A3], [bare])
+    assert decisions(tree, [LINE_A, LINE_A3]) == [RUN, RUN]
+    run_once(tree, [LINE_A], [bare])
+    assert decisions(tree, [LINE_A]) == [CACHED_PASS]
+
+
+@pytest.mark.parametrize("change", ["binary", "config", "case file", "task line"])
+def test_changed_inputs_miss(tree, change):
+    run_once(tree, [LINE_A], [done(LINE_A, PASS)])
+    line = LINE_A
+    if change == "binary":
+        (tree / "bin" / "taosd").write_bytes(b"taosd v2")
+    elif change == "config":
+        (tree / "run.sh").write_text("#!/bin/bash\nset -e\n")
+    elif change == "case file":
+        (tree / "test" / "cases" / "a" / "test_a.py").write_text("def test(): assert 1\n")
+    else:
+        line = LINE_A + " -R"
+    assert decisions(tree, [line]) == [RUN]
+
+
+def test_missing_binary_disables_cache(tree):
+    (tree / "bin" / "taosd").unlink()
+    cache = cache_for(tree)
+    assert not cache.enabled
+    assert cache.filter([LINE_A], tree / "test")[0] == [LINE_A]
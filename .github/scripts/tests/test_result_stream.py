@@ -0,0 +1,80 @@
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from duration_store import FAIL, PASS, TIMEOUT
+from result_stream import JUnitWriter, ResultStream, ResultStreams, Watchdog
+
+
+def _done(case, seconds, outcome):
+    return f"    1  DONE  <<<<<  y,.,./ci/pytest.sh pytest {case} [{seconds}s]  {outcome}\n".encode()
+
+
+def test_watchdog_over_shards_counts_all_streams(tmp_path):
+    streams = ResultStreams()
+    watchdog = Watchdog(streams, max_failures=2)
+    for i in range(2):
+        streams.append(ResultStream(tmp_path / f"s{i}.xml", tmp_path / f"s{i}.json"))
+    streams.streams[0].feed(_done("cases/a/test_a.py", 3, "failed"))
+    watchdog.feed(b"")
+    assert watchdog.stop_reason is None
+    streams.streams[1].feed(_done("cases/b/test_b.py", 4, "success") + _done("cases/b/test_c.py", 5, "failed"))
+    watchdog.feed(b"")
+    assert streams.finished == 3
+    assert "2 cases failed" in watchdog.stop_reason
+    for stream in streams.streams:
+        stream.close()
+
+
+def test_junit_is_valid_after_every_add(tmp_path):
+    path = tmp_path / "results.xml"
+    writer = JUnitWriter(path, "function")
+    assert ET.parse(path).getroot().find("testsuite").get("tests").strip() == "0"
+    added = [
+        ("cases/a/test_a.py", PASS, 3.0, ""),
+        ("cases/a/test_b.py", FAIL, 4.5, "AssertionError: <expected> & 'got' \"x\""),
+        ("tsim/parser/join.sim", TIMEOUT, 1200.0, "killed after 1200s"),
+    ]
+    for count, (case, outcome, duration, message) in enumerate(added, 1):
+        writer.add(case, outcome, duration, message)
+        suite = ET.parse(path).getroot().find("testsuite")
+        cases = suite.findall("testcase")
+        assert len(cases) == count
+        assert int(suite.get("tests")) == count
+        assert float(suite.get("time")) == sum(item[2] for item in added[:count])
+    writer.close()
+    failures = [case.find("failure") for case in cases]
+    assert failures[0] is None
+    assert failures[1].get("type") == "failure" and failures[1].text == added[1][3]
+    assert failures[2].get("type") == "timeout"
+    assert int(suite.get("failures")) == 2
+
+
+def test_stream_reads_split_chunks(tmp_path):
+    stream = ResultStream(tmp_path / "r.xml", tmp_path / "r.json")
+    data = b"    1 START >>>>> y,.,./ci/pytest.sh pytest cases/a/test_a.py\n" + _done("cases/a/test_a.py", 7, "success")
+    for i in range(0, len(data), 5):
+        stream.feed(data[i:i + 5])
+    stream.close()
+    assert stream.passed == 1 and stream.running == {}
+
+
+def test_stream_over_run_sh_log_writes_valid_junit(tmp_path):
+    log = Path(__file__).parent / "fixtures" / "run_sh_log" / "run.log"
+    stream = ResultStream(tmp_path / "r.xml", tmp_path / "r.json")
+    stream.feed(log.read_bytes())
+    stream.close()
+    assert stream.passed == 3 and len(stream.failed) == 1
+    # the "error info begin" banner after the failure does not restart the case
+    assert stream.running == {}
+    suite = ET.parse(tmp_path / "r.xml").getroot().find("testsuite")
+    failure = suite.find("testcase[@name='cases/13-StreamProcessing/test_stream_basic.py']/failure")
+    assert "\x1b" not in failure.text and failure.text.endswith("failed")
+
+
+def test_junit_drops_characters_invalid_in_xml(tmp_path):
+    path = tmp_path / "results.xml"
+    writer = JUnitWriter(path, "function")
+    writer.add("cases/a/test_a.py", FAIL, 1.0, "bad \x00\x07 bytes")
+    writer.close()
+    failure = ET.parse(path).getroot().find("testsuite/testcase/failure")
+    assert failure.text == "bad  bytes"
@@ -0,0 +1,52 @@
+import subprocess
+
+import pytest
+
+from output_capture import CAPTURE_FULL
+from shell_session import ShellSession
+from utils import Utils
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with ShellSession(Utils()) as session:
+        yield session
+
+
+def run(session, command, **kwargs):
+    return session.run(command, check=False, silent=True, capture=CAPTURE_FULL, **kwargs)
+
+
+def test_exit_codes(session):
+    assert run(session, "true").returncode == 0
+    assert run(session, "false").returncode == 1
+    assert run(session, "(exit 7)").returncode == 7
+    with pytest.raises(subprocess.CalledProcessError):
+        session.run("(exit 3)", silent=True)
+
+
+def test_export_and_cd_persist(session, tmp_path):
+    run(session, "export CI_SESSION_TEST=kept")
+    run(session, "cd /", cwd=tmp_path)
+    assert run(session, "echo $CI_SESSION_TEST").stdout.strip() == "kept"
+    assert run(session, "pwd").stdout.strip() == "/"
+    assert run(session, "pwd", cwd=tmp_path).stdout.strip() == str(tmp_path)
+
+
+@pytest.mark.parametrize("command", ["echo 'unterminated", "if true; then", "echo )"])
+def test_syntax_error_does_not_hang(session, command):
+    result = run(session, command)
+    assert result.returncode == 2
+    # the session survives and keeps its framing
+    assert run(session, "echo still-here").stdout == "still-here\n"
+
+
+def test_exit_ends_the_session(session):
+    assert run(session, "exit 4").returncode == 4
+    assert run(session, "echo restarted").stdout == "restarted\n"
+
+
+def test_quotes_and_multiline_commands(session):
+    result = run(session, "for w in a 'b c'; do\n  echo \"$w\"\ndone")
+    assert result.stdout == "a\nb c\n"
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+
+import pytest
+
+from ssh_pool import LocalTransport, SSHPool
+
+HOST = {"host": "local", "username": "ci"}
+
+
+class _SilentChannel:
+    """Channel whose command never produces output nor EOF"""
+
+    def __init__(self):
+        self._pipe = os.pipe()
+        self.eof_received = False
+        self.status_event = threading.Event()
+
+    def fileno(self):
+        return self._pipe[0]
+
+    def exec_command(self, command):
+        pass
+
+    def recv_ready(self):
+        return False
+
+    def recv_stderr_ready(self):
+        return False
+
+    def close(self):
+        for fd in self._pipe:
+            os.close(fd)
+
+
+class _SilentTransport(LocalTransport):
+    def open_session(self):
+        return _SilentChannel()
+
+
+class _FlakySFTP:
+    def __init__(self, error):
+        self.error = error
+
+    def put(self, local_path, remote_path):
+        raise self.error
+
+    def close(self):
+        pass
+
+
+def test_execute_collects_both_streams_and_exit_code():
+    with SSHPool(connect=lambda h, u: LocalTransport()) as pool:
+        exit_code, stdout, stderr = pool.execute(HOST, "seq 1 20000; echo oops >&2; exit 3")
+        assert exit_code == 3
+        assert stdout.splitlines()[-1] == "20000"
+        assert stderr == "oops\n"
+        pool.execute(HOST, "true")
+        assert pool.connects == 1
+
+
+def test_execute_times_out_without_output():
+    with SSHPool(connect=lambda h, u: _SilentTransport()) as pool:
+        start = time.time()
+        with pytest.raises(TimeoutError):
+            pool.execute(HOST, "sleep 60", timeout=0.3)
+        assert time.time() - start < 2
+
+
+def test_put_retries_on_stale_session(tmp_path):
+    source = tmp_path / "script.sh"
+    source.write_text("echo hi\n")
+    with SSHPool(connect=lambda h, u: LocalTransport()) as pool:
+        pool._sftp["local"] = _FlakySFTP(EOFError("session closed"))
+        pool.transport(HOST)
+        pool.put(HOST, source, str(tmp_path / "copy.sh"))
+        assert (tmp_path / "copy.sh").read_text() == "echo hi\n"
+        assert pool.connects == 2
+
+
+def test_put_raises_upload_errors_without_reconnecting(tmp_path):
+    with SSHPool(connect=lambda h, u: LocalTransport()) as pool:
+        with pytest.raises(FileNotFoundError):
+            pool.put(HOST, tmp_path / "missing.sh", str(tmp_path / "copy.sh"))
+        assert pool.connects == 1
+
+
+def test_sftp_is_opened_once_across_threads():
+    opened = []
+
+    class CountingTransport(LocalTransport):
+        def open_sftp_client(self):
+            time.sleep(0.05)
+            opened.append(1)
+            return super().open_sftp_client()
+
+    with SSHPool(connect=lambda h, u: CountingTransport()) as pool:
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(pool.sftp(HOST))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(opened) == 1
+        assert len({id(client) for client in clients}) == 1
@@ -0,0 +1,71 @@
+import argparse
+import multiprocessing
+import subprocess
+
+import pytest
+
+from step_cache import StepCache, add_no_cache_argument, apply_no_cache_argument, cache_disabled
+
+
+def test_key_follows_input_content(tmp_path):
+    cache = StepCache(tmp_path / "cache", enabled=True)
+    requirements = tmp_path / "requirements.txt"
+    requirements.write_text("a==1\n")
+    key = cache.key("pip install -r requirements.txt", [requirements], tmp_path)
+    assert not cache.lookup(key)
+    cache.store(key, "pip install -r requirements.txt", [requirements])
+    assert cache.lookup(key)
+    requirements.write_text("a==2\n")
+    assert cache.key("pip install -r requirements.txt", [requirements], tmp_path) != key
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+
+def test_no_cache_flag_disables_caches(monkeypatch):
+    # restored after the test, apply_no_cache_argument sets os.environ itself
+    monkeypatch.setenv("CI_NO_CACHE", "")
+    parser = argparse.ArgumentParser()
+    add_no_cache_argument(parser)
+    apply_no_cache_argument(parser.parse_args([]))
+    assert not cache_disabled()
+    apply_no_cache_argument(parser.parse_args(["--no-cache"]))
+    assert cache_disabled() and not StepCache().enabled
+
+
+def test_run_skips_unchanged_step_within_ttl(tmp_path):
+    cache = StepCache(tmp_path / "cache", enabled=True)
+    dependencies = tmp_path / "dependencies.txt"
+    dependencies.write_text("cmake\n")
+    calls = []
+    assert not cache.run("install_dependencies linux", lambda: calls.append(1), [dependencies], ttl=60)
+    assert cache.run("install_dependencies linux", lambda: calls.append(1), [dependencies], ttl=60)
+    # expired entries and changed inputs run the step again
+    assert not cache.run("install_dependencies linux", lambda: calls.append(1), [dependencies], ttl=-1)
+    dependencies.write_text("cmake\nlz4\n")
+    assert not cache.run("install_dependencies linux", lambda: calls.append(1), [dependencies], ttl=60)
+    assert len(calls) == 3
+
+
+def test_run_does_not_record_failed_step(tmp_path):
+    cache = StepCache(tmp_path / "cache", enabled=True)
+
+    def fail():
+        raise subprocess.CalledProcessError(100, "apt install")
+
+    with pytest.raises(subprocess.CalledProcessError):
+        cache.run("apt install", fail)
+    assert not cache.run("apt install", lambda: None)
+
+
+def _miss_many(cache_dir, count):
+    cache = StepCache(cache_dir, enabled=True)
+    for i in range(count):
+        cache.lookup(f"missing-{i}")
+
+
+def test_stats_survive_concurrent_jobs(tmp_path):
+    jobs = [multiprocessing.Process(target=_miss_many, args=(str(tmp_path), 50)) for _ in range(4)]
+    for job in jobs:
+        job.start()
+    for job in jobs:
+        job.join()
+    assert StepCache(tmp_path, enabled=True).stats()["misses"] == 200
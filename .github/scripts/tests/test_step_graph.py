@@ -0,0 +1,43 @@
+import subprocess
+
+import pytest
+
+from step_graph import FAILED, SKIPPED, SUCCESS, StepGraph
+
+
+@pytest.fixture
+def graph(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return StepGraph(max_workers=4)
+
+
+def test_serial_steps_are_not_prefixed(graph, capfd):
+    graph.add("first", "echo one")
+    graph.add("second", "echo two", deps=["first"])
+    graph.run(summary=False)
+    out = capfd.readouterr().out
+    assert "one\n" in out and "two\n" in out
+    assert "[first]" not in out and "[second]" not in out
+
+
+def test_concurrent_steps_are_prefixed(graph, capfd):
+    graph.add("left", "sleep 0.2; echo left-out; sleep 0.5")
+    graph.add("right", "sleep 0.2; echo right-out; sleep 0.5")
+    graph.run(summary=False)
+    out = capfd.readouterr().out
+    assert "[left] left-out" in out
+    assert "[right] right-out" in out
+
+
+def test_failure_skips_dependents_only(graph):
+    graph.add("broken", "exit 1")
+    graph.add("after", "true", deps=["broken"])
+    graph.add("other", "true")
+    statuses = graph.run(check=False, summary=False)
+    assert statuses == {"broken": FAILED, "after": SKIPPED, "other": SUCCESS}
+
+
+def test_check_raises_the_step_timeout(graph):
+    graph.add("slow", "sleep 5", timeout=0.2)
+    with pytest.raises(subprocess.TimeoutExpired):
+        graph.run(summary=False)
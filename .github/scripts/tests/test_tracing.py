@@ -0,0 +1,35 @@
+import multiprocessing
+
+from async_utils import AsyncUtils
+from tracing import Tracer, load_events
+
+
+def test_async_commands_carry_rusage(tmp_path, monkeypatch):
+    trace = tmp_path / "trace.json"
+    monkeypatch.setenv("CI_TRACE_FILE", str(trace))
+    AsyncUtils().run_command("python3 -c 'sum(range(3000000))'", silent=True)
+    spans = [event for event in load_events(str(trace)) if event.get("cat") == "command"]
+    assert len(spans) == 1
+    assert spans[0]["args"]["exit_code"] == 0
+    assert spans[0]["args"]["user_cpu_s"] > 0 and spans[0]["args"]["peak_rss_kb"] > 0
+
+
+def _append_spans(path, ready):
+    tracer = Tracer(path)
+    ready.wait()
+    for i in range(20):
+        tracer.add_span(f"span-{i}", 0.0, 1.0)
+
+
+def test_concurrent_writers_open_the_array_once(tmp_path):
+    path = str(tmp_path / "trace.json")
+    ready = multiprocessing.Event()
+    jobs = [multiprocessing.Process(target=_append_spans, args=(path, ready)) for _ in range(8)]
+    for job in jobs:
+        job.start()
+    ready.set()
+    for job in jobs:
+        job.join()
+    with open(path, encoding="utf-8") as f:
+        assert f.read().count("[") == 1
+    assert len([event for event in load_events(path) if event["ph"] == "X"]) == 160
@@ -0,0 +1,58 @@
+import io
+import subprocess
+import sys
+import time
+
+import pytest
+
+from utils import Utils
+
+
+class _Stream(io.TextIOWrapper):
+    def __init__(self):
+        super().__init__(io.BytesIO(), encoding="utf-8")
+
+
+def test_echo_reaches_stream_without_explicit_flush(monkeypatch):
+    stream = _Stream()
+    monkeypatch.setattr(sys, "stdout", stream)
+    Utils()._echo(b"line\n", "stdout")
+    assert stream.buffer.getvalue() == b"line\n"
+
+
+def test_echo_keeps_order_with_printed_text(monkeypatch):
+    stream = _Stream()
+    monkeypatch.setattr(sys, "stdout", stream)
+    print("before")
+    Utils()._echo(b"raw\n", "stdout")
+    assert stream.buffer.getvalue() == b"before\nraw\n"
+
+
+def _alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # zombies wait for a reaper that may not exist in a container
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /proc")
+def test_stop_process_tree_without_process_table_reaches_grandchildren(monkeypatch):
+    # "bash -c" forks for the trailing wait, so sleep is a grandchild
+    proc = subprocess.Popen(
+        ["bash", "-c", "bash -c 'sleep 30 & echo $!; wait' & wait"],
+        stdout=subprocess.PIPE,
+        start_new_session=True,
+    )
+    grandchild = int(proc.stdout.readline())
+    utils = Utils()
+    # the macOS branch
+    monkeypatch.setattr(utils, "is_linux", False)
+    utils.stop_process_tree(proc.pid)
+    proc.wait(timeout=5)
+    proc.stdout.close()
+    deadline = time.time() + 5
+    while _alive(grandchild) and time.time() < deadline:
+        time.sleep(0.05)
+    assert not _alive(grandchild)
@@ -0,0 +1,75 @@
+import multiprocessing
+import os
+import subprocess
+import time
+
+from venv_cache import COMPLETE_MARKER, VenvCache
+
+
+class FakeUtils:
+    """Builds a fake venv layout and logs every build"""
+
+    def __init__(self, build_log):
+        self.build_log = build_log
+
+    def run_command(self, command, **kwargs):
+        if "-c" in command:
+            return subprocess.CompletedProcess(command, 0, stdout="3.9.18\n")
+        if command[1:3] == ["-m", "venv"]:
+            with open(self.build_log, "a") as f:
+                f.write(f"{os.getpid()}\n")
+            os.makedirs(os.path.join(command[3], "bin"), exist_ok=True)
+            # a slow build widens the window for a racing job
+            time.sleep(0.5)
+        return subprocess.CompletedProcess(command, 0, stdout="")
+
+
+def _ensure(root, requirements, build_log, results):
+    results.put(VenvCache(FakeUtils(build_log), root=root).ensure(requirements))
+
+
+def test_concurrent_jobs_build_once(tmp_path):
+    requirements = tmp_path / "requirements.txt"
+    requirements.write_text("pytest\n")
+    build_log = tmp_path / "builds.log"
+    results = multiprocessing.Queue()
+    jobs = [
+        multiprocessing.Process(target=_ensure, args=(str(tmp_path / "venvs"), str(requirements), str(build_log), results))
+        for _ in range(3)
+    ]
+    for job in jobs:
+        job.start()
+    for job in jobs:
+        job.join()
+    paths = {results.get() for _ in jobs}
+    assert len(paths) == 1
+    venv = paths.pop()
+    assert os.path.islink(venv)
+    assert os.path.exists(os.path.join(venv, COMPLETE_MARKER))
+    assert len(build_log.read_text().split()) == 1
+
+
+def test_incomplete_build_is_replaced(tmp_path):
+    requirements = tmp_path / "requirements.txt"
+    requirements.write_text("pytest\n")
+    build_log = tmp_path / "builds.log"
+    cache = VenvCache(FakeUtils(build_log), root=tmp_path / "venvs")
+    venv = cache.ensure(requirements)
+    first = os.path.realpath(venv)
+    os.remove(os.path.join(venv, COMPLETE_MARKER))
+    assert cache.ensure(requirements) == venv
+    assert os.path.realpath(venv) != first and not os.path.exists(first)
+
+
+def test_prune_keeps_recent_venvs(tmp_path):
+    build_log = tmp_path / "builds.log"
+    cache = VenvCache(FakeUtils(build_log), root=tmp_path / "venvs", keep=2)
+    venvs = []
+    for i in range(3):
+        requirements = tmp_path / f"requirements{i}.txt"
+        requirements.write_text(f"pkg{i}\n")
+        venvs.append(cache.ensure(requirements))
+        os.utime(os.path.join(venvs[-1], COMPLETE_MARKER), (i, i))
+    cache.prune()
+    assert [os.path.exists(v) for v in venvs] == [False, True, True]
+    assert len([name for name in os.listdir(tmp_path / "venvs") if not name.endswith(".lock")]) == 4
@@ -0,0 +1,189 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+_MAXRSS_DIVISOR = 1024 if sys.platform == "darwin" else 1
+
+
+def wait_with_rusage(proc):
+    """Reap `proc` with os.wait4 and return its rusage (None where unsupported).
+
+    The exit status is stored on proc.returncode, so a later proc.wait()
+    returns immediately.
+    """
+    if proc.returncode is not None or not hasattr(os, "wait4"):
+        proc.wait()
+        return None
+    try:
+        _, status, rusage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        proc.wait()
+        return None
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return rusage
+
+
+def poll_with_rusage(proc):
+    """Non-blocking wait_with_rusage: (True, rusage) once `proc` is reaped, (False, None) while it runs"""
+    if proc.returncode is not None or not hasattr(os, "wait4"):
+        return proc.poll() is not None, None
+    try:
+        pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+    except ChildProcessError:
+        proc.wait()
+        return True, None
+    if pid == 0:
+        return False, None
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return True, rusage
+
+
+class Tracer:
+    """Append per-command spans to a Chrome trace-event file.
+
+    The file uses the JSON Array Format, whose closing bracket is optional, so
+    prepare_test_env.py, build.py and test_runner.py of one job can all append
+    to the same file and it can be opened in chrome://tracing or Perfetto as
+    it is. `python3 tracing.py merge out.json a.json b.json` merges files
+    from several hosts into one. Tracing is enabled by setting CI_TRACE_FILE.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._process_named = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _append(self, events: List[Dict[str, Any]]) -> None:
+        data = "".join(json.dumps(event) + ",\n" for event in events)
+        parent = os.path.dirname(self.path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            # the size as of now, another process may have written since the open
+            if f.seek(0, os.SEEK_END) == 0:
+                data = "[\n" + data
+            f.write(data)
+
+    def _process_metadata(self) -> List[Dict[str, Any]]:
+        if self._process_named:
+            return []
+        self._process_named = True
+        return [{
+            "name": "process_name",
+            "ph": "M",
+            "pid": self.pid,
+            "args": {"name": os.path.basename(sys.argv[0]) or "python"},
+        }]
+
+    def add_span(
+        self,
+        name: str,
+        start: float,
+        end: float,
+        cat: str = "command",
+        args: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Record a complete event; `start`/`end` are time.time() values"""
+        if not self.enabled:
+            return
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": int(start * 1_000_000),
+            "dur": int(max(0.0, end - start) * 1_000_000),
+            "pid": self.pid,
+            "tid": threading.get_ident() % 1_000_000,
+            "args": args or {},
+        }
+        try:
+            self._append(self._process_metadata() + [event])
+        except OSError as e:
+            print(f"Failed to write trace event to {self.path}: {e}", file=sys.stderr)
+
+    def add_command(self, command, cwd, start: float, end: float, returncode, rusage=None) -> None:
+        """Record a run_command span with its exit code and child resource usage"""
+        if not self.enabled:
+            return
+        text = " ".join(map(str, command)) if isinstance(command, (list, tuple)) else str(command)
+        args = {"command": text, "cwd": str(cwd), "exit_code": returncode}
+        if rusage is not None:
+            args.update({
+                "user_cpu_s": round(rusage.ru_utime, 3),
+                "sys_cpu_s": round(rusage.ru_stime, 3),
+                "peak_rss_kb": rusage.ru_maxrss // _MAXRSS_DIVISOR,
+            })
+        self.add_span(text[:80], start, end, args=args)
+
+    @contextmanager
+    def span(self, name: str, cat: str = "step", **args):
+        """Trace a block of Python code"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.time(), cat=cat, args=args)
+
+
+_tracers: Dict[Optional[str], Tracer] = {}
+
+
+def get_tracer() -> Tracer:
+    """Tracer for the current CI_TRACE_FILE (read on each call, it may be set late)"""
+    path = os.getenv("CI_TRACE_FILE") or None
+    if path not in _tracers:
+        _tracers[path] = Tracer(path)
+    return _tracers[path]
+
+
+def load_events(path: str) -> List[Dict[str, Any]]:
+    """Read a trace file written by Tracer (or a complete JSON trace)"""
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read().strip()
+    if not content:
+        return []
+    if content.startswith("{"):
+        return json.loads(content).get("traceEvents", [])
+    if not content.endswith("]"):
+        content = content.rstrip(",") + "]"
+    return json.loads(content)
+
+
+def merge(output: str, inputs: List[str]) -> int:
+    events = []
+    for path in inputs:
+        events.extend(load_events(path))
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return len(events)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or sys.argv[1] != "merge":
+        print("Usage: python3 tracing.py merge <output.json> <trace.json> [trace.json ...]")
+        sys.exit(1)
+    count = merge(sys.argv[2], sys.argv[3:])
+    print(f"Merged {count} events into {sys.argv[2]}")
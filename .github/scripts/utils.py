@@ -3,12 +3,22 @@ import re
 import shlex
 import json
 import platform
+import signal
 import threading
 import subprocess
 import sys
+import time
 from pathlib import Path
 from typing import List, Union, Optional, Dict, Any
 
+from io_pump import OutputPump
+from log_sink import LogSinkFactory
+from output_capture import CAPTURE_FULL, new_capture
+from tracing import get_tracer
+from dep_planner import DependencyPlanner
+from step_cache import StepCache
+from proc_table import ProcessTable
+
 class Utils:
     """This class provides utility functions for common operations in steps of workflow"""
     def __init__(self):
@@ -22,9 +32,12 @@ class Utils:
         self.shell = True  # Use shell for cross-platform compatibility
         self.shell_exec = 'cmd.exe' if self.is_windows else '/bin/bash'
 
+        # Log sinks for command output (see log_sink.py for CI_LOG_* settings)
+        self.log_sinks = LogSinkFactory.from_env()
+
     def read_dependencies(self):
         """Get the dependencies of specified platform from dependencies.txt file"""
-        dependencies_file = os.path.join(os.path.dirname(__file__), "dependencies.txt")
+        dependencies_file = self.dependencies_file()
         dependencies = {"linux": [], "macOS": []}
 
         with open(dependencies_file, "r") as file:
@@ -40,21 +53,21 @@ class Utils:
 
         return dependencies
 
+    def dependencies_file(self) -> str:
+        return os.path.join(os.path.dirname(__file__), "dependencies.txt")
+
     def install_dependencies(self, platform: str = None):
-        """Install the dependencies based on the platform"""
-        dependencies = self.read_dependencies()
-        if platform == 'linux':
-            cmds = [
-                "sudo apt update -y",
-                f"sudo apt install -y {' '.join(dependencies['linux'])}"
-            ]
-            self.run_commands(cmds)
-        elif platform == 'macOS':
-            cmds = [
-                "brew update",
-                f"brew install {' '.join(dependencies['macOS'])}"
-            ]
-            self.run_commands(cmds)
+        """Install the missing dependencies based on the platform; skipped while
+        dependencies.txt is unchanged since the last install on this machine, at
+        most CI_DEPS_CACHE_TTL seconds (a day by default)"""
+        if platform in ('linux', 'macOS'):
+            dependencies = self.read_dependencies()
+            StepCache().run(
+                f"install_dependencies {platform}",
+                lambda: DependencyPlanner(self, platform).apply(dependencies[platform]),
+                inputs=[self.dependencies_file()],
+                ttl=float(os.getenv("CI_DEPS_CACHE_TTL", 24 * 3600)),
+            )
         elif self.is_windows:
             pass
 
@@ -139,36 +152,128 @@ class Utils:
     # --------------------------
     # Command Execution
     # --------------------------
-    def _stream_reader(self, stream, stream_type, silent=False, log_file=None):
-        """Thread function to read stream and print output or save to log."""
+    def _echo(self, data: bytes, stream_type: str) -> None:
+        """Pass raw output bytes through to our own stdout/stderr"""
+        target = sys.stderr if stream_type == "stderr" else sys.stdout
+        buffer = getattr(target, "buffer", None)
+        if buffer is not None:
+            # text printed before must come out ahead of these bytes
+            target.flush()
+            buffer.write(data)
+            # the binary layer has no line buffering, flush so echo is not delayed
+            buffer.flush()
+            return
         try:
-            for line in iter(stream.readline, b''):
+            target.write(data.decode('utf-8'))
+        except UnicodeDecodeError:
+            target.write(data.decode('latin-1'))
+
+    def _output_handler(self, stream_type, silent=False, log_sink=None, capture=None):
+        """Build the callback that logs, captures and echoes output chunks of one stream"""
+        def handle(data: bytes) -> None:
+            if log_sink:
+                log_sink.write(data)
+            if capture is not None:
+                capture.write(data)
+            if not silent:
+                self._echo(data, stream_type)
+        return handle
+
+    def _consumer_handler(self, handler, consumers, stop):
+        """Feed output to `consumers` after `handler`; call `stop` once one of them sets stop_reason"""
+        if not consumers:
+            return handler
+        stopped = []
+
+        def handle(data: bytes) -> None:
+            handler(data)
+            for consumer in consumers:
+                consumer.feed(data)
+                if consumer.stop_reason and not stopped:
+                    stopped.append(consumer.stop_reason)
+                    print(f"Stopping command: {consumer.stop_reason}", flush=True)
+                    # terminate in the background so output keeps being drained meanwhile
+                    threading.Thread(target=stop, daemon=True).start()
+        return handle
+
+    def stop_process_tree(self, pid: int, include_root: bool = True) -> None:
+        """Terminate the descendants of `pid` (and `pid` itself if include_root)"""
+        if self.is_windows:
+            if include_root:
+                subprocess.run(["taskkill", "/F", "/T", "/PID", str(pid)], capture_output=True)
+            return
+        # commands of run_command, AsyncUtils and ShellSession lead their own
+        # process group, which also holds descendants that were reparented
+        group = include_root and self._leads_group(pid)
+        if self.is_linux and ProcessTable.supported():
+            table = ProcessTable.snapshot()
+            pids = [proc.pid for proc in reversed(table.descendants(pid))]
+            ProcessTable.terminate(pids + ([pid] if include_root else []))
+        elif not group:
+            # no process table, walk the tree with pgrep (macOS)
+            pids = self._child_pids(pid)
+            for child in reversed(pids + ([pid] if include_root else [])):
                 try:
-                    decoded_line = line.decode('utf-8')  # Try decoding as UTF-8
-                except UnicodeDecodeError:
-                    decoded_line = line.decode('latin-1')  # Fallback to Latin-1
-
-                if decoded_line:
-                    if log_file:
-                        with open(log_file, 'a', encoding='utf-8') as f:
-                            f.write(decoded_line)
-                    if not silent:
-                        if stream_type == "stderr":
-                            print(decoded_line, end="", file=sys.stderr)
-                        else:
-                            print(decoded_line, end="")
+                    os.kill(child, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        if group:
+            try:
+                os.killpg(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    @staticmethod
+    def _leads_group(pid: int) -> bool:
+        try:
+            return os.getpgid(pid) == pid
+        except ProcessLookupError:
+            return False
+
+    @staticmethod
+    def _child_pids(pid: int) -> List[int]:
+        """Descendants of `pid`, parents before their children"""
+        result = []
+        pending = [pid]
+        while pending:
+            output = subprocess.run(["pgrep", "-P", str(pending.pop())], capture_output=True, text=True).stdout
+            children = [int(child) for child in output.split()]
+            result.extend(children)
+            pending.extend(children)
+        return result
+
+    def _stream_reader(self, stream, stream_type, handler):
+        """Thread function to read stream and pass each line to the output handler."""
+        try:
+            for line in iter(stream.readline, b''):
+                handler(line)
         except Exception as e:
             print(f"Error reading {stream_type}: {e}", file=sys.stderr)
         finally:
             stream.close()
 
+    def _prepare_command(self, command: Union[str, List[str]]):
+        """Return (proc_args, use_shell) for a command as run by run_command"""
+        if isinstance(command, list):
+            return [str(x) for x in command], False
+        cmd_str = str(command)
+        # Normalize forward/back slashes for Windows paths embedded in command
+        if self.is_windows:
+            cmd_str = cmd_str.replace('/', '\\')
+            # use cmd.exe to support "&&" in older PowerShell/cmd contexts
+            return ['cmd', '/c', cmd_str], False
+        return cmd_str, True  # allow shell features on POSIX
+
     def run_command(
         self,
         command: Union[str, List[str]],
         cwd: Optional[Union[str, Path]] = None,
         env: Optional[Dict[str, str]] = None,
         check: bool = True,
-        silent: bool = False
+        silent: bool = False,
+        log_name: Optional[str] = None,
+        capture: Optional[str] = None,
+        consumers: Optional[List[Any]] = None
     ) -> subprocess.CompletedProcess:
         """
         Execute a command cross-platform with real-time output and handle encoding issues.
@@ -176,26 +281,25 @@ class Utils:
         - If `command` is a str -> on Windows run via ['cmd','/c', cmd_str] (so "&&" works),
           on POSIX run with shell=True.
         - If cwd is None, use current working directory.
+        - Output is appended to stdout.log/stderr.log, or to per-command files
+          (optionally named by `log_name`) when CI_LOG_DIR is set.
+        - `capture="ring"` keeps the head and tail of stdout/stderr in bounded memory,
+          `capture="full"` keeps all of it; the text is set on the returned
+          CompletedProcess (and on CalledProcessError).
+        - `consumers` are fed every stdout chunk (`feed(data)`); once one sets
+          `stop_reason`, the command and its children are terminated.
         """
         cwd = str(self.path(cwd)) if cwd else os.getcwd()
         env_out = env or os.environ
 
-        if isinstance(command, list):
-            proc_args = [str(x) for x in command]
-            use_shell = False
-        else:
-            cmd_str = str(command)
-            # Normalize forward/back slashes for Windows paths embedded in command
-            if self.is_windows:
-                cmd_str = cmd_str.replace('/', '\\')
-                # use cmd.exe to support "&&" in older PowerShell/cmd contexts
-                proc_args = ['cmd', '/c', cmd_str]
-                use_shell = False
-            else:
-                proc_args = cmd_str
-                use_shell = True  # allow shell features on POSIX
+        proc_args, use_shell = self._prepare_command(command)
 
         print(f"Running command: {proc_args} (cwd={cwd})")
+        # flush pending text before raw bytes are echoed through the buffers
+        sys.stdout.flush()
+        sys.stderr.flush()
+        start = time.time()
+        rusage = None
         proc = subprocess.Popen(
             proc_args,
             cwd=cwd,
@@ -203,32 +307,89 @@ class Utils:
             shell=use_shell,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=False  # Disable text mode to handle raw bytes
+            text=False,  # Disable text mode to handle raw bytes
+            # own process group, stop_process_tree reaches everything it starts
+            start_new_session=not self.is_windows,
         )
 
-        stdout_thread = threading.Thread(target=self._stream_reader, args=(proc.stdout, "stdout", silent, "stdout.log"))
-        stderr_thread = threading.Thread(target=self._stream_reader, args=(proc.stderr, "stderr", silent, "stderr.log"))
+        stdout_sink, stderr_sink = self.log_sinks.open_for(proc_args, log_name)
+        stdout_capture, stderr_capture = new_capture(capture), new_capture(capture)
+        on_stdout = self._consumer_handler(
+            self._output_handler("stdout", silent, stdout_sink, stdout_capture),
+            consumers,
+            lambda: self.stop_process_tree(proc.pid),
+        )
+        on_stderr = self._output_handler("stderr", silent, stderr_sink, stderr_capture)
+        try:
+            if self.is_windows:
+                # Windows pipes are not selectable, keep one reader thread per stream
+                stdout_thread = threading.Thread(target=self._stream_reader, args=(proc.stdout, "stdout", on_stdout))
+                stderr_thread = threading.Thread(target=self._stream_reader, args=(proc.stderr, "stderr", on_stderr))
 
-        stdout_thread.start()
-        stderr_thread.start()
-        stdout_thread.join()
-        stderr_thread.join()
+                stdout_thread.start()
+                stderr_thread.start()
+                stdout_thread.join()
+                stderr_thread.join()
+            else:
+                with OutputPump() as pump:
+                    pump.add(proc, on_stdout=on_stdout, on_stderr=on_stderr)
+                    pump.run()
+                    rusage = pump.rusage.get(proc)
 
-        proc.wait()
+            proc.wait()
+        finally:
+            stdout_sink.close()
+            stderr_sink.close()
+            if not silent:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            get_tracer().add_command(proc_args, cwd, start, time.time(), proc.returncode, rusage)
 
+        stdout = stdout_capture.getvalue() if stdout_capture else None
+        stderr = stderr_capture.getvalue() if stderr_capture else None
         if check and proc.returncode != 0:
-            raise subprocess.CalledProcessError(proc.returncode, proc_args)
+            raise subprocess.CalledProcessError(proc.returncode, proc_args, output=stdout, stderr=stderr)
 
-        return subprocess.CompletedProcess(args=proc_args, returncode=proc.returncode)
+        return subprocess.CompletedProcess(args=proc_args, returncode=proc.returncode, stdout=stdout, stderr=stderr)
 
-    def run_commands(self, commands: List[Union[str, List[str], tuple]], cwd: Optional[Union[str, Path]] = None) -> None:
+    def run_commands(
+        self,
+        commands: List[Union[str, List[str], tuple]],
+        cwd: Optional[Union[str, Path]] = None,
+        persistent_shell: bool = False,
+        consumers: Optional[List[Any]] = None
+    ) -> None:
         """
         Run multiple commands.
         Supports items:
           - "cd <path> && git reset --hard"         -> will extract path and run command in that cwd
           - ("git reset --hard", "/path/to/repo")   -> explicit (cmd, cwd)
           - ['git','reset','--hard']                -> list form
+        With `persistent_shell` (POSIX only) all commands run in one ShellSession,
+        so `export`/`cd`/`source` in one entry are still in effect for the next.
+        `consumers` are passed on to every command (see run_command).
         """
+        if persistent_shell and not self.is_windows:
+            from shell_session import ShellSession
+            with ShellSession(self) as session:
+                for item_cmd, item_cwd in self._iter_command_items(commands, cwd):
+                    session.run(item_cmd, cwd=item_cwd, consumers=consumers)
+            return
+
+        for item_cmd, item_cwd in self._iter_command_items(commands, cwd):
+            # If cmd is simple and can be split safely, prefer list form on Windows
+            if self.is_windows and isinstance(item_cmd, str):
+                # try simple split, fallback to string (cmd /c handled in run_command)
+                try:
+                    cmd_list = shlex.split(item_cmd, posix=False)
+                except Exception:
+                    cmd_list = item_cmd
+                self.run_command(cmd_list, cwd=item_cwd, consumers=consumers)
+            else:
+                self.run_command(item_cmd, cwd=item_cwd, consumers=consumers)
+
+    def _iter_command_items(self, commands, cwd):
+        """Yield (cmd, cwd) for each run_commands item"""
         cd_pattern = re.compile(r'^\s*cd\s+("([^"]+)"|\'([^\']+)\'|([^&;]+))\s*&&\s*(.+)$', flags=re.I)
         for item in commands:
             item_cwd = cwd
@@ -242,34 +403,38 @@ class Utils:
                     path = m.group(2) or m.group(3) or m.group(4)
                     item_cwd = path.strip()
                     cmd = m.group(5).strip()
-            
-            # If cmd is simple and can be split safely, prefer list form on Windows
-            if self.is_windows and isinstance(cmd, str):
-                # try simple split, fallback to string (cmd /c handled in run_command)
-                try:
-                    cmd_list = shlex.split(cmd, posix=False)
-                except Exception:
-                    cmd_list = cmd
-                self.run_command(cmd_list, cwd=item_cwd)
-            else:
-                self.run_command(cmd, cwd=item_cwd)
+            yield cmd, item_cwd
 
     # --------------------------
     # Process Management
     # --------------------------
-    def kill_process(self, process_name: str) -> None:
-        """Kill processes by name (cross-platform)"""
+    def kill_process(self, process_name: str, job_only: bool = False) -> None:
+        """Kill processes by name (cross-platform).
+        On linux the /proc table is used and survivors of SIGTERM get SIGKILL;
+        with `job_only` only processes started by this job are touched."""
         if self.is_windows:
             self.run_command(f"taskkill /F /IM {process_name}", check=False)
+        elif ProcessTable.supported():
+            table = ProcessTable.snapshot()
+            matched = {proc.pid for proc in table.find(cmdline=process_name)}
+            # /proc/<pid>/comm is truncated to 15 characters, as with killall
+            matched |= {proc.pid for proc in table.find(name=process_name[:15])}
+            if job_only:
+                matched &= {proc.pid for proc in table.job_processes()}
+            print(f"Killing {len(matched)} '{process_name}' processes: {sorted(matched)}")
+            ProcessTable.terminate(matched)
         else:
             self.run_command(f"pkill -f {process_name}", check=False)
             self.run_command(f"killall {process_name}", check=False)
 
     def process_exists(self, process_name: str) -> bool:
+        """True if a process command line matches `process_name`, a regex as with pgrep -f"""
         if self.is_windows:
-            result = self.run_command(f'tasklist /FI "IMAGENAME eq {process_name}"', check=False, silent=True)
+            result = self.run_command(f'tasklist /FI "IMAGENAME eq {process_name}"', check=False, silent=True, capture=CAPTURE_FULL)
             stdout = (result.stdout or "").lower()
             return process_name.lower() in stdout
+        elif ProcessTable.supported():
+            return bool(ProcessTable.snapshot().find(cmdline=process_name))
         else:
             result = self.run_command(f'pgrep -f "{process_name}"', check=False, silent=True)
-            return result.returncode == 0
\ No newline at end of file
+            return result.returncode == 0
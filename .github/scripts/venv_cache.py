@@ -0,0 +1,118 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from output_capture import CAPTURE_FULL
+from step_cache import cache_disabled, file_digest
+
+DEFAULT_VENV_ROOT = os.path.join(os.path.expanduser("~"), ".cache", "taos-ci", "venvs")
+# written last, a venv without it was interrupted while being built
+COMPLETE_MARKER = ".ci-complete"
+
+
+class VenvCache:
+    """Virtualenvs keyed by requirements.txt content and interpreter version.
+
+    A venv is built once per key under CI_VENV_ROOT (~/.cache/taos-ci/venvs)
+    and reused by every later run; a changed requirements.txt or a new
+    Python gets a fresh venv next to the old ones:
+
+        venv = VenvCache(utils, "python3.9").ensure(f"{test_dir}/requirements.txt")
+        utils.run_command(f"source {venv}/bin/activate && pytest ...")
+
+    Venvs are not relocatable, so each is built in its own directory and
+    marked complete at the end; the key path is a symlink that is swapped to
+    a complete build with os.replace. Only one job builds a key at a time
+    (flock on <key>.lock); the others wait and reuse its venv. With
+    CI_NO_CACHE=1 (--no-cache) the venv is always rebuilt.
+    """
+
+    def __init__(self, utils, python: str = "python3", root: Optional[Union[str, Path]] = None, keep: int = 3):
+        self.utils = utils
+        self.python = python
+        self.root = str(root or os.getenv("CI_VENV_ROOT") or DEFAULT_VENV_ROOT)
+        # venvs kept per root, least recently used ones beyond this are removed
+        self.keep = keep
+
+    def python_version(self) -> str:
+        result = self.utils.run_command(
+            [self.python, "-c", "import sys; print(sys.version)"],
+            silent=True,
+            capture=CAPTURE_FULL,
+        )
+        return (result.stdout or "").strip()
+
+    def key(self, requirements: Union[str, Path]) -> str:
+        digest = hashlib.sha256()
+        digest.update(file_digest(requirements).encode())
+        digest.update(f"\0{self.python}\0{self.python_version()}".encode())
+        return digest.hexdigest()[:16]
+
+    def _reuse(self, venv: str, requirements) -> bool:
+        marker = os.path.join(venv, COMPLETE_MARKER)
+        if cache_disabled() or not os.path.exists(marker):
+            return False
+        print(f"Reuse venv {venv} for {requirements}")
+        os.utime(marker)
+        return True
+
+    def ensure(self, requirements: Union[str, Path]) -> str:
+        """Return the path of a complete venv for `requirements`, building it if needed"""
+        venv = os.path.join(self.root, self.key(requirements))
+        if self._reuse(venv, requirements):
+            return venv
+
+        os.makedirs(self.root, exist_ok=True)
+        with open(f"{venv}.lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # whoever held the lock before may have built it meanwhile
+            if self._reuse(venv, requirements):
+                return venv
+            build = tempfile.mkdtemp(prefix=f"{os.path.basename(venv)}.", dir=self.root)
+            print(f"Build venv {venv} for {requirements} in {build}")
+            self.utils.run_command([self.python, "-m", "venv", build])
+            pip = os.path.join(build, "bin", "pip")
+            self.utils.run_command([pip, "install", "--upgrade", "pip"])
+            self.utils.run_command([pip, "install", "-r", str(requirements)])
+            with open(os.path.join(build, COMPLETE_MARKER), "w", encoding="utf-8") as f:
+                f.write(f"{requirements}\n")
+            self._publish(venv, build)
+        self.prune()
+        return venv
+
+    def _publish(self, venv: str, build: str) -> None:
+        """Point the key symlink at `build`; called with the key's lock held"""
+        previous = os.path.realpath(venv) if os.path.islink(venv) else None
+        if os.path.isdir(venv) and not os.path.islink(venv):
+            # incomplete venv built in place by an older version of this class
+            shutil.rmtree(venv)
+        tmp_link = f"{venv}.{os.getpid()}.tmp"
+        os.symlink(os.path.basename(build), tmp_link)
+        os.replace(tmp_link, venv)
+        if previous and previous != os.path.realpath(build):
+            # the previous build never got its marker, nobody uses it
+            shutil.rmtree(previous, ignore_errors=True)
+
+    def prune(self) -> None:
+        """Remove the least recently used venvs beyond `keep`"""
+        venvs = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            marker = os.path.join(path, COMPLETE_MARKER)
+            # keys are symlinks, their build directories are not counted twice
+            if os.path.islink(path) and os.path.exists(marker):
+                venvs.append((os.path.getmtime(marker), path))
+        for _, path in sorted(venvs, reverse=True)[self.keep:]:
+            print(f"Remove unused venv {path}")
+            build = os.path.realpath(path)
+            os.remove(path)
+            shutil.rmtree(build, ignore_errors=True)
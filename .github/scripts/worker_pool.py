@@ -0,0 +1,59 @@
+import asyncio
+import subprocess
+from typing import Callable, List, Tuple, Union
+
+from async_utils import AsyncUtils, CommandSpec
+
+
+class WorkerPool:
+    """Run jobs on a fixed number of exclusive worker slots.
+
+    Unlike AsyncUtils.gather, which only bounds concurrency, every job gets
+    the index of a free worker and keeps it until it ends, so jobs can use
+    per-worker resources (work dir, ports) without colliding:
+
+        pool = WorkerPool(AsyncUtils(), workers=3)
+        results = pool.run([(case, lambda worker, case=case: spec_for(case, worker)) for case in cases])
+
+    Each job builds its CommandSpec from the worker index; jobs are handed
+    out in order as workers become free. A failing job does not stop the
+    others, its exception is returned in its place.
+    """
+
+    def __init__(self, async_utils: AsyncUtils, workers: int = 1):
+        self.async_utils = async_utils
+        self.workers = max(1, workers)
+
+    async def gather(
+        self, jobs: List[Tuple[str, Callable[[int], CommandSpec]]]
+    ) -> List[Union[subprocess.CompletedProcess, BaseException]]:
+        free: asyncio.Queue = asyncio.Queue()
+        for worker in range(min(self.workers, len(jobs)) or 1):
+            free.put_nowait(worker)
+
+        async def run_one(name: str, make_spec: Callable[[int], CommandSpec]):
+            worker = await free.get()
+            try:
+                spec = make_spec(worker)
+                print(f"Worker {worker}: {name}")
+                return await self.async_utils.run_command_async(
+                    spec.command,
+                    cwd=spec.cwd,
+                    env=spec.env,
+                    check=spec.check,
+                    silent=spec.silent,
+                    timeout=spec.timeout,
+                    log_name=spec.log_name,
+                    label=spec.label or f"w{worker}",
+                    capture=spec.capture,
+                )
+            finally:
+                free.put_nowait(worker)
+
+        return await asyncio.gather(*(run_one(name, make_spec) for name, make_spec in jobs), return_exceptions=True)
+
+    def run(
+        self, jobs: List[Tuple[str, Callable[[int], CommandSpec]]]
+    ) -> List[Union[subprocess.CompletedProcess, BaseException]]:
+        """Synchronous facade of gather, results in job order"""
+        return asyncio.run(self.gather(jobs))